@@ -0,0 +1,189 @@
+import polars as pl
+import numpy as np
+import os
+import sys
+import threading
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.entities.ndc_dictionary import load_ndc_dictionary, NDC_ID_DTYPE
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+ENTITY_MAP_FILE = "ndc_entity_map.parquet"
+# entity_lookup/codes.npy: int32 [len(ATTRIBUTES), max ndc_id + 1], column = ndc_id,
+# -1 = unknown (one contiguous row per attribute, so a gather reads one row);
+# entity_lookup/values.parquet: (attribute, code, value).
+LOOKUP_DIR = "entity_lookup"
+CODES_FILE = "codes.npy"
+VALUES_FILE = "values.parquet"
+ATTRIBUTES = ["drug_description", "ingredient", "manufacturer", "labeler_id"]
+
+
+def lookup_root(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, LOOKUP_DIR)
+
+
+def lookup_signature(processed_path=PROCESSED_DATA_PATH):
+    """
+    (mtime, inode) of the lookup files. os.replace gives a rewritten file a
+    new inode, so a rebuild by another process changes this even when the
+    mtime resolution would hide it.
+    """
+    root = lookup_root(processed_path)
+    signature = []
+    for name in (CODES_FILE, VALUES_FILE):
+        stat = os.stat(os.path.join(root, name))
+        signature += [stat.st_mtime_ns, stat.st_ino]
+    return tuple(signature)
+
+
+def write_entity_lookup(processed_path=PROCESSED_DATA_PATH):
+    """
+    Rebuilds the lookup from ndc_entity_map.parquet. Every attribute is
+    dictionary-encoded; since ndc_id is dense, the codes are a plain array
+    indexed by ndc_id, so a lookup is an array gather instead of a join.
+    """
+    entity_map = (
+        pl.read_parquet(os.path.join(processed_path, ENTITY_MAP_FILE), columns=["ndc_id"] + ATTRIBUTES)
+        .unique(subset=["ndc_id"], keep="first", maintain_order=True)
+    )
+    ids = entity_map["ndc_id"].cast(pl.Int64).to_numpy()
+    size = int(ids.max()) + 1 if len(ids) else 0
+
+    codes = np.full((len(ATTRIBUTES), size), -1, dtype=np.int32)
+    values = []
+    for position, attribute in enumerate(ATTRIBUTES):
+        column = entity_map[attribute].cast(pl.Utf8)
+        categories = column.drop_nulls().unique(maintain_order=True)
+        codes[position, ids] = (
+            column.replace_strict(categories, pl.int_range(categories.len(), eager=True),
+                                  default=-1, return_dtype=pl.Int32)
+            .to_numpy()
+        )
+        values.append(pl.DataFrame({
+            "attribute": attribute,
+            "code": pl.int_range(categories.len(), dtype=pl.Int32, eager=True),
+            "value": categories,
+        }))
+
+    root = lookup_root(processed_path)
+    os.makedirs(root, exist_ok=True)
+    # Written to temp names and swapped in, so readers never map a torn file
+    np.save(os.path.join(root, f".{CODES_FILE}"), codes)
+    pl.concat(values).write_parquet(os.path.join(root, f".{VALUES_FILE}"))
+    os.replace(os.path.join(root, f".{CODES_FILE}"), os.path.join(root, CODES_FILE))
+    os.replace(os.path.join(root, f".{VALUES_FILE}"), os.path.join(root, VALUES_FILE))
+    print(f"   🗃️  Entity lookup: {entity_map.height:,} NDCs "
+          f"({codes.nbytes / 1e6:.1f} MB codes) -> {root}")
+
+
+class EntityLookup:
+    """
+    Read-only ndc_id -> (description, ingredient, manufacturer, labeler) table.
+    The code array is memory-mapped, so processes share the OS page cache
+    instead of each re-reading the entity map.
+    """
+
+    def __init__(self, processed_path=PROCESSED_DATA_PATH):
+        root = lookup_root(processed_path)
+        self.processed_path = processed_path
+        # Taken before reading: a file swapped in meanwhile only triggers one more reload
+        self.signature = lookup_signature(processed_path)
+        self.codes = np.load(os.path.join(root, CODES_FILE), mmap_mode="r")
+        values = pl.read_parquet(os.path.join(root, VALUES_FILE))
+        # Each value table ends with a null, so code -1 (and unknown ids) gather to null
+        self.values = {
+            attribute: pl.concat([
+                values.filter(pl.col("attribute") == attribute).sort("code")["value"],
+                pl.Series("value", [None], dtype=pl.Utf8),
+            ])
+            for attribute in ATTRIBUTES
+        }
+        self._dictionary = None
+
+    def __len__(self):
+        return self.codes.shape[1]
+
+    def lookup(self, ndc_ids, attributes=None) -> pl.DataFrame:
+        """
+        Batched lookup; the result is aligned with `ndc_ids` (nulls for unknown ids).
+
+        Args:
+            ndc_ids: Series/array/list of ndc_id values.
+            attributes (list): Subset of ATTRIBUTES (default: all).
+        """
+        attributes = attributes or ATTRIBUTES
+        ids = pl.Series("ndc_id", ndc_ids).cast(pl.Int64, strict=False)
+        raw = ids.fill_null(-1).to_numpy()
+        known = (raw >= 0) & (raw < len(self))
+        rows = np.where(known, raw, 0)
+
+        codes = {}
+        for attribute in attributes:
+            null_code = self.values[attribute].len() - 1
+            if len(self):
+                found = self.codes[ATTRIBUTES.index(attribute)][rows]
+                codes[attribute] = np.where(known & (found >= 0), found, null_code)
+            else:
+                codes[attribute] = np.full(len(raw), null_code)
+
+        # One select, so the per-attribute string gathers run in parallel
+        return pl.DataFrame(codes).select(
+            ids.cast(NDC_ID_DTYPE, strict=False),
+            *[pl.lit(self.values[a]).gather(pl.col(a)).alias(a) for a in attributes],
+        )
+
+    def lookup_ndc11(self, ndc11_values, attributes=None) -> pl.DataFrame:
+        """Same as lookup(), keyed by ndc11 strings via the NDC dictionary."""
+        if self._dictionary is None:
+            self._dictionary = load_ndc_dictionary(self.processed_path)
+        ndc11 = pl.DataFrame({"ndc11": ndc11_values}, schema={"ndc11": pl.Utf8})
+        ids = ndc11.join(self._dictionary, on="ndc11", how="left", maintain_order="left")["ndc_id"]
+        return ndc11.hstack(self.lookup(ids, attributes).drop("ndc_id"))
+
+    def attach(self, frame, attributes=None):
+        """
+        Adds the requested attributes (default: all) that `frame` does not
+        already have, gathered by its ndc_id column.
+        """
+        wanted = [a for a in (attributes or ATTRIBUTES) if a not in frame.columns]
+        if not wanted:
+            return frame
+        found = self.lookup(frame["ndc_id"], wanted).drop("ndc_id")
+        return frame.hstack(found)
+
+    def table(self, attributes=None) -> pl.DataFrame:
+        """All known NDCs as a DataFrame (ndc_id + attributes)."""
+        ids = np.flatnonzero((np.asarray(self.codes) >= 0).any(axis=0))
+        return self.lookup(ids, attributes)
+
+
+_lookups = {}
+_lookups_lock = threading.Lock()
+
+
+def get_entity_lookup(processed_path=PROCESSED_DATA_PATH) -> EntityLookup:
+    """
+    Process-wide lookup per processed_path, rebuilt from the entity map when
+    that is newer, and reloaded when the lookup files were rewritten (e.g.
+    by map_builder in another process). Raises FileNotFoundError if the
+    entity map was never built.
+    """
+    map_path = os.path.join(processed_path, ENTITY_MAP_FILE)
+    codes_path = os.path.join(lookup_root(processed_path), CODES_FILE)
+    with _lookups_lock:
+        if not os.path.exists(map_path):
+            raise FileNotFoundError(f"Entity map not found at {map_path}")
+        stale = (not os.path.exists(codes_path)
+                 or os.path.getmtime(codes_path) < os.path.getmtime(map_path))
+        if stale:
+            write_entity_lookup(processed_path)
+        cached = _lookups.get(processed_path)
+        if cached is None or cached.signature != lookup_signature(processed_path):
+            _lookups[processed_path] = EntityLookup(processed_path)
+        return _lookups[processed_path]
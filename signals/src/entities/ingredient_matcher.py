@@ -0,0 +1,155 @@
+import polars as pl
+import os
+import hashlib
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+NDC_DIRECTORY_FILE = "ndc_directory.parquet"
+VOCABULARY_FILE = "ingredient_vocabulary.parquet"
+MIN_TERM_CHARS = 3  # shorter ingredient names match too much ordinary text
+EXCLUDED_TERMS = {"UNKNOWN"}
+
+
+def normalize_description(expr):
+    """
+    Upper-case, punctuation to spaces, single-spaced and space-padded, so a
+    padded pattern (" SODIUM CHLORIDE ") only matches whole words.
+    "Hydrocodone-Acetaminophen 5/325" -> " HYDROCODONE ACETAMINOPHEN 5 325 "
+    """
+    text = (
+        expr.str.to_uppercase()
+        .str.replace_all(r"[^A-Z0-9]+", " ")
+        .str.strip_chars()
+    )
+    return pl.concat_str([pl.lit(" "), text, pl.lit(" ")])
+
+
+def build_ingredient_vocabulary(directory):
+    """
+    ndc_directory rows -> distinct normalized ingredient terms, longest first.
+    Takes every active ingredient (`ingredient_names`), not only the first
+    one, so both halves of a combination product are terms; directories
+    written before that column existed fall back to `ingredient_name`.
+    """
+    directory = directory.lazy()
+    names = [pl.col("ingredient_name")]
+    if "ingredient_names" in directory.collect_schema().names():
+        names.append(pl.col("ingredient_names").explode(empty_as_null=True))
+    return (
+        pl.concat([directory.select(name.alias("name")) for name in names])
+        .select(normalize_description(pl.col("name")).str.strip_chars().alias("term"))
+        .drop_nulls()
+        .filter(
+            (pl.col("term").str.len_chars() >= MIN_TERM_CHARS)
+            & ~pl.col("term").is_in(list(EXCLUDED_TERMS))
+        )
+        .unique()
+        .sort([pl.col("term").str.len_chars(), "term"], descending=[True, False])
+        .collect()
+    )
+
+
+def write_ingredient_vocabulary(processed_path=PROCESSED_DATA_PATH):
+    """Rebuilds ingredient_vocabulary.parquet from ndc_directory.parquet."""
+    directory = pl.scan_parquet(os.path.join(processed_path, NDC_DIRECTORY_FILE))
+    vocabulary = build_ingredient_vocabulary(directory)
+    output_path = os.path.join(processed_path, VOCABULARY_FILE)
+    vocabulary.write_parquet(output_path)
+    print(f"   🧪 Ingredient vocabulary: {vocabulary.height:,} terms -> {output_path}")
+    return vocabulary
+
+
+def load_ingredient_vocabulary(processed_path=PROCESSED_DATA_PATH):
+    """Reads the vocabulary, building it from the directory if it is missing or stale."""
+    vocabulary_path = os.path.join(processed_path, VOCABULARY_FILE)
+    directory_path = os.path.join(processed_path, NDC_DIRECTORY_FILE)
+    if (not os.path.exists(vocabulary_path)
+            or os.path.getmtime(vocabulary_path) < os.path.getmtime(directory_path)):
+        return write_ingredient_vocabulary(processed_path)
+    return pl.read_parquet(vocabulary_path)
+
+
+def vocabulary_hash(vocabulary):
+    """Fingerprint of the term list (map_builder re-tags descriptions when it changes)."""
+    return hashlib.sha256("\n".join(vocabulary["term"].to_list()).encode("utf-8")).hexdigest()
+
+
+def tag_ingredients(frame, column, vocabulary):
+    """
+    Adds `ingredient_matches` (every matched term that doesn't overlap a
+    longer match, in text order; "HYDROCODONE-ACETAMINOPHEN" gives both) and
+    `ingredient_match` (the longest; the first one on ties), so "SODIUM
+    CHLORIDE" wins over the "SODIUM" inside it.
+
+    One Aho-Corasick pass (str.extract_many, overlapping) finds all term
+    occurrences; overlapped hits are then dropped with a self-join on the
+    row, so no Python runs per row.
+    """
+    lazy = isinstance(frame, pl.LazyFrame)
+    frame = frame.lazy().with_row_index("_row")
+    patterns = [f" {t} " for t in vocabulary["term"].to_list()]
+
+    if not patterns:
+        tags = frame.select("_row").with_columns(
+            pl.lit([], dtype=pl.List(pl.Utf8)).alias("ingredient_matches"),
+            pl.lit(None, dtype=pl.Utf8).alias("ingredient_match"),
+        )
+    else:
+        text = normalize_description(pl.col(column))
+        hits = (
+            frame.select(
+                "_row",
+                text.alias("_text"),
+                text.str.extract_many(patterns, overlapping=True).alias("_hit"),
+            )
+            .explode("_hit", empty_as_null=True)
+            .drop_nulls("_hit")
+            .unique(subset=["_row", "_hit"], maintain_order=True)
+            .with_columns(
+                pl.col("_text").str.find(pl.col("_hit"), literal=True).alias("_at"),
+                pl.col("_hit").str.len_chars().alias("_len"),
+            )
+            .drop("_text")
+        )
+        # A hit loses to an overlapping longer one (or an equal one further
+        # left); spans exclude the padding spaces, which adjacent hits share
+        overlapped = (
+            hits.join(hits, on="_row", suffix="_outer")
+            .filter(
+                (pl.col("_at") + 1 < pl.col("_at_outer") + pl.col("_len_outer") - 1)
+                & (pl.col("_at_outer") + 1 < pl.col("_at") + pl.col("_len") - 1)
+                & ((pl.col("_len_outer") > pl.col("_len"))
+                   | ((pl.col("_len_outer") == pl.col("_len")) & (pl.col("_at_outer") < pl.col("_at"))))
+            )
+            .select("_row", "_hit")
+        )
+        tags = (
+            hits.join(overlapped, on=["_row", "_hit"], how="anti")
+            .sort(["_row", "_at"])
+            .group_by("_row", maintain_order=True)
+            .agg(
+                pl.col("_hit").str.strip_chars().alias("ingredient_matches"),
+                pl.col("_hit").sort_by("_len", descending=True, maintain_order=True)
+                  .first().str.strip_chars().alias("ingredient_match"),
+            )
+        )
+
+    tagged = (
+        frame.join(tags, on="_row", how="left", maintain_order="left")
+        .with_columns(pl.col("ingredient_matches").fill_null(pl.lit([], dtype=pl.List(pl.Utf8))))
+        .drop("_row")
+    )
+    return tagged if lazy else tagged.collect()
+
+
+def match_ingredient(values, vocabulary):
+    """
+    Distinct text values -> {value, ingredient_match, ingredient_matches} lookup. Tag the
+    distinct values once and join the lookup back, instead of tagging every
+    row of a long table.
+    """
+    distinct = pl.DataFrame({"value": values}, schema={"value": pl.Utf8}).unique().drop_nulls()
+    return tag_ingredients(distinct, "value", vocabulary).select(
+        "value", "ingredient_match", "ingredient_matches")
@@ -1,88 +1,207 @@
 import polars as pl
 import os
 import re
+import sys
+import json
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.nadac_store import scan_nadac_history
+from src.entities.ndc_index import load_ndc_index, ndc11_key
+from src.entities.ingredient_matcher import load_ingredient_vocabulary, match_ingredient, vocabulary_hash
+from src.entities.entity_lookup import write_entity_lookup
 
 # ==========================================
 # CONFIGURATION
 # ==========================================
 PROCESSED_DATA_PATH = "data/processed"
-NADAC_FILE = os.path.join(PROCESSED_DATA_PATH, "nadac_history.parquet")
-NDC_DIR_FILE = os.path.join(PROCESSED_DATA_PATH, "ndc_directory.parquet")
+NDC_DIR_FILE = "ndc_directory.parquet"
+ENTITY_MAP_FILE = "ndc_entity_map.parquet"
+# Incremental mode: hashes of the directory rows and NADAC descriptions NDCs
+# were resolved from, and the ingredient vocabulary the map was built with.
+MAP_INPUTS_FILE = "ndc_entity_map_inputs.parquet"
+MAP_VOCABULARY_FILE = "ndc_entity_map_vocabulary.parquet"
+MAP_STATE_FILE = "ndc_entity_map_state.json"
+NADAC_COLUMNS = ["ndc_id", "ndc11", "drug_description"]
 
 
-def build_entity_map():
-    print("🚀 Starting Entity Map Construction (Smart Fallback Mode)...")
-
-    # 1. Load Data
-    try:
-        # We need 'drug_description' from NADAC for the text mining fallback
-        nadac_df = pl.read_parquet(NADAC_FILE).select(
-            ["ndc11", "drug_description"]).unique()
-        fda_df = pl.read_parquet(NDC_DIR_FILE)
-    except Exception as e:
-        print(f"   ❌ Error loading files: {e}")
-        return
+def link_keys(nadac_df):
+    """
+    Integer link keys. The normalization index already holds every product
+    NDC (4-4, 5-3, 5-4) as its canonical 9-digit product_key; NADAC's ndc11
+    just divides down.
+    """
+    return nadac_df.with_columns(
+        ndc11_key(pl.col("ndc11")).alias("ndc11_key")
+    ).with_columns([
+        (pl.col("ndc11_key") // 100).alias("product_key"),
+        (pl.col("ndc11_key") // 1_000_000).alias("labeler_key"),
+        pl.col("ndc11").str.slice(0, 5).alias("labeler_code_5"),
+    ])
 
-    # 2. Prepare Link Keys (9-digit)
-    print("   🔗 Generating Link Keys...")
 
-    nadac_map = nadac_df.with_columns([
-        pl.col("ndc11").str.slice(0, 9).alias("match_key_9"),
-        pl.col("ndc11").str.slice(0, 5).alias(
-            "labeler_code_5")  # Extract Labeler (First 5)
-    ])
+def directory_lookups(fda_df, ndc_index):
+    """
+    Directory -> (package lookup on ndc11_key, product lookup on product_key,
+    labeler fallback on labeler_key). The package lookup is exact: it takes
+    the directory row that lists the package, where a product_ndc listed
+    twice would otherwise resolve to whichever row came first.
+    """
+    if "package_ndcs" in fda_df.columns:
+        listed = (
+            fda_df.select(["product_ndc", "package_ndcs", "manufacturer_simple", "ingredient_name"])
+            .explode("package_ndcs", empty_as_null=True)
+            .rename({"package_ndcs": "package_ndc"})
+        )
+    else:  # Directory written before package NDCs were kept
+        listed = pl.DataFrame(schema={
+            "product_ndc": pl.Utf8, "package_ndc": pl.Utf8,
+            "manufacturer_simple": pl.Utf8, "ingredient_name": pl.Utf8})
+    package_map = (
+        ndc_index
+        .filter(pl.col("ndc11_key").is_not_null())
+        .select(["ndc11_key", "product_ndc", "package_ndc"])
+        .join(listed, on=["product_ndc", "package_ndc"])
+        .select(["ndc11_key", "manufacturer_simple", "ingredient_name"])
+        .unique(subset=["ndc11_key"], keep="first", maintain_order=True)
+    )
 
-    # Prepare FDA (Normalize "12345-6789" -> "123456789")
-    fda_map = fda_df.with_columns([
-        pl.col("product_ndc")
-          .str.split("-")
-          .list.get(0)
-          .str.zfill(5)
-          .alias("labeler_code"),
-
-        pl.col("product_ndc")
-          .str.split("-")
-          .list.get(1)
-          .str.zfill(4)
-          .alias("product_code")
-    ]).with_columns(
-        (pl.col("labeler_code") + pl.col("product_code")).alias("match_key_9")
+    fda_map = (
+        ndc_index
+        .filter(pl.col("ndc11_key").is_null())
+        .select(["product_key", "product_ndc"])
+        .join(
+            fda_df.select(["product_ndc", "manufacturer_simple", "ingredient_name"]),
+            on="product_ndc",
+        )
+        .unique(subset=["product_key"], keep="first", maintain_order=True)
     )
 
-    # 3. Create a "Labeler Dictionary"
+    # Create a "Labeler Dictionary"
     # Even if we don't match the specific drug, we can match the Manufacturer
     # using the first 5 digits.
-    print("   🧠 Building Labeler Knowledge Base...")
     labeler_dict = (
         fda_map
-        .select(["labeler_code", "manufacturer_simple"])
-        .unique(subset=["labeler_code"])
         .filter(pl.col("manufacturer_simple").is_not_null())
-        .rename({"labeler_code": "labeler_code_5", "manufacturer_simple": "mfg_fallback"})
+        .select([
+            (pl.col("product_key") // 10_000).alias("labeler_key"),
+            pl.col("manufacturer_simple").alias("mfg_fallback"),
+        ])
+        .unique(subset=["labeler_key"], keep="first", maintain_order=True)
+    )
+    return package_map, fda_map, labeler_dict
+
+
+def latest_descriptions(nadac_lf):
+    """NADAC history -> one row per ndc_id with its most recent description."""
+    return (
+        nadac_lf.sort("effective_date")
+        .unique(subset=["ndc_id"], keep="last")
+        .select(NADAC_COLUMNS)
+        .collect()
+    )
+
+
+def input_hashes(package_map, fda_map, labeler_dict, nadac_df):
+    """
+    One row hash per input an NDC can be resolved from: each package's and
+    product's (manufacturer, ingredient), each labeler's fallback name and
+    each ndc_id's NADAC description.
+    Polars hashes are only stable within a Polars version; after an upgrade
+    every input looks changed and the next incremental run resolves all rows.
+    """
+    return pl.concat([
+        package_map.select(
+            pl.lit("package").alias("kind"),
+            pl.col("ndc11_key").alias("key"),
+            pl.struct(["manufacturer_simple", "ingredient_name"]).hash().alias("row_hash"),
+        ),
+        fda_map.select(
+            pl.lit("product").alias("kind"),
+            pl.col("product_key").alias("key"),
+            pl.struct(["manufacturer_simple", "ingredient_name"]).hash().alias("row_hash"),
+        ),
+        labeler_dict.select(
+            pl.lit("labeler").alias("kind"),
+            pl.col("labeler_key").alias("key"),
+            pl.col("mfg_fallback").hash().alias("row_hash"),
+        ),
+        nadac_df.select(
+            pl.lit("description").alias("kind"),
+            pl.col("ndc_id").cast(pl.Int64).alias("key"),
+            pl.col("drug_description").hash().alias("row_hash"),
+        ),
+    ])
+
+
+def changed_inputs(current, previous):
+    """
+    (ndc11_keys, product_keys, labeler_keys, ndc_ids) whose input was added,
+    changed or removed since `previous`.
+    """
+    diff = pl.concat([
+        current.join(previous, on=["kind", "key", "row_hash"], how="anti"),
+        previous.join(current, on=["kind", "key"], how="anti"),
+    ])
+    return tuple(
+        diff.filter(pl.col("kind") == kind)["key"].implode()
+        for kind in ["package", "product", "labeler", "description"]
+    )
+
+
+def retagged_descriptions(descriptions, previous_vocabulary, vocabulary):
+    """Distinct descriptions whose ingredient match differs between the two vocabularies."""
+    before = match_ingredient(descriptions, previous_vocabulary)
+    after = match_ingredient(descriptions, vocabulary)
+    return (
+        before.join(after, on="value", suffix="_new")
+        .filter(pl.col("ingredient_match").ne_missing(pl.col("ingredient_match_new")))
+        ["value"].implode()
     )
 
-    # 4. The Great Join
-    print("   🌉 Bridging Data...")
 
-    # Step A: Direct Join (The 15% precise matches)
+def resolve_entities(nadac_map, package_map, fda_map, labeler_dict, vocabulary):
+    """NADAC rows with link keys -> map rows (plus product_match / package_match for stats)."""
+    # Step A: Exact package-level join on the 11-digit key, then the
+    # product-level join for NDCs whose package the directory doesn't list
     master = nadac_map.join(
-        fda_map,
-        on="match_key_9",
+        package_map.with_columns(pl.lit(True).alias("package_match")),
+        on="ndc11_key",
         how="left"
-    )
+    ).join(
+        fda_map.drop("product_ndc"),
+        on="product_key",
+        how="left",
+        suffix="_product"
+    ).with_columns([
+        pl.when(pl.col("package_match"))
+          .then(pl.col(name))
+          .otherwise(pl.col(f"{name}_product"))
+          .alias(name)
+        for name in ["manufacturer_simple", "ingredient_name"]
+    ])
 
     # Step B: Join Labeler Fallback
     master = master.join(
         labeler_dict,
-        on="labeler_code_5",
+        on="labeler_key",
         how="left"
     )
 
-    # 5. The "MacGyver" Logic (Fill Gaps)
-    print("   🔧 Applying Smart Gap-Filling...")
+    # Step C: Dictionary match of the description against directory ingredients
+    # (longest match, so "SODIUM CHLORIDE 0.9%" -> "SODIUM CHLORIDE")
+    master = master.join(
+        match_ingredient(master["drug_description"], vocabulary)
+        .select("value", "ingredient_match")
+        .rename({"value": "drug_description", "ingredient_match": "description_ingredient"}),
+        on="drug_description",
+        how="left",
+        maintain_order="left"
+    )
 
-    # Helper to clean descriptions (e.g. "AMOXICILLIN 500MG" -> "AMOXICILLIN")
-    # We strip numbers and common dosage forms to get the raw ingredient name.
+    # The "MacGyver" Logic (Fill Gaps)
 
     master = master.with_columns([
         # Fallback 1: Manufacturer
@@ -91,9 +210,10 @@ def build_entity_map():
           .fill_null("UNKNOWN_MFG")
           .alias("final_manufacturer"),
 
-        # Fallback 2: Ingredient (Regex Magic)
-        # We take the first word of the description as a crude but effective ingredient proxy
+        # Fallback 2: Ingredient named in the description, else its first
+        # word as a crude proxy (e.g. "AMOXICILLIN 500MG" -> "AMOXICILLIN")
         pl.col("ingredient_name")
+          .fill_null(pl.col("description_ingredient"))
           .fill_null(
               pl.col("drug_description")
                 .str.split(" ")  # Split "GABAPENTIN 300MG CAP"
@@ -103,32 +223,137 @@ def build_entity_map():
         .alias("final_ingredient")
     ])
 
-    # 6. Final Clean & Save
-    final_map = master.select([
+    # Final Clean
+    return master.select([
+        pl.col("ndc_id"),
         pl.col("ndc11"),
         pl.col("drug_description"),
         pl.col("final_manufacturer").alias("manufacturer"),
         pl.col("final_ingredient").alias("ingredient"),
-        pl.col("labeler_code_5").alias("labeler_id")
+        pl.col("labeler_code_5").alias("labeler_id"),
+        pl.col("ingredient_name").is_not_null().alias("product_match"),
+        pl.col("package_match").fill_null(False),
     ])
 
+
+def load_map_state(processed_path=PROCESSED_DATA_PATH):
+    state_path = os.path.join(processed_path, MAP_STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_map_state(state, processed_path=PROCESSED_DATA_PATH):
+    with open(os.path.join(processed_path, MAP_STATE_FILE), "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def build_entity_map(processed_path=PROCESSED_DATA_PATH, incremental=False):
+    """
+    Builds ndc_entity_map.parquet. With incremental=True only NDCs not in
+    the map yet (anti-joined on ndc_id, so an NDC added by a revised old week
+    counts too), whose directory package/product/labeler row or NADAC
+    description changed since the last build, or whose description matches a
+    different ingredient under a changed vocabulary, are resolved; every
+    other row is carried over.
+    """
+    print("🚀 Starting Entity Map Construction (Smart Fallback Mode)...")
+    output_path = os.path.join(processed_path, ENTITY_MAP_FILE)
+    inputs_path = os.path.join(processed_path, MAP_INPUTS_FILE)
+    vocabulary_path = os.path.join(processed_path, MAP_VOCABULARY_FILE)
+    state = load_map_state(processed_path)
+    if incremental and not (os.path.exists(output_path) and os.path.exists(inputs_path)):
+        print("   ⚠️ No previous build to update; running a full build.")
+        incremental = False
+
+    # 1. Load Data
+    try:
+        # We need 'drug_description' from NADAC for the text mining fallback.
+        nadac_lf = scan_nadac_history(processed_path).select(["effective_date", *NADAC_COLUMNS])
+        fda_df = pl.read_parquet(os.path.join(processed_path, NDC_DIR_FILE))
+        ndc_index = load_ndc_index(processed_path)
+        vocabulary = load_ingredient_vocabulary(processed_path)
+    except Exception as e:
+        print(f"   ❌ Error loading files: {e}")
+        return
+
+    # 2. Directory Lookups (product level + labeler fallback)
+    print("   🧠 Building Labeler Knowledge Base...")
+    package_map, fda_map, labeler_dict = directory_lookups(fda_df, ndc_index)
+    latest = latest_descriptions(nadac_lf)
+    inputs = input_hashes(package_map, fda_map, labeler_dict, latest)
+    vocabulary_changed = state.get("vocabulary_hash") != vocabulary_hash(vocabulary)
+    if incremental and vocabulary_changed and not os.path.exists(vocabulary_path):
+        print("   ⚠️ Ingredient vocabulary changed and the previous one is missing; running a full build.")
+        incremental = False
+
+    # 3. Work List
+    carried = None
+    if not incremental:
+        nadac_df = latest
+    else:
+        existing = pl.read_parquet(output_path)
+        changed_packages, changed_products, changed_labelers, changed_descriptions = changed_inputs(
+            inputs, pl.read_parquet(inputs_path))
+        retagged = pl.Series([], dtype=pl.Utf8).implode()
+        if vocabulary_changed:
+            # Only descriptions that now match a different ingredient
+            retagged = retagged_descriptions(
+                existing["drug_description"], pl.read_parquet(vocabulary_path), vocabulary)
+            print(f"   🧪 Ingredient vocabulary changed: {retagged.list.len().item():,} descriptions re-tagged.")
+        affected = link_keys(existing).filter(
+            pl.col("ndc11_key").is_in(changed_packages)
+            | pl.col("product_key").is_in(changed_products)
+            | pl.col("labeler_key").is_in(changed_labelers)
+            | pl.col("ndc_id").is_in(changed_descriptions)
+            | pl.col("drug_description").is_in(retagged)
+        ).select("ndc_id")
+        carried = existing.join(affected, on="ndc_id", how="anti")
+        # Every NADAC ndc_id the map lacks (whichever week or revision brought
+        # it) plus the affected ones, with their latest description
+        nadac_df = latest.join(carried.select("ndc_id"), on="ndc_id", how="anti")
+        print(f"   🔁 Incremental: {nadac_df.height - affected.height:,} new NDCs, "
+              f"{affected.height:,} with changed inputs.")
+
+    # 4. The Great Join
+    print("   🌉 Bridging Data...")
+    resolved = resolve_entities(link_keys(nadac_df), package_map, fda_map, labeler_dict, vocabulary)
+    final_map = resolved.drop(["product_match", "package_match"])
+    if carried is not None:
+        final_map = pl.concat([carried, final_map])
+
     # Stats
     total = final_map.height
     with_mfg = final_map.filter(pl.col("manufacturer") != "UNKNOWN_MFG").height
     with_ing = final_map.filter(
         pl.col("ingredient") != "UNKNOWN_INGREDIENT").height
 
+    with_product = resolved.filter(pl.col("product_match")).height
+    with_package = resolved.filter(pl.col("package_match")).height
+
     print(f"   ✅ Map Complete!")
     print(f"      Total NDCs: {total:,}")
+    print(
+        f"      Newly Resolved:        {resolved.height:,} | carried over: {total - resolved.height:,}")
+    print(
+        f"      Product Matches:       {with_product:,} of resolved"
+        f" | exact package NDC: {with_package:,}")
     print(
         f"      Manufacturer Coverage: {with_mfg:,} ({(with_mfg/total)*100:.1f}%)")
     print(
         f"      Ingredient Coverage:   {with_ing:,} ({(with_ing/total)*100:.1f}%)")
 
-    output_path = os.path.join(PROCESSED_DATA_PATH, "ndc_entity_map.parquet")
     final_map.write_parquet(output_path)
+    inputs.write_parquet(inputs_path)
+    vocabulary.write_parquet(vocabulary_path)
+    state["vocabulary_hash"] = vocabulary_hash(vocabulary)
+    save_map_state(state, processed_path)
     print(f"   💾 Saved Enhanced Map to: {output_path}")
+    write_entity_lookup(processed_path)
+    return final_map
 
 
 if __name__ == "__main__":
-    build_entity_map()
+    # python src/entities/map_builder.py [--incremental]
+    build_entity_map(incremental="--incremental" in sys.argv)
@@ -0,0 +1,80 @@
+import polars as pl
+import os
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+NDC_DICTIONARY_FILE = "ndc_dictionary.parquet"
+
+# Dense, append-only surrogate key for ndc11. Every processed table carries
+# ndc_id and joins on it; the 11-character string is kept for display only.
+NDC_ID_DTYPE = pl.UInt32
+DICTIONARY_SCHEMA = {"ndc_id": NDC_ID_DTYPE, "ndc11": pl.Utf8}
+
+
+def dictionary_path(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, NDC_DICTIONARY_FILE)
+
+
+def load_ndc_dictionary(processed_path=PROCESSED_DATA_PATH):
+    """Returns the (ndc_id, ndc11) dictionary, empty if it has not been built yet."""
+    path = dictionary_path(processed_path)
+    if not os.path.exists(path):
+        return pl.DataFrame(schema=DICTIONARY_SCHEMA)
+    return pl.read_parquet(path)
+
+
+def update_ndc_dictionary(ndc11_values, processed_path=PROCESSED_DATA_PATH):
+    """
+    Registers any unseen ndc11 values and returns the full dictionary.
+
+    Ids are never reassigned: new NDCs get the next ids in sorted order, so
+    tables written earlier stay valid and ids stay dense (0..n-1).
+    """
+    dictionary = load_ndc_dictionary(processed_path)
+    unseen = (
+        pl.Series("ndc11", ndc11_values, dtype=pl.Utf8)
+        .drop_nulls()
+        .unique()
+        .sort()
+    )
+    unseen = unseen.filter(~unseen.is_in(dictionary["ndc11"].implode()))
+    if unseen.is_empty():
+        return dictionary
+
+    start = dictionary.height
+    additions = pl.DataFrame({
+        "ndc_id": pl.int_range(start, start + unseen.len(), dtype=NDC_ID_DTYPE, eager=True),
+        "ndc11": unseen,
+    })
+    dictionary = pl.concat([dictionary, additions])
+
+    os.makedirs(processed_path, exist_ok=True)
+    dictionary.write_parquet(dictionary_path(processed_path))
+    print(f"   🔑 NDC dictionary: +{unseen.len():,} new keys ({dictionary.height:,} total).")
+    return dictionary
+
+
+def attach_ndc_id(frame, dictionary, ndc_col="ndc11"):
+    """Adds ndc_id to a DataFrame/LazyFrame keyed by an ndc11 string column."""
+    lookup = dictionary.rename({"ndc11": ndc_col})
+    if isinstance(frame, pl.LazyFrame):
+        lookup = lookup.lazy()
+    return frame.join(lookup, on=ndc_col, how="left", maintain_order="left")
+
+
+def attach_ndc11(frame, dictionary):
+    """Decodes ndc_id back to the ndc11 string for display."""
+    if isinstance(frame, pl.LazyFrame):
+        dictionary = dictionary.lazy()
+    return frame.join(dictionary, on="ndc_id", how="left", maintain_order="left")
+
+
+def lookup_ndc_ids(ndc11_values, processed_path=PROCESSED_DATA_PATH):
+    """ndc11 string(s) -> list of known ndc_ids (unknown NDCs are dropped)."""
+    if isinstance(ndc11_values, str):
+        ndc11_values = [ndc11_values]
+    dictionary = load_ndc_dictionary(processed_path)
+    wanted = pl.Series(list(ndc11_values), dtype=pl.Utf8).implode()
+    return dictionary.filter(pl.col("ndc11").is_in(wanted))["ndc_id"].to_list()
@@ -0,0 +1,118 @@
+import polars as pl
+import os
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+NDC_DIRECTORY_FILE = "ndc_directory.parquet"
+NDC_INDEX_FILE = "ndc_index.parquet"
+
+# FDA labels use 10-digit NDCs in three layouts; the canonical (CMS/NADAC)
+# form is 11 digits, 5-4-2, made by zero-padding the short segment.
+PRODUCT_LAYOUTS = ["4-4", "5-3", "5-4"]
+PACKAGE_LAYOUTS = ["4-4-2", "5-3-2", "5-4-1", "5-4-2"]
+SEGMENT_WIDTHS = (5, 4, 2)
+
+# Integer keys: ndc11_key = the 11 digits, product_key = the first 9
+# (labeler + product), labeler = the first 5. So for any package,
+# product_key == ndc11_key // 100 and labeler == ndc11_key // 1_000_000.
+KEY_DTYPE = pl.Int64
+
+
+def ndc_layout(expr):
+    """Dashed NDC -> its segment layout, e.g. "0591-2897-01" -> "4-4-2"."""
+    segments = expr.str.extract_groups(r"^(\d+)-(\d+)(?:-(\d+))?$")
+    return pl.concat_str(
+        [segments.struct.field(str(i)).str.len_chars() for i in (1, 2, 3)],
+        separator="-", ignore_nulls=True,
+    )
+
+
+def canonical_ndc_key(expr, package=True):
+    """
+    Dashed 10-digit NDC -> integer canonical key (ndc11_key for packages,
+    product_key for products). Null when the layout is not a valid NDC layout.
+    """
+    segments = expr.str.extract_groups(r"^(\d+)-(\d+)(?:-(\d+))?$")
+    parts = [segments.struct.field(str(i + 1)).str.zfill(width)
+             for i, width in enumerate(SEGMENT_WIDTHS[:3 if package else 2])]
+    layouts = PACKAGE_LAYOUTS if package else PRODUCT_LAYOUTS
+    return (
+        pl.when(ndc_layout(expr).is_in(layouts))
+        .then(pl.concat_str(parts).cast(KEY_DTYPE))
+    )
+
+
+def ndc11_key(expr):
+    """Undashed 11-digit string (NADAC/CMS ndc11) -> integer key."""
+    return (
+        pl.when(expr.str.contains(r"^\d{11}$"))
+        .then(expr.cast(KEY_DTYPE, strict=False))
+    )
+
+
+def build_ndc_index(directory):
+    """
+    ndc_directory rows (product_ndc + package_ndcs) -> the normalization index.
+
+    One row per product (package columns null) and one per package NDC, each
+    with its integer keys, so lookups are integer hash joins instead of
+    string splitting at query time.
+    """
+    directory = directory.lazy()
+    if "package_ndcs" not in directory.collect_schema().names():
+        # Directory written before package NDCs were kept: products only
+        directory = directory.with_columns(
+            pl.lit(None, dtype=pl.List(pl.Utf8)).alias("package_ndcs"))
+    directory = directory.select("product_ndc", "package_ndcs")
+
+    products = directory.select(
+        pl.lit(None, dtype=KEY_DTYPE).alias("ndc11_key"),
+        canonical_ndc_key(pl.col("product_ndc"), package=False).alias("product_key"),
+        "product_ndc",
+        pl.lit(None, dtype=pl.Utf8).alias("package_ndc"),
+        ndc_layout(pl.col("product_ndc")).alias("layout"),
+    )
+    packages = (
+        directory
+        .explode("package_ndcs", empty_as_null=True)
+        .rename({"package_ndcs": "package_ndc"})
+        .select(
+            canonical_ndc_key(pl.col("package_ndc")).alias("ndc11_key"),
+            canonical_ndc_key(pl.col("product_ndc"), package=False).alias("product_key"),
+            "product_ndc",
+            "package_ndc",
+            ndc_layout(pl.col("package_ndc")).alias("layout"),
+        )
+        .filter(pl.col("ndc11_key").is_not_null())
+    )
+    return (
+        pl.concat([products, packages])
+        .filter(pl.col("product_key").is_not_null())
+        .unique(subset=["product_key", "ndc11_key"], keep="first", maintain_order=True)
+    )
+
+
+def write_ndc_index(processed_path=PROCESSED_DATA_PATH):
+    """Rebuilds ndc_index.parquet from ndc_directory.parquet."""
+    directory = pl.scan_parquet(os.path.join(processed_path, NDC_DIRECTORY_FILE))
+    index = build_ndc_index(directory).collect(engine="streaming")
+
+    output_path = os.path.join(processed_path, NDC_INDEX_FILE)
+    index.write_parquet(output_path)
+
+    packages = index.filter(pl.col("ndc11_key").is_not_null()).height
+    print(f"   🗂️  NDC index: {index.height - packages:,} products, "
+          f"{packages:,} packages -> {output_path}")
+    return index
+
+
+def load_ndc_index(processed_path=PROCESSED_DATA_PATH):
+    """Reads the index, building it from the directory if it is missing or stale."""
+    index_path = os.path.join(processed_path, NDC_INDEX_FILE)
+    directory_path = os.path.join(processed_path, NDC_DIRECTORY_FILE)
+    if (not os.path.exists(index_path)
+            or os.path.getmtime(index_path) < os.path.getmtime(directory_path)):
+        return write_ndc_index(processed_path)
+    return pl.read_parquet(index_path)
@@ -15,6 +15,10 @@ project_root = os.path.abspath(os.path.join(current_dir, "../.."))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from src.ingestion.nadac_store import history_exists, scan_weekly_prices
+from src.entities.ndc_dictionary import load_ndc_dictionary, attach_ndc_id, NDC_ID_DTYPE
+from src.entities.entity_lookup import get_entity_lookup
+
 # ==========================================
 # CONFIGURATION
 # ==========================================
@@ -22,8 +26,7 @@ REGISTRY_PATH = os.path.join(
     project_root, 'data/outputs/prediction_registry.parquet')
 FEATURES_PATH = os.path.join(
     project_root, 'data/processed/weekly_features.parquet')
-NADAC_HISTORY_PATH = os.path.join(
-    project_root, 'data/processed/nadac_history.parquet')
+PROCESSED_PATH = os.path.join(project_root, 'data/processed')
 MODEL_PATH = os.path.join(
     project_root, 'src/models/artifacts/spike_predictor_v2.pkl')
 REPORTS_DIR = os.path.join(project_root, 'reports')
@@ -35,12 +38,17 @@ os.makedirs(REPORTS_DIR, exist_ok=True)
 def initialize_registry() -> pl.DataFrame:
     if os.path.exists(REGISTRY_PATH):
         print(f"✅ Loading registry from '{REGISTRY_PATH}'.")
-        return pl.read_parquet(REGISTRY_PATH)
+        registry = pl.read_parquet(REGISTRY_PATH)
+        if "ndc_id" not in registry.columns:
+            # Registries written before the NDC dictionary: backfill the join key.
+            registry = attach_ndc_id(registry, load_ndc_dictionary(PROCESSED_PATH))
+        return registry
     else:
         print(f"🛠️ Initializing new registry at '{REGISTRY_PATH}'...")
         schema = {
             "prediction_id": pl.Utf8, "prediction_date": pl.Date, "target_date": pl.Date,
-            "ndc11": pl.Utf8, "drug_name": pl.Utf8, "start_price": pl.Float64,
+            "ndc_id": NDC_ID_DTYPE, "ndc11": pl.Utf8, "drug_name": pl.Utf8,
+            "start_price": pl.Float64,
             "predicted_risk_score": pl.Float64, "actual_price": pl.Float64,
             "price_change_pct": pl.Float64, "status": pl.Utf8
         }
@@ -81,22 +89,24 @@ def log_new_predictions(registry_df):
         current_preds = current_preds.with_columns(
             pl.Series("risk_score", scores))
 
-    # 2. FIX: Join with NADAC History to get 'drug_description'
+    # 2. FIX: Attach 'drug_description' from the shared entity lookup
     # The features file has 'ingredient' but usually not the full 'drug_description'
+    if "ndc_id" not in current_preds.columns:
+        # Features written before the NDC dictionary: backfill the join key,
+        # as initialize_registry does for old registries.
+        current_preds = attach_ndc_id(current_preds, load_ndc_dictionary(PROCESSED_PATH))
     if "drug_description" not in current_preds.columns:
-        print("   📖 Looking up drug names from NADAC history...")
-        if os.path.exists(NADAC_HISTORY_PATH):
-            names_df = pl.read_parquet(NADAC_HISTORY_PATH).select(
-                ["ndc11", "drug_description"]).unique(subset=["ndc11"])
-            current_preds = current_preds.join(
-                names_df, on="ndc11", how="left")
+        print("   📖 Looking up drug names from the entity lookup...")
+        try:
+            current_preds = get_entity_lookup(PROCESSED_PATH).attach(
+                current_preds, ["drug_description"])
 
             # Fill missing names with Ingredient if name lookup failed
             current_preds = current_preds.with_columns(
                 pl.col("drug_description").fill_null(pl.col("ingredient"))
             )
-        else:
-            print("   ⚠️ NADAC history not found. Using 'ingredient' as fallback name.")
+        except Exception as e:
+            print(f"   ⚠️ Entity lookup failed ({e}). Using 'ingredient' as fallback name.")
             current_preds = current_preds.with_columns(
                 pl.col("ingredient").alias("drug_description")
             )
@@ -107,6 +117,7 @@ def log_new_predictions(registry_df):
         .filter(pl.col("risk_score") > 0.5)
         .select([
             pl.col("effective_date").alias("prediction_date"),
+            pl.col("ndc_id"),
             pl.col("ndc11"),
             pl.col("drug_description").alias("drug_name"),
             pl.col("price_per_unit").alias("start_price"),
@@ -136,7 +147,7 @@ def log_new_predictions(registry_df):
 
 def reconcile_pending(registry_df):
     print("\n🕵️ Auditor: Reconciling past predictions...")
-    if not os.path.exists(NADAC_HISTORY_PATH):
+    if not history_exists(PROCESSED_PATH):
         return registry_df
 
     today = datetime.now().date()
@@ -150,13 +161,21 @@ def reconcile_pending(registry_df):
         return registry_df
 
     print(f"   Checking {pending.height} records against NADAC...")
-    history = pl.read_parquet(NADAC_HISTORY_PATH).select(
-        ["ndc11", "effective_date", "price_per_unit"])
+    # Only the pending NDCs within the pending target window are read.
+    history = (
+        scan_weekly_prices(
+            PROCESSED_PATH,
+            ndc11=pending["ndc11"].unique().to_list(),
+            start_date=pending["target_date"].min(),
+            end_date=pending["target_date"].max())
+        .select(["ndc_id", "effective_date", "price_per_unit"])
+        .collect()
+    )
 
     # Left Join to get actual prices
     annotated = (
         registry_df
-        .join(history, left_on=["ndc11", "target_date"], right_on=["ndc11", "effective_date"], how="left")
+        .join(history, left_on=["ndc_id", "target_date"], right_on=["ndc_id", "effective_date"], how="left")
         .with_columns([
             pl.when((pl.col("status") == "PENDING") & (
                 pl.col("price_per_unit").is_not_null()))
@@ -1,15 +1,24 @@
 import polars as pl
 import os
 import re
+import sys
+from datetime import timedelta
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.nadac_store import scan_nadac_history
+from src.ingestion.sentinel_store import scan_risks
+from src.entities.ingredient_matcher import load_ingredient_vocabulary, match_ingredient
+from src.entities.entity_lookup import get_entity_lookup
 
 # ==========================================
 # CONFIGURATION
 # ==========================================
 PROCESSED_PATH = "data/processed"
-NADAC_PATH = os.path.join(PROCESSED_PATH, "nadac_history.parquet")
 EVENTS_PATH = os.path.join(PROCESSED_PATH, "shortage_events.parquet")
-MAP_PATH = os.path.join(PROCESSED_PATH, "ndc_entity_map.parquet")
-SENTINEL_RISK_PATH = os.path.join(PROCESSED_PATH, "sentinel_risks.parquet")
+SENTINEL_LOOKBACK_DAYS = 90
 OUTPUT_PATH = os.path.join(PROCESSED_PATH, "weekly_features.parquet")
 
 
@@ -25,15 +34,80 @@ def normalize_text(col_expr):
     )
 
 
+def ingredient_join_key(frame, column, vocabulary):
+    """
+    Adds join_key: the longest directory ingredient found in `column` (so
+    "SODIUM CHLORIDE" and "SODIUM BICARBONATE" stay apart), falling back to
+    normalize_text's first word when no ingredient matches, join_keys: every
+    non-overlapping ingredient found (both halves of a combination), else
+    [join_key], and base_key: always that first word.
+    """
+    lookup = match_ingredient(frame[column], vocabulary).rename({"value": column})
+    return (
+        frame.join(lookup, on=column, how="left", maintain_order="left")
+        .with_columns(
+            pl.col("ingredient_match").fill_null(normalize_text(pl.col(column))).alias("join_key"),
+            normalize_text(pl.col(column)).alias("base_key"),
+        )
+        .with_columns(
+            pl.when(pl.col("ingredient_matches").list.len() > 0)
+              .then(pl.col("ingredient_matches"))
+              .otherwise(pl.concat_list("join_key"))
+              .alias("join_keys"),
+        )
+        .drop(["ingredient_match", "ingredient_matches"])
+    )
+
+
+def attach_shortage_events(spine, events):
+    """
+    As-of joins the latest shortage event onto each spine row (sorted by
+    effective_date; the spine carries join_key and base_key, events also
+    join_keys). Events are exploded over join_keys, so a combination
+    shortage hits the NDCs of each of its ingredients that is in the spine.
+    Events with none in the spine ("METFORMIN" against a spine of
+    "METFORMIN HYDROCHLORIDE", names the vocabulary lacks) fall back to the
+    first-word base_key, as before the vocabulary existed. The later event wins.
+    """
+    known = spine["join_key"].drop_nulls().unique().implode()
+    event_cols = ["event_date", "event_type", "reason"]
+    events = events.with_row_index("_event")
+    exact_events = (
+        events.drop("join_key")
+        .explode("join_keys", empty_as_null=True)
+        .rename({"join_keys": "join_key"})
+        .filter(pl.col("join_key").is_in(known))
+    )
+    loose_events = events.join(exact_events.select("_event"), on="_event", how="anti")
+
+    def latest(key, matched):
+        return spine.join_asof(
+            matched.select([key, *event_cols]).drop_nulls(key).sort("event_date"),
+            left_on="effective_date", right_on="event_date", by=key, strategy="backward",
+            check_sortedness=False,  # spine sorted by the caller, events here
+        ).select(event_cols)
+
+    exact = latest("join_key", exact_events)
+    loose = latest("base_key", loose_events)
+    use_loose = pl.col("event_date_loose").is_not_null() & (
+        pl.col("event_date").is_null() | (pl.col("event_date_loose") > pl.col("event_date")))
+    return spine.hstack(exact).hstack(
+        loose.rename({c: f"{c}_loose" for c in event_cols})
+    ).with_columns([
+        pl.when(use_loose).then(pl.col(f"{c}_loose")).otherwise(pl.col(c)).alias(c) for c in event_cols
+    ]).drop([f"{c}_loose" for c in event_cols])
+
+
 def generate_features():
     print("🚀 Starting 'Kitchen Sink' Feature Engineering...")
 
     # 1. Load Data
     try:
         print("   📂 Loading Datasets...")
-        nadac = pl.read_parquet(NADAC_PATH)
+        nadac = scan_nadac_history(PROCESSED_PATH).collect()
         events = pl.read_parquet(EVENTS_PATH)
-        entity_map = pl.read_parquet(MAP_PATH)
+        entity_lookup = get_entity_lookup(PROCESSED_PATH)
+        vocabulary = load_ingredient_vocabulary(PROCESSED_PATH)
     except Exception as e:
         print(f"   ❌ Error loading data: {e}")
         return
@@ -45,9 +119,10 @@ def generate_features():
 
     # We need to know: For every week, for every ingredient, WHO is selling?
     # Join NADAC (Price/Date) with Entity Map (Ingredient/Manufacturer)
+    # Names are gathered by the integer ndc_id; ndc11 rides along for display.
     market_spine = (
-        nadac.select(["effective_date", "ndc11"])
-        .join(entity_map.select(["ndc11", "ingredient", "manufacturer"]), on="ndc11", how="inner")
+        entity_lookup.attach(nadac.select(["effective_date", "ndc_id"]), ["ingredient", "manufacturer"])
+        .filter(pl.col("ingredient").is_not_null())  # NDCs in the entity map only
     )
 
     # Calculate Market Share per Manufacturer per Week
@@ -55,7 +130,7 @@ def generate_features():
     market_stats = (
         market_spine
         .group_by(["effective_date", "ingredient", "manufacturer"])
-        .agg(pl.count("ndc11").alias("mfg_ndc_count"))
+        .agg(pl.count("ndc_id").alias("mfg_ndc_count"))
         .with_columns([
             pl.col("mfg_ndc_count").sum().over(
                 ["effective_date", "ingredient"]).alias("total_ingredient_ndcs")
@@ -84,19 +159,19 @@ def generate_features():
 
     price_features = (
         nadac
-        .sort(["ndc11", "effective_date"])
+        .sort(["ndc_id", "effective_date"])
         .with_columns([
             # 1. Price Momentum (4-Week Velocity)
             # (Current Price - Price 4 Weeks Ago) / Price 4 Weeks Ago
             pl.col("price_per_unit").shift(4).over(
-                "ndc11").alias("price_lag_4w"),
+                "ndc_id").alias("price_lag_4w"),
 
             # 2. Volatility (12-Week Coefficient of Variation)
             # StdDev / Mean
             pl.col("price_per_unit").rolling_std(
-                window_size=12).over("ndc11").alias("std_12w"),
+                window_size=12).over("ndc_id").alias("std_12w"),
             pl.col("price_per_unit").rolling_mean(
-                window_size=12).over("ndc11").alias("mean_12w")
+                window_size=12).over("ndc_id").alias("mean_12w")
         ])
         .with_columns([
             ((pl.col("price_per_unit") - pl.col("price_lag_4w")) /
@@ -104,7 +179,7 @@ def generate_features():
             (pl.col("std_12w") / pl.col("mean_12w")
              ).fill_null(0).alias("price_volatility_12w")
         ])
-        .select(["effective_date", "ndc11", "price_per_unit", "price_velocity_4w", "price_volatility_12w"])
+        .select(["effective_date", "ndc_id", "ndc11", "price_per_unit", "price_velocity_4w", "price_volatility_12w"])
     )
 
     # -------------------------------------------------------
@@ -112,36 +187,29 @@ def generate_features():
     # -------------------------------------------------------
     print("   🕰️  Integrating Shortage Events...")
 
-    # Prepare Spine with Join Key
+    # Prepare Spine with Join Key (keyed once per NDC, not per week)
     spine_enhanced = (
-        nadac.select(["effective_date", "ndc11"])
-        .join(entity_map, on="ndc11", how="left")
-        .with_columns(normalize_text(pl.col("ingredient")))
+        nadac.select(["effective_date", "ndc_id"])
+        .join(ingredient_join_key(entity_lookup.table(["ingredient"]), "ingredient", vocabulary)
+              .select(["ndc_id", "join_key", "base_key"]),
+              on="ndc_id", how="left")
         .sort("effective_date")
     )
 
     # Prepare Events
     events_normalized = (
-        events
-        .with_columns(normalize_text(pl.col("generic_name")))
-        .sort("event_date")
-        .select(["event_date", "join_key", "event_type", "reason"])
+        ingredient_join_key(events, "generic_name", vocabulary)
+        .select(["event_date", "join_key", "join_keys", "base_key", "event_type", "reason"])
     )
 
-    # As-Of Join
-    shortage_signals = spine_enhanced.join_asof(
-        events_normalized,
-        left_on="effective_date",
-        right_on="event_date",
-        by="join_key",
-        strategy="backward"
-    ).with_columns([
+    # As-Of Join (exact ingredient, else first-word fallback)
+    shortage_signals = attach_shortage_events(spine_enhanced, events_normalized).with_columns([
         pl.when(pl.col("event_type") == "shortage_start").then(
             1).otherwise(0).alias("is_shortage"),
         pl.when(pl.col("event_type") == "shortage_start")
           .then((pl.col("effective_date") - pl.col("event_date")).dt.total_days() / 7)
           .otherwise(0).alias("weeks_in_shortage")
-    ]).select(["effective_date", "ndc11", "is_shortage", "weeks_in_shortage"])
+    ]).select(["effective_date", "ndc_id", "is_shortage", "weeks_in_shortage"])
 
     # -------------------------------------------------------
     # PHASE 4: THE GRAND MERGE
@@ -154,10 +222,9 @@ def generate_features():
 
     # We need Ingredient and Manufacturer on the Price table for joins
     master_table = (
-        price_features
-        .join(entity_map.select(["ndc11", "ingredient", "manufacturer"]), on="ndc11", how="left")
+        entity_lookup.attach(price_features, ["ingredient", "manufacturer"])
         .join(competition_features, on=["effective_date", "ingredient"], how="left")
-        .join(shortage_signals, on=["effective_date", "ndc11"], how="left")
+        .join(shortage_signals, on=["effective_date", "ndc_id"], how="left")
     )
     
     # -------------------------------------------------------
@@ -188,8 +255,13 @@ def integrate_sentinel_risk(features_df: pl.DataFrame) -> pl.DataFrame:
     print("   🛡️  Integrating Sentinel Manufacturer Risk...")
 
     # 1. Load and prepare sentinel risk data
+    # Only the event_date partitions inside the features' lookback window are scanned.
     try:
-        sentinel_risks = pl.read_parquet(SENTINEL_RISK_PATH)
+        start_date = end_date = None
+        if "effective_date" in features_df.columns and features_df.height > 0:
+            start_date = features_df["effective_date"].min() - timedelta(days=SENTINEL_LOOKBACK_DAYS)
+            end_date = features_df["effective_date"].max()
+        sentinel_risks = scan_risks(PROCESSED_PATH, start_date, end_date).collect()
     except Exception as e:
         print(f"   ⚠️  Could not load sentinel risk data, skipping. Error: {e}")
         return features_df.with_columns(pl.lit(0).alias("manufacturer_risk_score"))
@@ -220,7 +292,7 @@ def integrate_sentinel_risk(features_df: pl.DataFrame) -> pl.DataFrame:
         right_on="event_date",
         by="manufacturer",
         strategy="backward",
-        tolerance="90d"  # Look back 90 days
+        tolerance=f"{SENTINEL_LOOKBACK_DAYS}d"  # Look back 90 days
     )
 
     # 4. Finalize column
@@ -0,0 +1,135 @@
+import polars as pl
+import os
+import sys
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.graph.hydrate_baseline import node_frames, snapshot_hashes, DATA_PATH, SNAPSHOT_PATH
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+FACILITY_LINKS_PATH = "data/processed/facility_links.parquet"  # written by enrich_facilities.py
+EXPORT_DIR = "data/processed/neo4j_import"
+DATABASE = "neo4j"
+
+# Header syntax of `neo4j-admin database import`: ":ID(<space>)" marks the
+# node key (also stored as the property before the colon), relationships
+# point at those keys with ":START_ID(<space>)" / ":END_ID(<space>)".
+# One ID space per label, so a Corporation and an Ingredient may share a name.
+NODE_FILES = {
+    "Corporation": ("corporations.csv", {"name": "name:ID(Corporation)"}),
+    "Subsidiary": ("subsidiaries.csv", {"labeler_id": "labeler_id:ID(Subsidiary)"}),
+    "Ingredient": ("ingredients.csv", {"name": "name:ID(Ingredient)"}),
+    "NDC": ("ndcs.csv", {"ndc11": "ndc11:ID(NDC)", "drug_description": "description"}),
+    "Facility": ("facilities.csv", {"FEI_NUMBER": "fei_number:ID(Facility)",
+                                    "FIRM_NAME": "name", "FIRM_ADDRESS": "address"}),
+}
+RELATIONSHIP_FILES = {
+    "OWNS": ("owns.csv", {"manufacturer": ":START_ID(Corporation)", "labeler_id": ":END_ID(Subsidiary)"}),
+    "MARKETS": ("markets.csv", {"labeler_id": ":START_ID(Subsidiary)", "ndc11": ":END_ID(NDC)"}),
+    "CONTAINS": ("contains.csv", {"ndc11": ":START_ID(NDC)", "ingredient": ":END_ID(Ingredient)"}),
+    "OPERATES": ("operates.csv", {"subsidiary_name": ":START_ID(Corporation)", "FEI_NUMBER": ":END_ID(Facility)"}),
+}
+
+
+def import_frames(entity_map, facility_links=None):
+    """
+    Entity map (+ facility links) -> ({label: nodes}, {type: relationships}),
+    deduplicated the same way the transactional MERGEs would leave the graph.
+
+    Args:
+        entity_map (pl.DataFrame): ndc_entity_map rows.
+        facility_links (pl.DataFrame): enrich_facilities links (optional).
+    """
+    if facility_links is None:
+        facility_links = pl.DataFrame(schema={c: pl.Utf8 for c in
+                                              ["subsidiary_name", "FEI_NUMBER", "FIRM_NAME", "FIRM_ADDRESS"]})
+    nodes = node_frames(entity_map)
+    # Linked corporations are MERGEd by the link query too
+    nodes["Corporation"] = (
+        pl.concat([nodes["Corporation"],
+                   facility_links.select(pl.col("subsidiary_name").alias("name")).drop_nulls()])
+        .unique(maintain_order=True)
+    )
+    # ON CREATE SET: the first link seen for a facility names it
+    nodes["Facility"] = (
+        facility_links.select("FEI_NUMBER", "FIRM_NAME", "FIRM_ADDRESS")
+        .drop_nulls("FEI_NUMBER")
+        .unique(subset=["FEI_NUMBER"], keep="first", maintain_order=True)
+    )
+
+    relationships = {
+        "OWNS": entity_map.select("manufacturer", "labeler_id"),
+        "MARKETS": entity_map.select("labeler_id", "ndc11"),
+        "CONTAINS": entity_map.select("ndc11", "ingredient"),
+        "OPERATES": facility_links.select("subsidiary_name", "FEI_NUMBER"),
+    }
+    relationships = {t: f.drop_nulls().unique(maintain_order=True) for t, f in relationships.items()}
+    return nodes, relationships
+
+
+def export_import_csvs(entity_map, facility_links=None, output_dir=EXPORT_DIR):
+    """
+    Writes one node CSV per label and one relationship CSV per type into
+    `output_dir`. Returns {file name: rows}.
+    """
+    nodes, relationships = import_frames(entity_map, facility_links)
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+    for label, (file_name, headers) in NODE_FILES.items():
+        frame = nodes[label].rename(headers).with_columns(pl.lit(label).alias(":LABEL"))
+        frame.write_csv(os.path.join(output_dir, file_name))
+        written[file_name] = frame.height
+    for rel_type, (file_name, headers) in RELATIONSHIP_FILES.items():
+        frame = relationships[rel_type].rename(headers).with_columns(pl.lit(rel_type).alias(":TYPE"))
+        frame.write_csv(os.path.join(output_dir, file_name))
+        written[file_name] = frame.height
+    return written
+
+
+def import_command(output_dir=EXPORT_DIR, database=DATABASE):
+    """The neo4j-admin call that loads the exported files (database must be stopped)."""
+    args = ["neo4j-admin", "database", "import", "full"]
+    args += [f"--nodes={os.path.join(output_dir, f)}" for f, _ in NODE_FILES.values()]
+    args += [f"--relationships={os.path.join(output_dir, f)}" for f, _ in RELATIONSHIP_FILES.values()]
+    return " ".join(args + [database])
+
+
+def export_graph(data_path=DATA_PATH, links_path=FACILITY_LINKS_PATH, output_dir=EXPORT_DIR,
+                 snapshot_path=SNAPSHOT_PATH):
+    """
+    Writes the import CSVs and the hydration snapshot of the exported map, so
+    the first `hydrate_baseline.py --delta` after the import only sends what
+    changed since this export.
+    """
+    print("🚀 Exporting graph for neo4j-admin import...")
+    try:
+        entity_map = pl.read_parquet(data_path)
+    except Exception as e:
+        print(f"❌ Failed to load data: {e}")
+        return
+    facility_links = None
+    if os.path.exists(links_path):
+        facility_links = pl.read_parquet(links_path)
+    else:
+        print(f"   ⚠️ No facility links at '{links_path}'; exporting without facilities.")
+
+    written = export_import_csvs(entity_map, facility_links, output_dir)
+    for file_name, rows in written.items():
+        print(f"      {file_name:<18} {rows:>10,} rows")
+    snapshot_hashes(entity_map).write_parquet(snapshot_path)
+    print(f"✅ Export complete: {output_dir}")
+    print(f"   💾 Saved hydration snapshot to: {snapshot_path} (the graph after the import)")
+    print(f"   1. Load into a stopped database with:\n      {import_command(output_dir)}")
+    # neo4j-admin creates no constraints, and the MERGEs of later delta runs rely on them
+    print("   2. Start the database, then create the constraints and indexes:\n"
+          "      python src/graph/setup_db.py")
+    return written
+
+
+if __name__ == "__main__":
+    # python src/graph/bulk_export.py
+    export_graph()
@@ -4,13 +4,19 @@ from neo4j import GraphDatabase, basic_auth
 import rapidfuzz
 import numpy as np
 from dotenv import load_dotenv  # <--- ADDED THIS
-from google import genai
-from google.genai import types
 import json
 import logging
 import re
+import sys
 from typing import List, Dict
 
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.utils.llm_cache import get_llm_cache
+from src.utils.llm_backend import get_llm_backend, LLM_BACKEND
+
 # --- Load Environment Variables ---
 load_dotenv()  # <--- THIS LOADS YOUR .ENV FILE
 
@@ -29,6 +35,9 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # Data paths and URLs
 FDA_URL = "https://www.accessdata.fda.gov/downloads/drug/drd/drug-establishments-current-registration-site.zip"
 FDA_DATA_PATH = "signals/data/raw/fda_establishments.csv"
+# Every confirmed Corporation -> Facility link, kept for bulk re-imports (bulk_export.py)
+FACILITY_LINKS_PATH = "data/processed/facility_links.parquet"
+FACILITY_LINK_COLUMNS = ["subsidiary_name", "FEI_NUMBER", "FIRM_NAME", "FIRM_ADDRESS"]
 
 # Fuzzy matching thresholds
 FUZZ_ACCEPT_THRESHOLD = 90
@@ -66,6 +75,27 @@ def link_subsidiary_to_facility(driver, links: List[Dict]):
         session.run(query, links=links)
     logging.info("Successfully wrote links to Neo4j.")
 
+
+def facility_link_rows(links: List[Dict]) -> pl.DataFrame:
+    """Matched rows (auto-accepted or LLM-confirmed) -> the columns the link query reads."""
+    df = pl.DataFrame(links)
+    if "Firm_Name" in df.columns:
+        df = df.rename({"Firm_Name": "FIRM_NAME"})
+    return df.select([
+        (pl.col(c) if c in df.columns else pl.lit(None)).cast(pl.Utf8).alias(c)
+        for c in FACILITY_LINK_COLUMNS
+    ])
+
+
+def save_facility_links(links: pl.DataFrame, path: str = FACILITY_LINKS_PATH):
+    """Merges this run's links into the links file (latest firm details win)."""
+    if os.path.exists(path):
+        links = pl.concat([pl.read_parquet(path), links])
+    links = links.unique(subset=["subsidiary_name", "FEI_NUMBER"], keep="last", maintain_order=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    links.write_parquet(path)
+    logging.info(f"Saved {links.height} facility links to {path}.")
+
 # --- Step 1: Ingestion ---
 
 
@@ -168,23 +198,25 @@ def fuzzy_match_entities(subs_df: pl.DataFrame, fda_df: pl.DataFrame) -> (pl.Dat
 # --- Step 3: LLM Resolution ---
 
 
-def get_llm_verdicts(gray_zone_df: pl.DataFrame) -> List[Dict]:
+def get_llm_verdicts(gray_zone_df: pl.DataFrame, backend=None) -> List[Dict]:
     """
-    Sends batches of gray-zone matches to Gemini for verification using the updated SDK.
+    Sends batches of gray-zone matches to the configured LLM backend (Gemini,
+    or the local stand-in with LLM_BACKEND=local) for verification.
+    Batches already answered in an earlier run are served from the LLM cache.
     """
-    if not GEMINI_API_KEY:
-        logging.error(
-            "GEMINI_API_KEY not set. Cannot resolve gray zone matches.")
+    if gray_zone_df.is_empty():
         return []
 
-    if gray_zone_df.is_empty():
+    try:
+        backend = backend or get_llm_backend()
+    except ValueError as e:
+        logging.error(f"{e} Cannot resolve gray zone matches.")
         return []
 
     logging.info(
-        f"Resolving {len(gray_zone_df)} gray-zone matches with Gemini...")
+        f"Resolving {len(gray_zone_df)} gray-zone matches with {backend.model}...")
 
-    # --- UPDATED: New Client Syntax ---
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    cache = get_llm_cache()
 
     confirmed_links = []
 
@@ -211,19 +243,17 @@ def get_llm_verdicts(gray_zone_df: pl.DataFrame) -> List[Dict]:
         """
 
         try:
-            # --- UPDATED: New Generation Call ---
-            response = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type='application/json'
-                )
-            )
+            response_text = cache.get(backend.model, prompt)
+            fresh = response_text is None
+            if fresh:
+                response_text = backend.generate(prompt)
 
             # Clean and parse the JSON response
             cleaned_response = re.search(
-                r"\[.*\]", response.text, re.DOTALL).group(0)
+                r"\[.*\]", response_text, re.DOTALL).group(0)
             verdicts = json.loads(cleaned_response)
+            if fresh:
+                cache.set(backend.model, prompt, response_text)
 
             for idx, verdict in enumerate(verdicts):
                 if verdict is True:
@@ -233,6 +263,8 @@ def get_llm_verdicts(gray_zone_df: pl.DataFrame) -> List[Dict]:
                 f"An error occurred during LLM resolution for batch {i//LLM_BATCH_SIZE + 1}: {e}")
 
     logging.info(f"LLM confirmed {len(confirmed_links)} additional matches.")
+    logging.info(cache.summary())
+    logging.info(backend.summary())
     return confirmed_links
 
 # --- Main Orchestration ---
@@ -257,13 +289,21 @@ def main():
             subsidiaries_df, fda_df)
 
         # Write auto-accepted matches to Neo4j
+        confirmed = []
         if not auto_accept_df.is_empty():
-            link_subsidiary_to_facility(driver, auto_accept_df.to_dicts())
+            auto_links = facility_link_rows(auto_accept_df.to_dicts())
+            link_subsidiary_to_facility(driver, auto_links.to_dicts())
+            confirmed.append(auto_links)
 
         # Step 3: LLM Resolution
         llm_confirmed_links = get_llm_verdicts(gray_zone_df)
         if llm_confirmed_links:
-            link_subsidiary_to_facility(driver, llm_confirmed_links)
+            llm_links = facility_link_rows(llm_confirmed_links)
+            link_subsidiary_to_facility(driver, llm_links.to_dicts())
+            confirmed.append(llm_links)
+
+        if confirmed:
+            save_facility_links(pl.concat(confirmed))
 
         logging.info("✅ Facility enrichment process completed successfully.")
 
@@ -276,7 +316,7 @@ def main():
 
 
 if __name__ == "__main__":
-    if not GEMINI_API_KEY:
+    if not GEMINI_API_KEY and LLM_BACKEND != "local":
         logging.warning(
             "GEMINI_API_KEY environment variable not found. LLM resolution will be skipped.")
     main()
@@ -1,6 +1,9 @@
 import polars as pl
 from neo4j import GraphDatabase, basic_auth
+from neo4j.exceptions import TransientError
+from concurrent.futures import ThreadPoolExecutor
 import os
+import sys
 import time
 
 # --- Configuration ---
@@ -10,39 +13,328 @@ NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 # Use the password you set in docker-compose
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
 DATA_PATH = "data/processed/ndc_entity_map.parquet"
+# Row hashes of the map as of the last successful hydration (--delta compares against it)
+SNAPSHOT_PATH = "data/processed/ndc_entity_map_hydrated.parquet"
+SNAPSHOT_COLUMNS = ["ndc11", "drug_description", "manufacturer", "ingredient", "labeler_id"]
+BATCH_SIZE = 1000
+# Concurrent sessions per phase (each writes its own partition of the rows)
+WRITER_SESSIONS = int(os.getenv("HYDRATE_WRITERS", "4"))
+# Retries of one batch after a TransientError (deadlock, lock timeout), with
+# exponential backoff starting at RETRY_BACKOFF_SECONDS
+BATCH_RETRIES = int(os.getenv("HYDRATE_BATCH_RETRIES", "3"))
+RETRY_BACKOFF_SECONDS = 0.5
 
-# --- Cypher Query ---
-# MERGE ensures we don't create duplicates.
-# We create the entire chain: Corporation -> Subsidiary -> NDC -> Ingredient
-INGEST_QUERY = """
+# --- Cypher Queries ---
+# Phase 1: distinct nodes, one label at a time (MERGE hits the unique
+# constraints from setup_db.py, so re-runs don't create duplicates).
+NODE_QUERIES = {
+    "Corporation": """
+UNWIND $batch AS row
+MERGE (:Corporation {name: row.name})
+""",
+    "Subsidiary": """
+UNWIND $batch AS row
+MERGE (:Subsidiary {labeler_id: row.labeler_id})
+""",
+    "Ingredient": """
+UNWIND $batch AS row
+MERGE (:Ingredient {name: row.name})
+""",
+    "NDC": """
 UNWIND $batch AS row
-MERGE (corp:Corporation {name: row.manufacturer})
-MERGE (sub:Subsidiary {labeler_id: row.labeler_id})
-MERGE (corp)-[:OWNS]->(sub)
-
-MERGE (ing:Ingredient {name: row.ingredient})
-
 MERGE (n:NDC {ndc11: row.ndc11})
 SET n.description = row.drug_description
+""",
+}
+
+# Phase 2: relationships between nodes that now exist, so each row is two
+# index lookups and one MERGE.
+# The chain: Corporation -> Subsidiary -> NDC -> Ingredient
+RELATIONSHIP_QUERIES = {
+    "OWNS": """
+UNWIND $batch AS row
+MATCH (corp:Corporation {name: row.manufacturer})
+MATCH (sub:Subsidiary {labeler_id: row.labeler_id})
+MERGE (corp)-[:OWNS]->(sub)
+""",
+    "MARKETS": """
+UNWIND $batch AS row
+MATCH (sub:Subsidiary {labeler_id: row.labeler_id})
+MATCH (n:NDC {ndc11: row.ndc11})
 MERGE (sub)-[:MARKETS]->(n)
+""",
+    "CONTAINS": """
+UNWIND $batch AS row
+MATCH (n:NDC {ndc11: row.ndc11})
+MATCH (ing:Ingredient {name: row.ingredient})
 MERGE (n)-[:CONTAINS]->(ing)
+""",
+}
+
+# Delta mode: removals run before the upserts, orphan pruning after them.
+DETACH_NDC_QUERY = """
+UNWIND $batch AS row
+MATCH (n:NDC {ndc11: row.ndc11})-[r:MARKETS|CONTAINS]-()
+DELETE r
+"""
+DELETE_NDC_QUERY = """
+UNWIND $batch AS row
+MATCH (n:NDC {ndc11: row.ndc11})
+DETACH DELETE n
+"""
+DELETE_OWNS_QUERY = """
+UNWIND $batch AS row
+MATCH (:Corporation {name: row.manufacturer})-[r:OWNS]->(:Subsidiary {labeler_id: row.labeler_id})
+DELETE r
 """
+# Only nodes left without any relationship go (a Corporation that still
+# OPERATES a Facility is kept).
+PRUNE_QUERIES = {
+    "Corporation": """
+UNWIND $batch AS row
+MATCH (c:Corporation {name: row.name})
+WHERE NOT (c)--()
+DELETE c
+""",
+    "Subsidiary": """
+UNWIND $batch AS row
+MATCH (s:Subsidiary {labeler_id: row.labeler_id})
+WHERE NOT (s)--()
+DELETE s
+""",
+    "Ingredient": """
+UNWIND $batch AS row
+MATCH (i:Ingredient {name: row.name})
+WHERE NOT (i)--()
+DELETE i
+""",
+}
+
+# Writers are partitioned on the high-degree end of each relationship: every
+# edge touching a given Subsidiary / Ingredient goes through one session, and
+# the other end (mostly a single NDC) belongs to one row only, so concurrent
+# transactions don't wait on each other's node locks. Both ends of OWNS are
+# shared hubs (a Corporation owns many Subsidiaries, relabelers tie a
+# Subsidiary to several Corporations), so it has no safe split and runs on a
+# single session; it is the smallest relationship phase.
+RELATIONSHIP_PARTITION_KEYS = {
+    "OWNS": None,
+    "MARKETS": "labeler_id",
+    "CONTAINS": "ingredient",
+}
+
+
+def partition_rows(df, key, writers=WRITER_SESSIONS):
+    """Splits `df` into at most `writers` frames; rows sharing `key` land in the same one."""
+    if df.is_empty():
+        return []
+    if writers <= 1:
+        return [df]
+    return (
+        df.with_columns((pl.col(key).hash() % writers).alias("_writer"))
+        .partition_by("_writer", include_key=False, maintain_order=True)
+    )
+
+
+def node_frames(df):
+    """Distinct node keys (and NDC properties) per label."""
+    return {
+        "Corporation": df.select(pl.col("manufacturer").alias("name")).drop_nulls().unique(maintain_order=True),
+        "Subsidiary": df.select("labeler_id").drop_nulls().unique(maintain_order=True),
+        "Ingredient": df.select(pl.col("ingredient").alias("name")).drop_nulls().unique(maintain_order=True),
+        # Last description wins, as with the old per-row SET
+        "NDC": (
+            df.select("ndc11", "drug_description")
+            .drop_nulls("ndc11")
+            .unique(subset=["ndc11"], keep="last", maintain_order=True)
+        ),
+    }
+
+
+def plan_hydration(df, writers=WRITER_SESSIONS):
+    """
+    Entity map -> ordered list of phases ({"name", "query", "partitions"}).
+    All node phases come before any relationship phase; relationships run
+    one type at a time since MARKETS and CONTAINS share the NDC nodes.
+    No database access, so the plan can be inspected and tested on its own.
+
+    Args:
+        df (pl.DataFrame): ndc_entity_map rows.
+        writers (int): Sessions per phase.
+    """
+    nodes = node_frames(df)
+    relationships = {
+        "OWNS": df.select("manufacturer", "labeler_id"),
+        "MARKETS": df.select("labeler_id", "ndc11"),
+        "CONTAINS": df.select("ndc11", "ingredient"),
+    }
+
+    phases = []
+    for label, frame in nodes.items():
+        # Distinct keys never contend, so any split will do
+        key = frame.columns[0]
+        phases.append({"name": f"{label} nodes", "query": NODE_QUERIES[label],
+                       "partitions": partition_rows(frame, key, writers)})
+    for rel_type, frame in relationships.items():
+        frame = frame.drop_nulls().unique(maintain_order=True)
+        key = RELATIONSHIP_PARTITION_KEYS[rel_type]
+        phases.append({"name": f"{rel_type} relationships", "query": RELATIONSHIP_QUERIES[rel_type],
+                       "partitions": partition_rows(frame, key, writers if key else 1)})
+    return phases
+
+
+def snapshot_hashes(df):
+    """One row per NDC: the graph-relevant columns plus their row hash."""
+    return (
+        df.select(SNAPSHOT_COLUMNS)
+        .drop_nulls("ndc11")
+        .unique(subset=["ndc11"], keep="last", maintain_order=True)
+        .with_columns(pl.struct(SNAPSHOT_COLUMNS).hash().alias("row_hash"))
+    )
 
 
-def ingest_batch(tx, batch_data):
+def diff_entity_map(current, snapshot):
     """
-    Transaction function to execute the batch ingest.
+    (inserted, updated, removed) rows between the hydrated snapshot and the
+    current map. inserted/updated hold current values, removed holds the
+    snapshot's. Polars hashes are only stable within a Polars version; after
+    an upgrade every row looks updated and is simply re-upserted.
     """
-    tx.run(INGEST_QUERY, batch=batch_data)
+    current = snapshot_hashes(current)
+    inserted = current.join(snapshot, on="ndc11", how="anti")
+    updated = current.join(snapshot.select("ndc11", "row_hash"), on="ndc11", how="inner", suffix="_old").filter(
+        pl.col("row_hash") != pl.col("row_hash_old")
+    ).drop("row_hash_old")
+    removed = snapshot.join(current, on="ndc11", how="anti")
+    return inserted, updated, removed
 
 
-def hydrate_graph():
+def plan_delta(current, snapshot, writers=WRITER_SESSIONS):
+    """
+    Phases that bring a graph hydrated from `snapshot` in line with `current`:
+    1. drop removed NDCs, the edges of updated NDCs and OWNS pairs no row has any more;
+    2. the normal staged upsert of inserted + updated rows;
+    3. prune Corporation/Subsidiary/Ingredient nodes that lost every relationship.
+    Deletes lock both ends of each edge and can't be split on one hub, so
+    they run on a single session; they are small next to the upserts.
+
+    Args:
+        current (pl.DataFrame): ndc_entity_map rows now.
+        snapshot (pl.DataFrame): snapshot_hashes() of the last hydrated map.
+        writers (int): Sessions per upsert phase.
+    """
+    inserted, updated, removed = diff_entity_map(current, snapshot)
+    current_keys = snapshot_hashes(current)
+    stale_owns = (
+        snapshot.select("manufacturer", "labeler_id").drop_nulls().unique(maintain_order=True)
+        .join(current_keys.select("manufacturer", "labeler_id"), on=["manufacturer", "labeler_id"], how="anti")
+    )
+
+    phases = [
+        {"name": "NDC deletes", "query": DELETE_NDC_QUERY,
+         "partitions": partition_rows(removed.select("ndc11"), "ndc11", 1)},
+        {"name": "NDC edge resets", "query": DETACH_NDC_QUERY,
+         "partitions": partition_rows(updated.select("ndc11"), "ndc11", 1)},
+        {"name": "OWNS deletes", "query": DELETE_OWNS_QUERY,
+         "partitions": partition_rows(stale_owns, "manufacturer", 1)},
+    ]
+    phases += plan_hydration(pl.concat([inserted, updated]), writers)
+
+    # Hub nodes the old versions of removed/updated rows pointed at that no current row references
+    previous = snapshot.join(pl.concat([removed, updated]).select("ndc11"), on="ndc11", how="semi")
+    previous_nodes, current_nodes = node_frames(previous), node_frames(current_keys)
+    for label, query in PRUNE_QUERIES.items():
+        key = previous_nodes[label].columns[0]
+        orphans = previous_nodes[label].join(current_nodes[label].select(key), on=key, how="anti")
+        phases.append({"name": f"{label} prunes", "query": query,
+                       "partitions": partition_rows(orphans, key, 1)})
+    return phases
+
+
+def ingest_batch(tx, query, batch_data):
+    """
+    Transaction function to execute one batch of a phase.
+    """
+    tx.run(query, batch=batch_data)
+
+
+def write_batch(session, query, batch, retries=BATCH_RETRIES):
+    """
+    Writes one batch, retrying it after a TransientError (e.g. a deadlock
+    between concurrent writers) with exponential backoff. Batches are MERGEs,
+    so a retried batch never duplicates anything.
+    """
+    for attempt in range(retries + 1):
+        try:
+            # UPDATED FOR NEO4J 5.x: write_transaction -> execute_write
+            return session.execute_write(ingest_batch, query, batch)
+        except TransientError as e:
+            if attempt == retries:
+                raise
+            print(f"   ⏳ Transient error, retrying batch ({attempt + 1}/{retries}): {e}")
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+def write_partition(driver, query, partition, batch_size=BATCH_SIZE):
+    """Writes one partition in batches on its own session. Returns rows written."""
+    records = partition.to_dicts()
+    written = 0
+    with driver.session(database="neo4j") as session:
+        for i in range(0, len(records), batch_size):
+            batch = records[i: i + batch_size]
+            write_batch(session, query, batch)
+            written += len(batch)
+    return written
+
+
+def run_phase(driver, phase, batch_size=BATCH_SIZE):
+    """
+    Runs a phase's partitions on concurrent sessions.
+    Returns (rows written, seconds); raises the first writer error.
+    """
+    started = time.time()
+    partitions = phase["partitions"]
+    if not partitions:
+        return 0, 0.0
+    with ThreadPoolExecutor(max_workers=len(partitions)) as pool:
+        futures = [pool.submit(write_partition, driver, phase["query"], partition, batch_size)
+                   for partition in partitions]
+        written = sum(future.result() for future in futures)
+    return written, time.time() - started
+
+
+def run_phases(driver, phases, batch_size=BATCH_SIZE):
+    """
+    Runs phases in order, printing rows/sec for each.
+    Stops at the first failed phase (later phases depend on its nodes).
+    Returns {phase name: (rows, seconds)} for the phases that completed.
+    """
+    stats = {}
+    for phase in phases:
+        try:
+            rows, seconds = run_phase(driver, phase, batch_size)
+        except Exception as e:
+            print(f"\n❌ Error in phase '{phase['name']}': {e}")
+            break
+        stats[phase["name"]] = (rows, seconds)
+        rate = rows / seconds if seconds else 0.0
+        print(f"      {phase['name']:<24} {rows:>10,} rows in {seconds:6.2f}s "
+              f"({rate:,.0f} rows/sec, {len(phase['partitions'])} writer(s))")
+    return stats
+
+
+def hydrate_frame(driver, df, writers=WRITER_SESSIONS, batch_size=BATCH_SIZE):
+    """Loads a whole entity map frame (see plan_hydration)."""
+    return run_phases(driver, plan_hydration(df, writers), batch_size)
+
+
+def hydrate_graph(delta=False, data_path=DATA_PATH, snapshot_path=SNAPSHOT_PATH):
     print("🚀 Starting graph hydration process...")
 
     # 1. Load Data
     try:
-        df = pl.read_parquet(DATA_PATH)
-        print(f"✅ Loaded {df.height:,} records from '{DATA_PATH}'.")
+        df = pl.read_parquet(data_path)
+        print(f"✅ Loaded {df.height:,} records from '{data_path}'.")
     except Exception as e:
         print(f"❌ Failed to load data: {e}")
         return
@@ -58,41 +350,36 @@ def hydrate_graph():
         print(f"❌ Connection failed: {e}")
         return
 
-    # 3. Ingest in Batches
-    BATCH_SIZE = 1000
-    total_rows = df.height
-
-    # Convert Polars DataFrame to a list of dictionaries for Neo4j
-    # (Polars .to_dicts() is fast and memory efficient)
-    records = df.to_dicts()
-
-    print(f"   Ingesting data in batches of {BATCH_SIZE}...")
+    # 3. Ingest in Phases (nodes first, then relationships)
+    if delta and not os.path.exists(snapshot_path):
+        print("   ⚠️ No hydration snapshot yet; running a full load.")
+        delta = False
+    print(f"   Ingesting in batches of {BATCH_SIZE} on up to {WRITER_SESSIONS} sessions...")
     start_time = time.time()
+    if delta:
+        snapshot = pl.read_parquet(snapshot_path)
+        inserted, updated, removed = diff_entity_map(df, snapshot)
+        print(f"   🔁 Delta: {inserted.height:,} inserted, {updated.height:,} updated, "
+              f"{removed.height:,} removed NDCs.")
+        phases = plan_delta(df, snapshot)
+    else:
+        phases = plan_hydration(df)
+    stats = run_phases(driver, phases)
 
-    with driver.session(database="neo4j") as session:
-        for i in range(0, total_rows, BATCH_SIZE):
-            batch = records[i: i + BATCH_SIZE]
-
-            try:
-                # UPDATED FOR NEO4J 5.x: write_transaction -> execute_write
-                session.execute_write(ingest_batch, batch)
-
-                # Progress bar effect
-                if (i // BATCH_SIZE) % 10 == 0:
-                    print(
-                        f"      Processed {i + len(batch):,} / {total_rows:,} rows...", end="\r")
-            except Exception as e:
-                print(f"\n❌ Error on batch starting at index {i}: {e}")
-                break
+    # Only a complete run becomes the baseline for the next delta
+    if len(stats) == len(phases):
+        snapshot_hashes(df).write_parquet(snapshot_path)
+        print(f"   💾 Saved hydration snapshot to: {snapshot_path}")
 
     end_time = time.time()
     duration = end_time - start_time
     print(
-        f"\n✅ Hydration Complete! Processed {total_rows:,} nodes in {duration:.2f} seconds.")
+        f"\n✅ Hydration Complete! Processed {df.height:,} rows in {duration:.2f} seconds.")
 
     driver.close()
     print("🔌 Connection to Neo4j closed.")
 
 
 if __name__ == "__main__":
-    hydrate_graph()
+    # python src/graph/hydrate_baseline.py [--delta]
+    hydrate_graph(delta="--delta" in sys.argv)
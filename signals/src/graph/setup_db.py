@@ -63,6 +63,7 @@ def create_constraints(db: Neo4jDatabase):
         "NDC": "CREATE CONSTRAINT IF NOT EXISTS FOR (n:NDC) REQUIRE n.ndc11 IS UNIQUE",
         "Ingredient": "CREATE CONSTRAINT IF NOT EXISTS FOR (i:Ingredient) REQUIRE i.name IS UNIQUE",
         "Corporation": "CREATE CONSTRAINT IF NOT EXISTS FOR (c:Corporation) REQUIRE c.name IS UNIQUE",
+        "Subsidiary": "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Subsidiary) REQUIRE s.labeler_id IS UNIQUE",
         "Facility": "CREATE CONSTRAINT IF NOT EXISTS FOR (f:Facility) REQUIRE f.fei_number IS UNIQUE"
     }
 
@@ -1,46 +1,63 @@
-import requests
 import polars as pl
 import os
-import time
+import sys
+import json
 from datetime import datetime
 
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.openfda_client import get_client, OpenFDAClient, OpenFDAError, records_to_frame
+from src.ingestion.raw_cache import get_cache, REPLAY_DEFAULT
+
 # ==========================================
 # CONFIGURATION
 # ==========================================
 API_URL = "https://api.fda.gov/drug/shortages.json"
 PROCESSED_DATA_PATH = "data/processed"
+EVENTS_FILE = "shortage_events.parquet"
+SYNC_STATE_FILE = "shortage_sync_state.json"
+
+# An event is the same event if these match; a re-synced record replaces it
+# (including its event_date, which openFDA revises). record_id is the
+# record's package NDC / presentation when the API provides one, else its
+# initial posting date, which keeps sibling records (other strengths of the
+# same generic) apart. Events with no record_id at all are only deduplicated
+# when identical.
+EVENT_KEY = ["event_type", "generic_name", "company_name", "record_id"]
+# Record fields that identify one shortage record, first present wins.
+RECORD_ID_FIELDS = ["package_ndc", "presentation", "initial_posting_date"]
+
+# Raw record fields read by process_shortages (all strings in the API)
+RECORD_SCHEMA = {
+    name: pl.Utf8 for name in [
+        "generic_name", "company_name", "shortage_reason", "status",
+        "initial_posting_date", "change_date", "status_change_date", "update_date",
+        "package_ndc", "presentation",
+    ]
+}
 
 
-def fetch_all_shortages():
+def fetch_all_shortages(client=None, updated_since=None):
     """
-    Paginate through the openFDA API to get ALL shortage records.
+    Paginate through the openFDA API to get ALL shortage records,
+    or only those updated on/after `updated_since` (a date).
+    Returns None if the download could not be completed.
     """
     print("🚀 Starting FDA Shortage Ingestion...")
-    all_records = []
-    skip = 0
-    limit = 1000
-
-    while True:
-        params = {"limit": limit, "skip": skip}
-        try:
-            # print(f"   📡 Fetching records {skip} to {skip + limit}...")
-            response = requests.get(API_URL, params=params)
-            data = response.json()
-
-            if "error" in data:
-                break
-
-            results = data.get("results", [])
-            if not results:
-                break
+    client = client or get_client()
 
-            all_records.extend(results)
-            skip += limit
-            time.sleep(0.5)
+    search = None
+    if updated_since is not None:
+        search = f"update_date:[{updated_since:%Y%m%d} TO 29991231]"
+        print(f"   🔎 Incremental sync: records updated since {updated_since}")
 
-        except Exception as e:
-            print(f"   ❌ Network Error: {e}")
-            break
+    try:
+        all_records = client.fetch_all(API_URL, search=search)
+    except OpenFDAError as e:
+        print(f"   ❌ Network Error: {e}")
+        return None
 
     print(f"   📥 Total Raw Records Fetched: {len(all_records)}")
     return all_records
@@ -55,58 +72,51 @@ def process_shortages(raw_records):
 
     print("   ⚙️  Processing Event Stream...")
 
-    events = []
-
-    for r in raw_records:
-        # 1. Safe Extraction
-        generic_name = r.get("generic_name", "UNKNOWN").upper()
-        company = r.get("company_name", "UNKNOWN").upper()
-        reason = r.get("shortage_reason", "UNKNOWN")
+    # 1. Columnar load: only the fields we use, missing keys become nulls
+    records = records_to_frame(raw_records, RECORD_SCHEMA)
 
-        # 2. Extract Date Fields
-        # The logs showed format is "MM/DD/YYYY"
-        start_date_str = r.get("initial_posting_date")
+    def present(name):
+        # Empty strings count as missing, like the API's blank date fields
+        return pl.when(pl.col(name).str.len_chars() > 0).then(pl.col(name))
 
+    base = records.select(
+        pl.col("generic_name").fill_null("UNKNOWN").str.to_uppercase(),
+        pl.col("company_name").fill_null("UNKNOWN").str.to_uppercase().alias("company_name"),
+        pl.coalesce(present(f) for f in RECORD_ID_FIELDS).alias("record_id"),
+        pl.col("shortage_reason").fill_null("UNKNOWN").alias("reason"),
+        present("initial_posting_date").alias("start_date"),
         # Fallback chain for the "End Date"
-        change_date_str = (
-            r.get("change_date") or
-            r.get("status_change_date") or
-            r.get("update_date")  # Added based on your inspection logs
-        )
+        pl.coalesce(present("change_date"), present("status_change_date"),
+                    present("update_date")).alias("change_date"),
+        pl.col("status").fill_null("Current"),
+    )
+
+    # 2. "Shortage Start" events
+    starts = base.filter(pl.col("start_date").is_not_null()).select(
+        pl.col("start_date").alias("event_date"),
+        pl.lit("shortage_start").alias("event_type"),
+        "generic_name", "company_name", "record_id", "reason",
+        pl.lit("Active").alias("status_at_event"),
+    )
+
+    # 3. "Shortage Resolved" events
+    # Only create this if we know for sure it's resolved
+    resolved = base.filter(
+        (pl.col("status") == "Resolved") & pl.col("change_date").is_not_null()
+    ).select(
+        pl.col("change_date").alias("event_date"),
+        pl.lit("shortage_resolved").alias("event_type"),
+        "generic_name", "company_name", "record_id", "reason",
+        pl.lit("Resolved").alias("status_at_event"),
+    )
 
-        status = r.get("status", "Current")
-
-        # 3. Create "Shortage Start" Event
-        if start_date_str:
-            events.append({
-                "event_date": start_date_str,
-                "event_type": "shortage_start",
-                "generic_name": generic_name,
-                "company_name": company,
-                "reason": reason,
-                "status_at_event": "Active"
-            })
-
-        # 4. Create "Shortage Resolved" Event
-        # Only create this if we know for sure it's resolved
-        if status == "Resolved" and change_date_str:
-            events.append({
-                "event_date": change_date_str,
-                "event_type": "shortage_resolved",
-                "generic_name": generic_name,
-                "company_name": company,
-                "reason": reason,
-                "status_at_event": "Resolved"
-            })
-
-    if not events:
+    df = pl.concat([starts, resolved])
+    if df.is_empty():
         print("   ⚠️ No events generated.")
         return None
 
-    # 5. Robust Date Parsing (Polars)
+    # 4. Robust Date Parsing (Polars)
     # We now handle MM/DD/YYYY (US standard) specifically
-    df = pl.DataFrame(events)
-
     df = (
         df
         .with_columns(
@@ -121,17 +131,142 @@ def process_shortages(raw_records):
     return df
 
 
-def run_pipeline():
-    raw_data = fetch_all_shortages()
+def newest_update_date(raw_records):
+    """
+    Latest update_date across the records (the next sync watermark). Only
+    update_date counts: it is the field the incremental search filters on.
+    """
+    if not raw_records:
+        return None
+    dates = records_to_frame(raw_records, {"update_date": pl.Utf8})
+    return dates.select(
+        pl.col("update_date").str.strptime(pl.Date, "%m/%d/%Y", strict=False).max()
+    ).item()
+
+
+def load_sync_state(processed_path=PROCESSED_DATA_PATH):
+    state_path = os.path.join(processed_path, SYNC_STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_sync_state(state, processed_path=PROCESSED_DATA_PATH):
+    os.makedirs(processed_path, exist_ok=True)
+    with open(os.path.join(processed_path, SYNC_STATE_FILE), "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def merge_events(existing_df, new_df):
+    """
+    Upserts events by EVENT_KEY: a re-synced event replaces its stored
+    version, also when openFDA moved its date. Only events with a record_id
+    are matched that way; the others are kept and deduplicated as exact rows.
+    """
+    if "record_id" not in existing_df.columns:  # written before record ids were kept
+        existing_df = existing_df.with_columns(pl.lit(None, dtype=pl.Utf8).alias("record_id"))
+    has_id = pl.col("record_id").is_not_null()
+    carried = existing_df.filter(has_id).join(
+        new_df.filter(has_id).select(EVENT_KEY), on=EVENT_KEY, how="anti")
+    return (
+        pl.concat([carried, existing_df.filter(~has_id), new_df], how="diagonal_relaxed")
+        .select(new_df.columns)
+        .unique()
+        .sort("event_date")
+    )
+
+
+def cached_syncs(cache):
+    """
+    Searches of the syncs to replay, oldest first: the latest full download
+    (search=None) followed by every incremental sync fetched after it.
+    """
+    first_pages = [e for e in cache.entries(API_URL)
+                   if int(e["params"].get("skip", 0)) == 0]
+    full = [i for i, e in enumerate(first_pages) if "search" not in e["params"]]
+    if not full:
+        return []
+    syncs = []
+    for entry in first_pages[full[-1]:]:
+        search = entry["params"].get("search")
+        if search in syncs:
+            syncs.remove(search)
+        syncs.append(search)
+    return syncs
+
+
+def replay_shortages(processed_path=PROCESSED_DATA_PATH, cache=None):
+    """
+    Rebuilds shortage_events.parquet from the raw cache with no network access,
+    applying the cached syncs in the order they originally ran.
+    """
+    print("⏪ Replaying FDA Shortage Ingestion from raw cache...")
+    cache = cache or get_cache()
+    client = OpenFDAClient(cache=cache, replay=True)
+
+    syncs = cached_syncs(cache)
+    if not syncs:
+        print("   ⚠️ No full shortage download in the raw cache; nothing to replay.")
+        return None
+
+    df = None
+    for search in syncs:
+        try:
+            records = client.fetch_all(API_URL, search=search)
+        except OpenFDAError as e:
+            print(f"   ❌ Incomplete cache: {e}")
+            return None
+        events = process_shortages(records) if records else None
+        if events is None:
+            continue
+        df = events if df is None else merge_events(df, events)
+
+    if df is not None:
+        output_path = os.path.join(processed_path, EVENTS_FILE)
+        os.makedirs(processed_path, exist_ok=True)
+        df.write_parquet(output_path)
+        print(f"   ✅ Replayed {len(syncs)} sync(s): {df.height} events.")
+        print(f"   💾 Saved to: {output_path}")
+    return df
+
+
+def run_pipeline(full_refresh=False, processed_path=PROCESSED_DATA_PATH, client=None,
+                 replay=REPLAY_DEFAULT):
+    """
+    Syncs shortage_events.parquet. After the first full download only records
+    updated since the stored watermark are requested and merged in; the
+    watermark day itself is re-read so same-day revisions are never missed.
+    With replay=True the events are rebuilt from the raw cache instead.
+    """
+    if replay:
+        replay_shortages(processed_path)
+        return
+
+    output_path = os.path.join(processed_path, EVENTS_FILE)
+    state = load_sync_state(processed_path)
+
+    watermark = None
+    if not full_refresh and state.get("watermark") and os.path.exists(output_path):
+        watermark = datetime.strptime(state["watermark"], "%Y-%m-%d").date()
+
+    raw_data = fetch_all_shortages(client, updated_since=watermark)
+    if raw_data is None:
+        return
     if not raw_data:
+        print("   ✅ No shortage records changed since the last sync.")
         return
 
     df = process_shortages(raw_data)
 
     if df is not None:
-        os.makedirs(PROCESSED_DATA_PATH, exist_ok=True)
-        output_path = os.path.join(
-            PROCESSED_DATA_PATH, "shortage_events.parquet")
+        if watermark is not None:
+            existing = pl.read_parquet(output_path)
+            df = merge_events(existing, df)
+            print(f"   🔀 Merged {len(raw_data)} updated records into "
+                  f"{existing.height} stored events.")
+
+        os.makedirs(processed_path, exist_ok=True)
         df.write_parquet(output_path)
 
         print(f"   ✅ SUCCESS! Processed {df.height} historical events.")
@@ -140,6 +275,17 @@ def run_pipeline():
                 f"   📅 Date Range: {df['event_date'].min()} to {df['event_date'].max()}")
         print(f"   💾 Saved to: {output_path}")
 
+    newest = newest_update_date(raw_data)
+    if newest is not None and (watermark is None or newest > watermark):
+        watermark = newest
+    if watermark is not None:
+        save_sync_state({
+            "watermark": watermark.isoformat(),
+            "synced_at": datetime.now().isoformat(timespec="seconds"),
+            "records_fetched": len(raw_data),
+        }, processed_path)
+
 
 if __name__ == "__main__":
-    run_pipeline()
+    run_pipeline(full_refresh="--full-refresh" in sys.argv,
+                 replay="--replay" in sys.argv or REPLAY_DEFAULT)
@@ -1,59 +1,97 @@
 import polars as pl
 import os
+import sys
 import glob
+import csv
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion import nadac_store
+from src.entities.ndc_dictionary import update_ndc_dictionary, attach_ndc_id
 
 # ==========================================
 # CONFIGURATION
 # ==========================================
 RAW_DATA_PATH = "data/raw"
 PROCESSED_DATA_PATH = "data/processed"
+HISTORY_FILE = nadac_store.HISTORY_FILE
+MANIFEST_FILE = "nadac_manifest.parquet"
 
+# Streaming mode: rows per morsel each engine thread holds in flight
+# (NADAC_STREAMING_CHUNK_ROWS, default 0 = let Polars pick).
+STREAMING_CHUNK_ROWS = int(os.getenv("NADAC_STREAMING_CHUNK_ROWS", "0"))
 
-def normalize_and_load(file_path):
-    """
-    Reads a CSV, forces all headers to lowercase, applies standard naming,
-    and returns a clean LazyFrame.
-    """
-    # 1. Read (Lazy)
-    lf = pl.scan_csv(file_path, infer_schema_length=0)
+# Per-file normalization: parallel workers (NADAC_WORKERS, default = cores)
+# writing staged parquet keyed by content hash.
+STAGING_DIR = "nadac_staging"
+WORKERS = int(os.getenv("NADAC_WORKERS", "0"))
 
-    # 2. Force Lowercase Headers immediately
-    # This solves the "NDC" vs "ndc" issue forever.
-    # Proper way to get names in newer Polars
-    current_columns = lf.collect_schema().names()
-    lower_map = {col: col.lower() for col in current_columns}
-    lf = lf.rename(lower_map)
+# One row per raw CSV we have already folded into the history.
+MANIFEST_SCHEMA = {
+    "path": pl.Utf8,
+    "size_bytes": pl.Int64,
+    "mtime": pl.Float64,
+    "sha256": pl.Utf8,
+    "row_count": pl.Int64,
+    "min_date": pl.Date,
+    "max_date": pl.Date,
+    "ingested_at": pl.Datetime,
+}
 
-    # 3. Define our "Rosetta Stone" (All keys must be lowercase now)
-    rename_map = {
-        # Price
-        "nadac per unit": "price_per_unit",
-        "nadac_per_unit": "price_per_unit",
 
-        # Date
-        "effective date": "effective_date",
-        "effective_date": "effective_date",
+# "Rosetta Stone" (All keys must be lowercase)
+RENAME_MAP = {
+    # Price
+    "nadac per unit": "price_per_unit",
+    "nadac_per_unit": "price_per_unit",
 
-        # NDC
-        "ndc": "ndc11",
+    # Date
+    "effective date": "effective_date",
+    "effective_date": "effective_date",
 
-        # Description
-        "ndc description": "drug_description",
-        "ndc_description": "drug_description",
+    # NDC
+    "ndc": "ndc11",
 
-        # Classification
-        "classification for rate setting": "classification",
-        "classification_for_rate_setting": "classification"
-    }
+    # Description
+    "ndc description": "drug_description",
+    "ndc_description": "drug_description",
+
+    # Classification
+    "classification for rate setting": "classification",
+    "classification_for_rate_setting": "classification"
+}
+
+def read_header(file_path):
+    """Reads only the first line of a CSV."""
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
 
-    # 4. Apply Renaming
-    # We re-fetch columns because we just renamed them to lowercase
-    current_columns_lower = [c.lower() for c in current_columns]
-    actual_renames = {k: v for k,
-                      v in rename_map.items() if k in current_columns_lower}
-    lf = lf.rename(actual_renames)
 
-    # 5. Standardize Data Types
+def header_mapping(columns):
+    """Returns the {raw header: canonical name} rename map for a header layout."""
+    # Force lowercase first: this solves the "NDC" vs "ndc" issue forever.
+    return {col: RENAME_MAP.get(col.lower(), col.lower()) for col in columns}
+
+
+def normalize_and_load(file_path, column_map=None):
+    """
+    Reads a CSV, forces all headers to lowercase, applies standard naming,
+    and returns a clean LazyFrame.
+    """
+    if column_map is None:
+        column_map = header_mapping(read_header(file_path))
+
+    # 1. Read (Lazy) + Apply Renaming
+    lf = pl.scan_csv(file_path, infer_schema_length=0).rename(column_map)
+
+    # 2. Standardize Data Types
     lf = lf.select([
         pl.col("effective_date").str.strptime(
             pl.Date, "%m/%d/%Y", strict=False),
@@ -71,52 +109,377 @@ def normalize_and_load(file_path):
     return lf
 
 
-def fetch_and_process_nadac():
-    print("🚀 Starting NADAC Ingestion (Case-Insensitive Mode)...")
+def stage_file(file_path, column_map, staged_path):
+    """
+    Normalizes one raw CSV into a staged parquet file and returns its stats.
+    Runs inside a worker process, so it must stay a module-level function.
+    """
+    tmp_path = staged_path + ".tmp"
+    (
+        normalize_and_load(file_path, column_map)
+        .filter(pl.col("price_per_unit").is_not_null())
+        .sink_parquet(tmp_path, engine="streaming")
+    )
+    os.replace(tmp_path, staged_path)
+    return _staged_stats(staged_path)
+
+
+def _staged_stats(staged_path):
+    return pl.scan_parquet(staged_path).select([
+        pl.len().alias("row_count"),
+        pl.col("effective_date").min().alias("min_date"),
+        pl.col("effective_date").max().alias("max_date"),
+    ]).collect().row(0, named=True)
+
+
+@contextmanager
+def _worker_threads(threads):
+    """Caps Polars threads in spawned workers so N workers don't oversubscribe."""
+    previous = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(threads)
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("POLARS_MAX_THREADS", None)
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous
+
+
+def stage_files(entries, staging_path, workers=None):
+    """
+    Normalizes changed CSVs into staging_path/<sha256>.parquet across a
+    process pool. Content that is already staged is reused as-is, so a full
+    reload only parses CSVs it has never seen. Header layouts are resolved in
+    the parent (one line read per file) and shipped to the workers.
+
+    Fills row_count/min_date/max_date on each entry and returns
+    (staged entries, their parquet paths) in input order.
+    """
+    if workers is None:
+        workers = WORKERS or os.cpu_count() or 1
+    os.makedirs(staging_path, exist_ok=True)
+
+    jobs, results, duplicates = {}, {}, {}
+    scheduled = {}
+    for idx, entry in enumerate(entries):
+        staged_path = os.path.join(staging_path, f"{entry['sha256']}.parquet")
+        if os.path.exists(staged_path):
+            results[idx] = _staged_stats(staged_path)
+            continue
+        if staged_path in scheduled:
+            # Byte-identical copy of a file already queued in this run
+            duplicates[idx] = scheduled[staged_path]
+            continue
+        try:
+            # No header-fingerprint cache: resolving a layout is one line read
+            # plus a dict comprehension, done once here in the parent.
+            column_map = header_mapping(read_header(entry["path"]))
+        except Exception as e:
+            print(f"      ⚠️ Skipping {os.path.basename(entry['path'])}: {e}")
+            continue
+        jobs[idx] = (entry["path"], column_map, staged_path)
+        scheduled[staged_path] = idx
+
+    if jobs:
+        print(f"   ⚙️  Normalizing {len(jobs)} files on {min(workers, len(jobs))} workers...")
+    if len(jobs) <= 1 or workers <= 1:
+        for idx, args in jobs.items():
+            try:
+                results[idx] = stage_file(*args)
+            except Exception as e:
+                print(f"      ⚠️ Skipping {os.path.basename(args[0])}: {e}")
+    elif jobs:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with _worker_threads(threads):
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = {pool.submit(stage_file, *args): idx for idx, args in jobs.items()}
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    try:
+                        results[idx] = future.result()
+                    except Exception as e:
+                        print(f"      ⚠️ Skipping {os.path.basename(jobs[idx][0])}: {e}")
+
+    for idx, source_idx in duplicates.items():
+        if source_idx in results:
+            results[idx] = results[source_idx]
+
+    staged, paths = [], []
+    for idx, entry in enumerate(entries):
+        if idx not in results:
+            continue
+        entry.update(results[idx])
+        staged.append(entry)
+        paths.append(os.path.join(staging_path, f"{entry['sha256']}.parquet"))
+    return staged, paths
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """Content hash of a raw file, streamed so large CSVs never sit in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(processed_path=PROCESSED_DATA_PATH):
+    """Returns the ingest manifest, or an empty frame on first run."""
+    manifest_path = os.path.join(processed_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return pl.DataFrame(schema=MANIFEST_SCHEMA)
+    return pl.read_parquet(manifest_path)
+
+
+def plan_ingest(csv_files, manifest):
+    """
+    Splits the raw CSVs into files that need (re)normalizing and files we can skip.
+
+    A file is skipped without being opened when its path, size and mtime match
+    the manifest. If only the stat changed (touched, copied, renamed) we hash it
+    and still skip it when the content hash is already known.
+
+    Returns (changed, carried) where both are lists of manifest-shaped dicts;
+    'carried' rows keep their stored row_count/date range.
+    """
+    by_path = {row["path"]: row for row in manifest.to_dicts()}
+    by_hash = {row["sha256"]: row for row in manifest.to_dicts()}
+
+    changed, carried = [], []
+    for f in sorted(csv_files):
+        stat = os.stat(f)
+        entry = {"path": f, "size_bytes": stat.st_size, "mtime": stat.st_mtime}
+
+        known = by_path.get(f)
+        if known and known["size_bytes"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            carried.append(known)
+            continue
+
+        entry["sha256"] = file_sha256(f)
+        known = by_hash.get(entry["sha256"])
+        if known:
+            carried.append({**known, **entry})
+            continue
+
+        changed.append(entry)
+
+    return changed, carried
+
+
+def streaming_config(chunk_rows):
+    """
+    Polars config for the streaming run: caps the morsel size at chunk_rows
+    when set. This bounds per-thread working sets, not total memory; the
+    sort/unique state still grows with the data.
+    """
+    if not chunk_rows:
+        return nullcontext()
+    return pl.Config(streaming_chunk_size=chunk_rows)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size so far, in MB, as {"self", "children"} (None if
+    unavailable). "children" is the largest waited-for child process, i.e.
+    the stage_files workers.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports KB, macOS reports bytes
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def fetch_and_process_nadac(raw_path=RAW_DATA_PATH, processed_path=PROCESSED_DATA_PATH,
+                            full_refresh=False, partitioned=None, streaming=False,
+                            chunk_rows=None, workers=None):
+    """
+    Folds new or revised raw NADAC CSVs into the NADAC history.
+
+    Untouched files (per the manifest) are never re-read. Rows from a changed
+    file replace the existing history only for the effective dates that file
+    covers. Pass full_refresh=True to rebuild the history from every CSV.
+
+    partitioned selects the storage layout (see nadac_store); None follows
+    the NADAC_PARTITIONED environment setting.
+
+    Changed CSVs are normalized in parallel (see stage_files) and the merge
+    reads the staged parquet, never the CSVs.
+
+    streaming=True runs the consolidation on the Polars streaming engine and
+    sinks it straight to parquet instead of collecting the deduplicated
+    history in memory. chunk_rows overrides the engine's morsel size
+    (None follows NADAC_STREAMING_CHUNK_ROWS); there is no hard memory cap.
+
+    The run-length price table (nadac_store.build_price_runs) is refreshed
+    alongside the weekly history; incremental runs only rework the runs
+    around the replaced weeks (nadac_store.update_price_runs).
+
+    Returns a run summary (rows, date range, price runs, peak RSS of this
+    process and of the normalization workers) or None if nothing ran.
+    """
+    if partitioned is None:
+        partitioned = nadac_store.PARTITIONED_DEFAULT
+    if chunk_rows is None:
+        chunk_rows = STREAMING_CHUNK_ROWS
+
+    mode = "Streaming" if streaming else "In-Memory"
+    print(f"🚀 Starting NADAC Ingestion (Case-Insensitive, {mode} Mode)...")
 
-    csv_files = glob.glob(os.path.join(RAW_DATA_PATH, "*.csv"))
+    csv_files = glob.glob(os.path.join(raw_path, "*.csv"))
     if not csv_files:
         print("   ❌ No CSV files found!")
         return
 
-    print(f"   📂 Processing {len(csv_files)} files...")
+    manifest = load_manifest(processed_path)
+    previous_entries = manifest.to_dicts()
+    if full_refresh or not nadac_store.history_exists(processed_path):
+        manifest = pl.DataFrame(schema=MANIFEST_SCHEMA)
 
-    lazy_frames = []
-    for f in csv_files:
-        try:
-            lf = normalize_and_load(f)
-            lazy_frames.append(lf)
-        except Exception as e:
-            print(f"      ⚠️ Skipping {os.path.basename(f)}: {e}")
+    changed, carried = plan_ingest(csv_files, manifest)
+    print(f"   📂 {len(csv_files)} files found: {len(changed)} new/changed, "
+          f"{len(carried)} unchanged.")
 
-    if not lazy_frames:
+    if not changed:
+        print("   ✅ History is up to date. Nothing to ingest.")
+        _write_manifest(carried, processed_path)
         return
 
-    print("   🔗 Merging history...")
-    combined_lf = pl.concat(lazy_frames)
+    staging_path = os.path.join(processed_path, STAGING_DIR)
+    ingested, staged_paths = stage_files(changed, staging_path, workers)
+    if not ingested:
+        return
+    now = datetime.now()
+    for entry in ingested:
+        entry["ingested_at"] = now
 
-    # Final Polish
-    final_df = (
-        combined_lf
-        .filter(pl.col("price_per_unit").is_not_null())
-        .unique(subset=["effective_date", "ndc11"])
-        .sort(["effective_date", "ndc11"])
-        .collect()
-    )
+    engine = "streaming" if streaming else "auto"
+    config = streaming_config(chunk_rows) if streaming else nullcontext()
+
+    with config:
+        print("   🔗 Merging history...")
+        new_lf = (
+            pl.scan_parquet(staged_paths)
+            .unique(subset=["effective_date", "ndc11"], keep="last", maintain_order=True)
+        )
+
+        # Register new NDCs and key every row by its integer ndc_id; rows go
+        # to write_nadac_history ordered by (effective_date, ndc_id).
+        new_lf = _with_ndc_ids(new_lf, processed_path, engine).sort(["effective_date", "ndc_id"])
+        if not streaming:
+            new_lf = new_lf.collect().lazy()
+
+        # A revised file owns its effective dates: drop those weeks from the
+        # existing history and splice the new rows back in.
+        replace_all = True
+        replaced_window = None  # (first, last) replaced week on incremental runs
+        if manifest.is_empty():
+            merged = new_lf
+        else:
+            replaced_dates = new_lf.select(
+                pl.col("effective_date").unique()).collect(engine=engine)["effective_date"]
+            not_replaced = ~pl.col("effective_date").is_in(replaced_dates.implode())
+            print(f"   ♻️  Replacing {replaced_dates.len()} effective dates.")
+            replaced_window = (replaced_dates.min(), replaced_dates.max())
+
+            if partitioned and nadac_store.is_partitioned(processed_path):
+                # Only the months the new rows fall into are read and rewritten.
+                month_key = (pl.col("effective_date").dt.year() * 100
+                             + pl.col("effective_date").dt.month())
+                touched = replaced_dates.to_frame().select(
+                    month_key.unique().alias("month_key"))["month_key"]
+                start, end = nadac_store.month_bounds(replaced_dates)
+                existing = _with_ndc_ids(
+                    nadac_store.scan_nadac_history(
+                        processed_path, start_date=start, end_date=end)
+                    .filter(not_replaced & month_key.is_in(touched.implode())),
+                    processed_path, engine)
+                merged = pl.concat([existing, new_lf])
+                replace_all = False
+            else:
+                history = _with_ndc_ids(
+                    nadac_store.scan_nadac_history(processed_path).filter(not_replaced),
+                    processed_path, engine)
+                if nadac_store.is_partitioned(processed_path):
+                    history = history.sort(["effective_date", "ndc_id"])
+                merged = history.merge_sorted(new_lf, key="effective_date")
+
+        if streaming:
+            nadac_store.sink_nadac_history(
+                merged, processed_path, partitioned, replace_all=replace_all)
+        else:
+            nadac_store.write_nadac_history(
+                merged.collect(), processed_path, partitioned, replace_all=replace_all)
+
+        if replaced_window and nadac_store.price_runs_exist(processed_path):
+            price_runs = nadac_store.update_price_runs(processed_path, *replaced_window)
+        else:
+            price_runs = nadac_store.write_price_runs(processed_path, streaming)
 
     # Validation
-    row_count = final_df.height
-    min_date = final_df["effective_date"].min()
-    max_date = final_df["effective_date"].max()
+    summary = nadac_store.scan_nadac_history(processed_path).select([
+        pl.len().alias("rows"),
+        pl.col("effective_date").min().alias("min_date"),
+        pl.col("effective_date").max().alias("max_date"),
+    ]).collect().row(0, named=True)
+    summary["price_runs"] = price_runs
+    rss = peak_rss_mb()
+    summary["peak_rss_mb"] = rss and rss["self"]
+    summary["peak_worker_rss_mb"] = rss and rss["children"]
+
+    print(f"   ✅ SUCCESS! History Range: {summary['min_date']} to {summary['max_date']}")
+    print(f"   ✅ Total Rows: {summary['rows']:,} "
+          f"({summary['price_runs']:,} price runs)")
+    if rss is not None:
+        print(f"   📈 Peak RSS: {rss['self']:,.0f} MB "
+              f"(normalization workers: {rss['children']:,.0f} MB)")
+    layout = "partitioned" if partitioned else "flat"
+    print(f"   💾 Saved ({layout}) under: {processed_path}")
+
+    manifest_entries = carried + ingested
+    _write_manifest(manifest_entries, processed_path)
+    _prune_staging(staging_path, previous_entries, manifest_entries)
+    return summary
+
+
+def _with_ndc_ids(lf, processed_path, engine="auto"):
+    """
+    Attaches ndc_id from the global NDC dictionary, registering unseen NDCs.
+    History written before the dictionary existed is backfilled the same way.
+    """
+    if "ndc_id" in lf.collect_schema().names():
+        return lf
+    ndcs = lf.select(pl.col("ndc11").unique()).collect(engine=engine)["ndc11"]
+    dictionary = update_ndc_dictionary(ndcs, processed_path)
+    return attach_ndc_id(lf, dictionary).select(nadac_store.HISTORY_COLUMNS)
+
+
+def _prune_staging(staging_path, previous_entries, manifest_entries):
+    """
+    Drops the staged parquet of content the new manifest superseded. Anything
+    else in the staging dir (e.g. another run's in-flight .tmp files) is left alone.
+    """
+    keep = {entry["sha256"] for entry in manifest_entries}
+    for sha256 in {entry["sha256"] for entry in previous_entries} - keep:
+        staged_path = os.path.join(staging_path, f"{sha256}.parquet")
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
 
-    print(f"   ✅ SUCCESS! History Range: {min_date} to {max_date}")
-    print(f"   ✅ Total Rows: {row_count:,}")
 
-    os.makedirs(PROCESSED_DATA_PATH, exist_ok=True)
-    output_path = os.path.join(PROCESSED_DATA_PATH, "nadac_history.parquet")
-    final_df.write_parquet(output_path)
-    print(f"   💾 Saved to: {output_path}")
+def _write_manifest(entries, processed_path):
+    manifest = pl.DataFrame(entries, schema=MANIFEST_SCHEMA)
+    os.makedirs(processed_path, exist_ok=True)
+    manifest.sort("path").write_parquet(
+        os.path.join(processed_path, MANIFEST_FILE))
 
 
 if __name__ == "__main__":
-    fetch_and_process_nadac()
+    fetch_and_process_nadac(full_refresh="--full-refresh" in sys.argv,
+                            streaming="--streaming" in sys.argv)
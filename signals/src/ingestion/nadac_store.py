@@ -0,0 +1,410 @@
+import polars as pl
+import os
+import sys
+import glob
+import shutil
+from datetime import date, timedelta
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.entities.ndc_dictionary import lookup_ndc_ids
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+HISTORY_FILE = "nadac_history.parquet"
+# Hive layout: nadac_history/year=2024/month=01/part-0.parquet
+PARTITION_DIR = "nadac_history"
+PARTITION_FILE = "part-0.parquet"
+HISTORY_COLUMNS = ["effective_date", "ndc_id", "ndc11", "price_per_unit",
+                   "drug_description", "classification"]
+# Run-length (SCD2) form: one row per unbroken weekly run at a constant price.
+PRICE_RUNS_FILE = "nadac_price_runs.parquet"
+NADAC_CADENCE = "1w"
+
+# Small row groups keep the ndc_id min/max statistics tight, so a single-NDC
+# lookup only decodes the row groups whose range can contain it.
+ROW_GROUP_SIZE = 16_384
+
+# Set NADAC_PARTITIONED=1 to write the partitioned layout by default.
+PARTITIONED_DEFAULT = os.getenv("NADAC_PARTITIONED", "0") == "1"
+
+
+def history_path(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, HISTORY_FILE)
+
+
+def partition_root(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, PARTITION_DIR)
+
+
+def is_partitioned(processed_path=PROCESSED_DATA_PATH):
+    return bool(_partition_files(processed_path))
+
+
+def history_exists(processed_path=PROCESSED_DATA_PATH):
+    return is_partitioned(processed_path) or os.path.exists(history_path(processed_path))
+
+
+def _partition_key(file_path):
+    """'.../year=2024/month=01/part-0.parquet' -> (2024, 1)"""
+    month_dir = os.path.dirname(file_path)
+    year_dir = os.path.dirname(month_dir)
+    year = int(os.path.basename(year_dir).split("=", 1)[1])
+    month = int(os.path.basename(month_dir).split("=", 1)[1])
+    return year, month
+
+
+def _partition_files(processed_path, start_date=None, end_date=None):
+    """Partition files in (year, month) order, pruned to the requested date window."""
+    pattern = os.path.join(partition_root(processed_path),
+                           "year=*", "month=*", "*.parquet")
+    files = sorted(glob.glob(pattern), key=_partition_key)
+
+    if start_date is not None:
+        files = [f for f in files if _partition_key(f) >= (start_date.year, start_date.month)]
+    if end_date is not None:
+        files = [f for f in files if _partition_key(f) <= (end_date.year, end_date.month)]
+    return files
+
+
+def scan_nadac_history(processed_path=PROCESSED_DATA_PATH, ndc11=None,
+                       start_date=None, end_date=None):
+    """
+    The one way to read NADAC history. Returns a LazyFrame with HISTORY_COLUMNS.
+
+    Works on either the flat file or the partitioned layout. Filters are pushed
+    down: the date window prunes whole month partitions, and an ndc11 (or list
+    of ndc11s) is translated to ndc_ids and matched against row-group statistics.
+    """
+    if is_partitioned(processed_path):
+        files = _partition_files(processed_path, start_date, end_date)
+        if not files:
+            schema = pl.read_parquet_schema(_partition_files(processed_path)[0])
+            return pl.LazyFrame(schema=schema)
+        lf = pl.scan_parquet(files, hive_partitioning=False)
+    else:
+        lf = pl.scan_parquet(history_path(processed_path))
+
+    if start_date is not None:
+        lf = lf.filter(pl.col("effective_date") >= start_date)
+    if end_date is not None:
+        lf = lf.filter(pl.col("effective_date") <= end_date)
+
+    if ndc11 is not None:
+        lf = _filter_ndcs(lf, processed_path, ndc11)
+
+    return lf
+
+
+def _filter_ndcs(lf, processed_path, ndc11):
+    """Filters on the integer key when the table has one, on the string otherwise."""
+    if "ndc_id" not in lf.collect_schema().names():
+        wanted = [ndc11] if isinstance(ndc11, str) else list(ndc11)
+        return lf.filter(pl.col("ndc11").is_in(pl.Series(wanted, dtype=pl.Utf8).implode()))
+
+    ids = lookup_ndc_ids(ndc11, processed_path)
+    if len(ids) == 1:
+        return lf.filter(pl.col("ndc_id") == ids[0])
+    return lf.filter(pl.col("ndc_id").is_in(ids))
+
+
+def latest_effective_date(processed_path=PROCESSED_DATA_PATH):
+    """Most recent NADAC week. On the partitioned layout only the newest month is read."""
+    if is_partitioned(processed_path):
+        lf = pl.scan_parquet(_partition_files(processed_path)[-1])
+    else:
+        lf = pl.scan_parquet(history_path(processed_path))
+    return lf.select(pl.col("effective_date").max()).collect().item()
+
+
+def write_nadac_history(df, processed_path=PROCESSED_DATA_PATH, partitioned=None,
+                        replace_all=True):
+    """
+    Persists NADAC history in the flat or partitioned layout.
+
+    Partitioned writes sort each month by ndc_id and enable row-group statistics.
+    With replace_all=False only the months present in `df` are rewritten, which
+    is what incremental ingestion uses; the caller must pass complete months.
+    Switching layouts removes the other layout so readers never see stale data.
+    """
+    if partitioned is None:
+        partitioned = PARTITIONED_DEFAULT
+    os.makedirs(processed_path, exist_ok=True)
+
+    if not partitioned:
+        # Callers hand us rows already ordered by (effective_date, ndc_id).
+        df.write_parquet(history_path(processed_path), statistics=True)
+        if os.path.exists(partition_root(processed_path)):
+            shutil.rmtree(partition_root(processed_path))
+        return
+
+    root = partition_root(processed_path)
+    if replace_all and os.path.exists(root):
+        shutil.rmtree(root)
+
+    keyed = df.with_columns([
+        pl.col("effective_date").dt.year().alias("_year"),
+        pl.col("effective_date").dt.month().alias("_month"),
+    ])
+    for (year, month), part in keyed.group_by(["_year", "_month"]):
+        part_dir = _partition_dir(root, year, month)
+        os.makedirs(part_dir, exist_ok=True)
+        (
+            part
+            .drop(["_year", "_month"])
+            .sort(["ndc_id", "effective_date"])
+            .write_parquet(os.path.join(part_dir, PARTITION_FILE),
+                           statistics=True, row_group_size=ROW_GROUP_SIZE)
+        )
+
+    if os.path.exists(history_path(processed_path)):
+        os.remove(history_path(processed_path))
+
+
+def sink_nadac_history(lf, processed_path=PROCESSED_DATA_PATH, partitioned=None,
+                       replace_all=True):
+    """
+    Streaming counterpart of write_nadac_history: `lf` is executed by the
+    Polars streaming engine and sunk straight to parquet, so the full history
+    is never materialized. Output is staged and swapped in at the end, which
+    also makes it safe for `lf` to read the history it replaces.
+    """
+    if partitioned is None:
+        partitioned = PARTITIONED_DEFAULT
+    os.makedirs(processed_path, exist_ok=True)
+
+    if not partitioned:
+        tmp_path = history_path(processed_path) + ".tmp"
+        lf.sink_parquet(tmp_path, statistics=True, row_group_size=ROW_GROUP_SIZE,
+                        engine="streaming")
+        os.replace(tmp_path, history_path(processed_path))
+        if os.path.exists(partition_root(processed_path)):
+            shutil.rmtree(partition_root(processed_path))
+        return
+
+    root = partition_root(processed_path)
+    build_root = root + ".tmp"
+    staging_path = os.path.join(processed_path, "nadac_history.staging.parquet")
+    if os.path.exists(build_root):
+        shutil.rmtree(build_root)
+
+    lf.sink_parquet(staging_path, engine="streaming")
+    try:
+        staged = pl.scan_parquet(staging_path)
+        months = (
+            staged
+            .select([
+                pl.col("effective_date").dt.year().alias("year"),
+                pl.col("effective_date").dt.month().alias("month"),
+            ])
+            .unique()
+            .collect(engine="streaming")
+            .rows()
+        )
+        # One bounded pass per month: only that month is ever sorted.
+        for year, month in months:
+            part_dir = _partition_dir(build_root, year, month)
+            os.makedirs(part_dir, exist_ok=True)
+            (
+                staged
+                .filter((pl.col("effective_date").dt.year() == year) &
+                        (pl.col("effective_date").dt.month() == month))
+                .sort(["ndc_id", "effective_date"])
+                .sink_parquet(os.path.join(part_dir, PARTITION_FILE), statistics=True,
+                              row_group_size=ROW_GROUP_SIZE, engine="streaming")
+            )
+
+        if replace_all and os.path.exists(root):
+            shutil.rmtree(root)
+        for year, month in months:
+            target = _partition_dir(root, year, month)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(_partition_dir(build_root, year, month), target)
+    finally:
+        os.remove(staging_path)
+        if os.path.exists(build_root):
+            shutil.rmtree(build_root)
+
+    if os.path.exists(history_path(processed_path)):
+        os.remove(history_path(processed_path))
+
+
+def _partition_dir(root, year, month):
+    return os.path.join(root, f"year={year}", f"month={month:02d}")
+
+
+def month_bounds(dates):
+    """(first day of earliest month, last day of latest month) covering `dates`."""
+    lo, hi = min(dates), max(dates)
+    start = date(lo.year, lo.month, 1)
+    end = date(hi.year + (hi.month == 12), hi.month % 12 + 1, 1)
+    return start, date.fromordinal(end.toordinal() - 1)
+
+
+# ==========================================
+# RUN-LENGTH (SCD2) PRICE TABLE
+# ==========================================
+def price_runs_path(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, PRICE_RUNS_FILE)
+
+
+def build_price_runs(history_lf):
+    """
+    Collapses weekly rows into change-point runs:
+    (ndc_id, ndc11, valid_from, valid_to, price_per_unit), valid_to inclusive.
+
+    A run breaks when the price changes or when a week is missing, so every
+    run is a contiguous weekly spine and expand_price_runs() rebuilds the
+    weekly table exactly.
+    """
+    prev_ndc = pl.col("ndc_id").shift(1)
+    prev_price = pl.col("price_per_unit").shift(1)
+    prev_date = pl.col("effective_date").shift(1)
+    run_break = (
+        (pl.col("ndc_id") != prev_ndc)
+        | (pl.col("price_per_unit") != prev_price)
+        | ((pl.col("effective_date") - prev_date).dt.total_days() != 7)
+    ).fill_null(True)
+
+    return (
+        history_lf
+        .select(["ndc_id", "ndc11", "effective_date", "price_per_unit"])
+        .sort(["ndc_id", "effective_date"])
+        .with_columns(run_break.cast(pl.UInt32).cum_sum().alias("_run"))
+        .group_by(["ndc_id", "ndc11", "_run"])
+        .agg([
+            pl.col("effective_date").min().alias("valid_from"),
+            pl.col("effective_date").max().alias("valid_to"),
+            pl.col("price_per_unit").first(),
+        ])
+        .drop("_run")
+        .sort(["ndc_id", "valid_from"])
+    )
+
+
+def write_price_runs(processed_path=PROCESSED_DATA_PATH, streaming=False):
+    """Rebuilds the run table from the weekly history and writes it next to it."""
+    runs = build_price_runs(scan_nadac_history(processed_path))
+    if streaming:
+        tmp_path = price_runs_path(processed_path) + ".tmp"
+        runs.sink_parquet(tmp_path, statistics=True, engine="streaming")
+        os.replace(tmp_path, price_runs_path(processed_path))
+    else:
+        runs.collect().write_parquet(price_runs_path(processed_path), statistics=True)
+    return pl.scan_parquet(price_runs_path(processed_path)).select(pl.len()).collect().item()
+
+
+def update_price_runs(processed_path=PROCESSED_DATA_PATH, start_date=None, end_date=None):
+    """
+    Incremental counterpart of write_price_runs after [start_date, end_date]
+    of the weekly history was replaced. Only that window of the history is
+    read. Runs reaching into it (or ending the week before / starting the week
+    after it) are cut back to the part outside the window. The window is
+    re-run from the new weekly rows and the pieces are re-joined where the
+    price carries on.
+    Appending a week therefore extends or closes each NDC's open run and opens
+    new ones, without re-sorting the history.
+    """
+    week = timedelta(days=7)
+    runs = pl.read_parquet(price_runs_path(processed_path))
+    near = (pl.col("valid_to") >= start_date - week) & (pl.col("valid_from") <= end_date + week)
+    untouched, touched = runs.filter(~near), runs.filter(near)
+
+    # Runs sit on a weekly grid from valid_from: last date before / first date after the window
+    weeks_to_start = ((pl.lit(start_date) - pl.col("valid_from")).dt.total_days() - 1) // 7
+    weeks_past_end = (pl.lit(end_date) - pl.col("valid_from")).dt.total_days() // 7 + 1
+    heads = touched.filter(pl.col("valid_from") < start_date).with_columns(
+        pl.min_horizontal("valid_to", pl.col("valid_from") + pl.duration(days=weeks_to_start * 7))
+        .alias("valid_to"))
+    tails = touched.filter(pl.col("valid_to") > end_date).with_columns(
+        pl.max_horizontal("valid_from", pl.col("valid_from") + pl.duration(days=weeks_past_end * 7))
+        .alias("valid_from"))
+    window = build_price_runs(
+        scan_nadac_history(processed_path, start_date=start_date, end_date=end_date)).collect()
+
+    pieces = pl.concat([heads, tails, window.select(runs.columns)]).sort(["ndc_id", "valid_from"])
+    # Re-join neighbouring pieces that continue the same price week to week
+    run_break = (
+        (pl.col("ndc_id") != pl.col("ndc_id").shift(1))
+        | (pl.col("price_per_unit") != pl.col("price_per_unit").shift(1))
+        | ((pl.col("valid_from") - pl.col("valid_to").shift(1)).dt.total_days() != 7)
+    ).fill_null(True)
+    rebuilt = (
+        pieces
+        .with_columns(run_break.cast(pl.UInt32).cum_sum().alias("_run"))
+        .group_by(["ndc_id", "ndc11", "_run"])
+        .agg([
+            pl.col("valid_from").min(),
+            pl.col("valid_to").max(),
+            pl.col("price_per_unit").first(),
+        ])
+        .drop("_run")
+        .select(runs.columns)
+    )
+
+    updated = pl.concat([untouched, rebuilt]).sort(["ndc_id", "valid_from"])
+    tmp_path = price_runs_path(processed_path) + ".tmp"
+    updated.write_parquet(tmp_path, statistics=True)
+    os.replace(tmp_path, price_runs_path(processed_path))
+    return updated.height
+
+
+def price_runs_exist(processed_path=PROCESSED_DATA_PATH):
+    return os.path.exists(price_runs_path(processed_path))
+
+
+def scan_price_runs(processed_path=PROCESSED_DATA_PATH, ndc11=None):
+    lf = pl.scan_parquet(price_runs_path(processed_path))
+    if ndc11 is not None:
+        lf = _filter_ndcs(lf, processed_path, ndc11)
+    return lf
+
+
+def expand_price_runs(runs_lf, start_date=None, end_date=None):
+    """
+    Rebuilds the weekly (effective_date, ndc_id, ndc11, price_per_unit) spine from runs,
+    optionally only for [start_date, end_date]. Runs outside the window are
+    dropped before expansion, so a narrow window stays cheap.
+    """
+    if start_date is not None:
+        runs_lf = runs_lf.filter(pl.col("valid_to") >= start_date)
+    if end_date is not None:
+        runs_lf = runs_lf.filter(pl.col("valid_from") <= end_date)
+
+    weekly = (
+        runs_lf
+        .with_columns(
+            pl.date_ranges("valid_from", "valid_to", NADAC_CADENCE).alias("effective_date"))
+        .explode("effective_date", empty_as_null=True)
+    )
+    if start_date is not None:
+        weekly = weekly.filter(pl.col("effective_date") >= start_date)
+    if end_date is not None:
+        weekly = weekly.filter(pl.col("effective_date") <= end_date)
+
+    return (
+        weekly
+        .select(["effective_date", "ndc_id", "ndc11", "price_per_unit"])
+        .sort(["effective_date", "ndc_id"])
+    )
+
+
+def scan_weekly_prices(processed_path=PROCESSED_DATA_PATH, ndc11=None,
+                       start_date=None, end_date=None):
+    """
+    Weekly (effective_date, ndc_id, ndc11, price_per_unit) for price lookups,
+    served from the run table (falls back to the weekly history when it has
+    not been built yet).
+    """
+    if price_runs_exist(processed_path):
+        return expand_price_runs(scan_price_runs(processed_path, ndc11), start_date, end_date)
+    return (
+        scan_nadac_history(processed_path, ndc11=ndc11, start_date=start_date, end_date=end_date)
+        .select(["effective_date", "ndc_id", "ndc11", "price_per_unit"])
+    )
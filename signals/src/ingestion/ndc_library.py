@@ -1,7 +1,22 @@
-import requests
 import polars as pl
+import pyarrow.parquet as pq
+import requests
 import os
+import sys
+import io
+import re
+import json
 import time
+import zipfile
+from email.utils import formatdate
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.openfda_client import get_client, OpenFDAError, records_to_frame, MAX_SKIP
+from src.ingestion.raw_cache import REPLAY_DEFAULT
+from src.entities.ndc_index import write_ndc_index
 
 # ==========================================
 # CONFIGURATION
@@ -9,58 +24,55 @@ import time
 # We use the 'drug/ndc' endpoint to get the master list of drugs
 API_URL = "https://api.fda.gov/drug/ndc.json"
 PROCESSED_DATA_PATH = "data/processed"
-
-
-def fetch_ndc_directory():
+NDC_DIRECTORY_FILE = "ndc_directory.parquet"
+
+# The API pages stop at the skip limit; the bulk download is the full directory.
+BULK_URL = "https://download.open.fda.gov/drug/ndc/drug-ndc-0001-of-0001.json.zip"
+BULK_CACHE_PATH = "data/raw/ndc_bulk"
+BULK_BATCH_SIZE = int(os.getenv("NDC_BULK_BATCH_SIZE", "5000"))
+# A cached bulk zip older than this is revalidated (If-Modified-Since) before reuse
+BULK_MAX_AGE_HOURS = float(os.getenv("NDC_BULK_MAX_AGE_HOURS", "24"))
+BULK_READ_CHARS = 1 << 20
+
+# Raw product fields read by process_ndc_directory
+RECORD_SCHEMA = {
+    "product_ndc": pl.Utf8,
+    "generic_name": pl.Utf8,
+    "brand_name": pl.Utf8,
+    "labeler_name": pl.Utf8,
+    "active_ingredients": pl.List(pl.Struct({"name": pl.Utf8, "strength": pl.Utf8})),
+    "marketing_start_date": pl.Utf8,
+    "marketing_end_date": pl.Utf8,
+    "product_type": pl.Utf8,
+    "packaging": pl.List(pl.Struct({"package_ndc": pl.Utf8, "description": pl.Utf8})),
+}
+
+
+def fetch_ndc_directory(client=None, max_records=50000, replay=REPLAY_DEFAULT):
     """
     Fetches the master NDC directory from OpenFDA.
     This gives us the Link between NDC <-> Ingredient <-> Manufacturer
+    With replay=True the pages come from the raw cache (no network).
     """
     print("🚀 Starting NDC Directory Ingestion...")
-
-    all_products = []
-    skip = 0
-    limit = 1000
-
-    # We'll fetch a safe chunk of the directory (e.g., 30k records)
-    # For a full enterprise run, we would loop until exhaustion,
-    # but for this setup, we'll grab enough to build a solid map.
-    # (The full DB is large, so we loop until empty or hit a safety cap)
-    max_records = 50000
-
-    while len(all_products) < max_records:
-        params = {
-            "limit": limit,
-            "skip": skip
-        }
-
-        try:
-            # print(f"   📡 Fetching NDCs {skip} to {skip + limit}...")
-            response = requests.get(API_URL, params=params)
-            data = response.json()
-
-            if "error" in data:
-                break
-
-            results = data.get("results", [])
-            if not results:
-                break
-
-            all_products.extend(results)
-            skip += limit
-
-            # Rate limiting
-            time.sleep(0.5)
-
-            # Progress update every 5k
-            if len(all_products) % 5000 == 0:
-                print(f"      ...fetched {len(all_products)} records so far")
-
-        except Exception as e:
-            print(f"   ❌ Network Error: {e}")
-            break
+    client = client or get_client(replay=replay)
+
+    # The API only serves a capped slice of the directory (max_records and
+    # openFDA's skip limit); the bulk loader is the complete source.
+    try:
+        all_products = client.fetch_all(API_URL, max_records=max_records)
+    except OpenFDAError as e:
+        print(f"   ❌ Network Error: {e}")
+        return None
 
     print(f"   📥 Total NDCs Fetched: {len(all_products)}")
+    cap = MAX_SKIP + client.page_size
+    if max_records:
+        cap = min(cap, max_records)
+    if len(all_products) >= cap:
+        print(f"   ⚠️ WARNING: stopped at the {cap:,}-record API cap. The NDC directory "
+              f"(and the entity map built from it) is PARTIAL. Run without --api "
+              f"to load the complete bulk file.")
     return all_products
 
 
@@ -72,38 +84,45 @@ def process_ndc_directory(raw_data):
     """
     print("   ⚙️  Building Entity Map...")
 
-    processed_rows = []
-
-    for item in raw_data:
-        # Extract Core Identifiers
-        product_ndc = item.get("product_ndc", "")  # e.g. "0591-2897"
-        generic_name = item.get("generic_name", "UNKNOWN").upper()
-        brand_name = item.get("brand_name", "UNKNOWN").upper()
-        labeler_name = item.get("labeler_name", "UNKNOWN").upper()
-
-        # Extract Active Ingredients (Usually a list)
-        ingredients = item.get("active_ingredients", [])
-        ingredient_name = ingredients[0].get(
-            "name", "UNKNOWN").upper() if ingredients else generic_name
-
-        processed_rows.append({
-            "product_ndc": product_ndc,
-            "generic_name": generic_name,
-            "brand_name": brand_name,
-            "labeler_name": labeler_name,
-            "ingredient_name": ingredient_name,
-            "marketing_start_date": item.get("marketing_start_date"),
-            "marketing_end_date": item.get("marketing_end_date"),
-            "product_type": item.get("product_type")
-        })
-
-    df = pl.DataFrame(processed_rows)
-
+    df = flatten_ndc_records(raw_data)
     if df.is_empty():
         return None
 
+    # One row per product
+    return df.unique(subset=["product_ndc"])
+
+
+def flatten_ndc_records(raw_data):
+    """Raw NDC product records -> cleaned directory rows (not yet de-duplicated)."""
+    # Columnar load: nested JSON -> Arrow structs/lists, unused fields dropped
+    records = records_to_frame(raw_data, RECORD_SCHEMA)
+
+    generic_name = pl.col("generic_name").fill_null("UNKNOWN").str.to_uppercase()
+    # Active ingredients are a list; the first one names the product
+    first_ingredient = pl.col("active_ingredients").list.first()
+
+    df = records.select(
+        pl.col("product_ndc").fill_null(""),  # e.g. "0591-2897"
+        generic_name,
+        pl.col("brand_name").fill_null("UNKNOWN").str.to_uppercase(),
+        pl.col("labeler_name").fill_null("UNKNOWN").str.to_uppercase(),
+        pl.when(first_ingredient.is_not_null())
+          .then(first_ingredient.struct.field("name").fill_null("UNKNOWN").str.to_uppercase())
+          .otherwise(generic_name)
+          .alias("ingredient_name"),
+        # Every active ingredient (combination products list several)
+        pl.col("active_ingredients").list.eval(
+            pl.element().struct.field("name").str.to_uppercase()).alias("ingredient_names"),
+        "marketing_start_date",
+        "marketing_end_date",
+        "product_type",
+        # Package NDCs feed the normalization index (entities/ndc_index.py)
+        pl.col("packaging").list.eval(pl.element().struct.field("package_ndc"))
+          .alias("package_ndcs"),
+    )
+
     # Normalization Logic
-    df = (
+    return (
         df
         .with_columns([
             # Create a "clean" manufacturer name (simplify LLC, Inc, etc)
@@ -121,14 +140,177 @@ def process_ndc_directory(raw_data):
             pl.col("marketing_end_date").str.strptime(
                 pl.Date, "%Y%m%d", strict=False)
         ])
-        .unique(subset=["product_ndc"])  # One row per product
     )
 
-    return df
 
+# ==========================================
+# BULK FILE LOADER
+# ==========================================
+def download_bulk_file(url=BULK_URL, dest_dir=BULK_CACHE_PATH, refresh=False,
+                       max_age_hours=BULK_MAX_AGE_HOURS, http=requests):
+    """
+    Streams the openFDA bulk NDC zip to disk (never held in memory) and
+    returns its path. An earlier download younger than max_age_hours is
+    reused as-is; an older one is revalidated with If-Modified-Since and
+    only downloaded again if openFDA has a newer file. refresh=True always
+    downloads.
+    """
+    dest = os.path.join(dest_dir, os.path.basename(url))
+    headers = {}
+    if os.path.exists(dest) and not refresh:
+        mtime = os.path.getmtime(dest)
+        if time.time() - mtime < max_age_hours * 3600:
+            print(f"   ♻️  Using cached bulk file: {dest}")
+            return dest
+        headers["If-Modified-Since"] = formatdate(mtime, usegmt=True)
+
+    print(f"   📥 Downloading bulk NDC directory: {url}")
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = dest + ".part"
+    with http.get(url, stream=True, timeout=60, headers=headers) as response:
+        if response.status_code == 304:
+            os.utime(dest)  # still current: restart the max-age clock
+            print(f"   ♻️  Bulk file not modified upstream: {dest}")
+            return dest
+        response.raise_for_status()
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+    os.replace(tmp_path, dest)
+    return dest
+
+
+def iter_json_array(stream, key="results", read_chars=BULK_READ_CHARS):
+    """
+    Yields the objects of the top-level `key` array of a JSON document one at a
+    time, reading `stream` in chunks, so only the current chunk is in memory.
+    """
+    decoder = json.JSONDecoder()
+    opening = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    # 1. Skip ahead to the array ("meta" comes first in openFDA files)
+    buf = ""
+    while True:
+        chunk = stream.read(read_chars)
+        buf += chunk
+        match = opening.search(buf)
+        if match:
+            pos = match.end()
+            break
+        if not chunk:
+            return
+        buf = buf[-64:]  # the key may straddle two chunks
+
+    # 2. Decode one element at a time
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            chunk = stream.read(read_chars)
+            if not chunk:
+                raise ValueError(f"Unterminated '{key}' array.")
+            buf, pos = chunk, 0
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Element cut off by the chunk boundary: read more and retry
+            chunk = stream.read(read_chars)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield obj
+        pos = end
+        if pos > read_chars:
+            buf, pos = buf[pos:], 0
+
+
+def iter_bulk_batches(zip_path, batch_size=BULK_BATCH_SIZE, read_chars=BULK_READ_CHARS):
+    """Yields lists of raw product records from every JSON file in the bulk zip."""
+    with zipfile.ZipFile(zip_path) as archive:
+        for name in sorted(n for n in archive.namelist() if n.endswith(".json")):
+            with archive.open(name) as raw:
+                stream = io.TextIOWrapper(raw, encoding="utf-8")
+                batch = []
+                for record in iter_json_array(stream, read_chars=read_chars):
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+
+
+def load_bulk_ndc_directory(zip_path, processed_path=PROCESSED_DATA_PATH,
+                            batch_size=BULK_BATCH_SIZE, read_chars=BULK_READ_CHARS):
+    """
+    Builds ndc_directory.parquet from the full bulk file in one pass.
+
+    Records are parsed incrementally and flattened/written one batch at a
+    time; the final one-row-per-product pass runs on the streaming engine.
+    Memory is bounded by the batch size, not the directory size.
+    """
+    print(f"🚀 Starting Bulk NDC Directory Load: {zip_path}")
+    os.makedirs(processed_path, exist_ok=True)
+    output_path = os.path.join(processed_path, NDC_DIRECTORY_FILE)
+    staged_path = output_path + ".batches"
+
+    records = 0
+    writer = None
+    try:
+        for batch in iter_bulk_batches(zip_path, batch_size, read_chars):
+            table = flatten_ndc_records(batch).to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(staged_path, table.schema)
+            writer.write_table(table)
+            records += len(batch)
+            print(f"   ⚙️  {records:,} products parsed...", end="\r")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print("   ⚠️ Bulk file contained no products.")
+        return None
+
+    print()
+    tmp_path = output_path + ".tmp"
+    (
+        pl.scan_parquet(staged_path)
+        .unique(subset=["product_ndc"], keep="first", maintain_order=True)
+        .sink_parquet(tmp_path, engine="streaming")
+    )
+    os.replace(tmp_path, output_path)
+    os.remove(staged_path)
+
+    products = pl.scan_parquet(output_path).select(pl.len()).collect().item()
+    print(f"   ✅ SUCCESS! Mapped {products:,} drugs from {records:,} records.")
+    print(f"   💾 Saved to: {output_path}")
+    write_ndc_index(processed_path)
+    return output_path
+
+
+def run_pipeline(replay=REPLAY_DEFAULT, bulk=True, bulk_path=None, refresh=False):
+    """
+    Bulk mode (the default) loads the complete directory from `bulk_path` or
+    the cached/downloaded bulk zip (see download_bulk_file; refresh=True forces
+    a new download); bulk=False pages openFDA instead, which is capped and
+    yields a partial directory.
+    """
+    if bulk or bulk_path:
+        if bulk_path is None:
+            cached = os.path.join(BULK_CACHE_PATH, os.path.basename(BULK_URL))
+            if replay and not os.path.exists(cached):
+                print(f"   ❌ Replay mode: no cached bulk file at {cached}")
+                return
+            bulk_path = cached if replay else download_bulk_file(refresh=refresh)
+        load_bulk_ndc_directory(bulk_path)
+        return
 
-def run_pipeline():
-    raw_data = fetch_ndc_directory()
+    raw_data = fetch_ndc_directory(replay=replay)
     if not raw_data:
         return
 
@@ -137,12 +319,22 @@ def run_pipeline():
     if df is not None:
         os.makedirs(PROCESSED_DATA_PATH, exist_ok=True)
         output_path = os.path.join(
-            PROCESSED_DATA_PATH, "ndc_directory.parquet")
+            PROCESSED_DATA_PATH, NDC_DIRECTORY_FILE)
         df.write_parquet(output_path)
 
         print(f"   ✅ SUCCESS! Mapped {df.height} drugs.")
         print(f"   💾 Saved to: {output_path}")
+        write_ndc_index(PROCESSED_DATA_PATH)
 
 
 if __name__ == "__main__":
-    run_pipeline()
+    # python src/ingestion/ndc_library.py [--replay] [--api | --bulk [path/to/drug-ndc.json.zip]] [--refresh]
+    args = sys.argv[1:]
+    bulk_path = None
+    if "--bulk" in args:
+        i = args.index("--bulk")
+        if i + 1 < len(args) and not args[i + 1].startswith("--"):
+            bulk_path = args[i + 1]
+    run_pipeline(replay="--replay" in args or REPLAY_DEFAULT,
+                 bulk="--api" not in args, bulk_path=bulk_path,
+                 refresh="--refresh" in args)
@@ -0,0 +1,345 @@
+import requests
+from requests.adapters import HTTPAdapter
+import polars as pl
+import pyarrow as pa
+import os
+import sys
+import json
+import random
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.raw_cache import get_cache, REPLAY_DEFAULT
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# openFDA allows 240 requests/minute per IP (or per key).
+OPENFDA_API_KEY = os.getenv("OPENFDA_API_KEY")
+RATE_PER_SECOND = float(os.getenv("OPENFDA_RATE_PER_SECOND", "4"))
+MAX_WORKERS = int(os.getenv("OPENFDA_MAX_WORKERS", "4"))
+PAGE_SIZE = 1000
+# openFDA rejects skip values above 25,000.
+MAX_SKIP = 25000
+CHECKPOINT_PATH = "data/raw/openfda_checkpoints"
+# Checkpoints older than this are discarded instead of resumed
+CHECKPOINT_TTL_SECONDS = int(os.getenv("OPENFDA_CHECKPOINT_TTL_HOURS", "24")) * 3600
+CHECKPOINT_META = "checkpoint.json"  # {"last_updated", "created"} of the snapshot paged
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# openFDA answers 404 NOT_FOUND when a query has no (more) results
+EMPTY_PAGE = b'{"meta": {}, "results": []}'
+
+
+class OpenFDAError(Exception):
+    """Raised when pages are still failing after every retry."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class OpenFDAClient:
+    """
+    Shared openFDA pager used by every openFDA ingestor.
+
+    - One pooled requests.Session (keep-alive across pages and calls).
+    - Pages after the first are fetched concurrently, throttled by a token bucket.
+    - Transient failures (network, 429, 5xx) are retried with exponential
+      backoff and jitter, honouring Retry-After.
+    - Completed pages are checkpointed to disk; if a run still fails, the next
+      call for the same query resumes from the pages it already has, as long
+      as openFDA still serves the same dataset version (meta.last_updated)
+      and the checkpoint is younger than CHECKPOINT_TTL_SECONDS.
+    - With a RawCache every raw page body is kept; with replay=True pages are
+      served from that cache only and the network is never touched.
+    """
+
+    def __init__(self, api_key=OPENFDA_API_KEY, rate_per_second=RATE_PER_SECOND,
+                 max_workers=MAX_WORKERS, page_size=PAGE_SIZE, max_retries=4,
+                 backoff_seconds=0.5, timeout=30, checkpoint_path=CHECKPOINT_PATH,
+                 cache=None, replay=False):
+        if replay and cache is None:
+            raise ValueError("replay mode needs a RawCache to read from.")
+        self.api_key = api_key
+        self.cache = cache
+        self.replay = replay
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.checkpoint_path = checkpoint_path
+        self.bucket = TokenBucket(rate_per_second)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    # ------------------------------------------
+    # Single page
+    # ------------------------------------------
+    def get_page(self, url, params):
+        """
+        Fetches one page with rate limiting and retries. Returns the JSON body.
+        Other 4xx answers (400, 401, 403...) raise OpenFDAError at once: a
+        retry would get the same answer.
+        """
+        if self.replay:
+            payload = self.cache.get(url, params)
+            if payload is None:
+                raise OpenFDAError(
+                    f"{url} skip={params.get('skip')}: not in raw cache (replay mode)")
+            return json.loads(payload)
+
+        cache_params = dict(params)
+        params = dict(params)
+        if self.api_key:
+            params["api_key"] = self.api_key
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code == 404:
+                    return self._keep(url, cache_params, EMPTY_PAGE)
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code >= 400:
+                        raise OpenFDAError(
+                            f"{url} skip={params.get('skip')}: HTTP {response.status_code}")
+                    return self._keep(url, cache_params, response.content)
+                last_error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+                last_error = str(e)
+
+            if attempt < self.max_retries:
+                delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random())
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                time.sleep(delay)
+
+        raise OpenFDAError(f"{url} skip={params.get('skip')}: {last_error}")
+
+    def _keep(self, url, params, payload):
+        """Parses a raw page body, storing it in the raw cache first."""
+        body = json.loads(payload)
+        if self.cache is not None:
+            self.cache.put(url, params, payload)
+        return body
+
+    # ------------------------------------------
+    # Full result set
+    # ------------------------------------------
+    def fetch_all(self, url, search=None, max_records=None):
+        """
+        Returns every record for `url` (+ optional openFDA `search`), in API order.
+
+        The first page tells us the total; the remaining pages are requested
+        concurrently. Raises OpenFDAError if any page keeps failing; the pages
+        that did arrive stay checkpointed for the next call.
+        """
+        base_params = {"limit": self.page_size}
+        if search:
+            base_params["search"] = search
+
+        checkpoint = self._checkpoint_dir(url, search)
+        pages, meta = self._load_checkpoint(checkpoint)
+
+        # Page 0 is always fetched: its last_updated tells whether the
+        # checkpointed pages belong to the dataset version served now
+        first = self.get_page(url, {**base_params, "skip": 0})
+        last_updated = first.get("meta", {}).get("last_updated")
+        if pages and meta.get("last_updated") != last_updated:
+            print(f"   ⚠️ Dataset updated since the checkpoint "
+                  f"({meta.get('last_updated')} -> {last_updated}); starting over.")
+            self._clear_checkpoint(checkpoint)
+            pages = {}
+        elif pages:
+            print(f"   ♻️  Resuming: {len(pages)} pages already fetched.")
+        if not pages:
+            self._start_checkpoint(checkpoint, last_updated)
+        pages[0] = first
+        self._save_page(checkpoint, 0, first)
+
+        total = pages[0].get("meta", {}).get("results", {}).get("total", 0)
+        if max_records is not None:
+            total = min(total, max_records)
+        if total > MAX_SKIP + self.page_size:
+            print(f"   ⚠️ {total:,} records exceed openFDA's skip limit; "
+                  f"fetching the first {MAX_SKIP + self.page_size:,}.")
+            total = MAX_SKIP + self.page_size
+
+        skips = [skip for skip in range(self.page_size, total, self.page_size)
+                 if skip not in pages]
+        failures = []
+        if skips:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {
+                    pool.submit(self.get_page, url, {**base_params, "skip": skip}): skip
+                    for skip in skips
+                }
+                for future in as_completed(futures):
+                    skip = futures[future]
+                    try:
+                        pages[skip] = future.result()
+                        self._save_page(checkpoint, skip, pages[skip])
+                    except OpenFDAError as e:
+                        failures.append(str(e))
+
+        if failures:
+            raise OpenFDAError(
+                f"{len(failures)} page(s) failed after retries; "
+                f"{len(pages)} pages checkpointed for resume. First error: {failures[0]}")
+
+        records = []
+        for skip in sorted(pages):
+            records.extend(pages[skip].get("results", []))
+        if max_records is not None:
+            records = records[:max_records]
+
+        self._clear_checkpoint(checkpoint)
+        return records
+
+    # ------------------------------------------
+    # Checkpoints
+    # ------------------------------------------
+    def _checkpoint_dir(self, url, search):
+        key = json.dumps({"url": url, "search": search, "limit": self.page_size},
+                         sort_keys=True)
+        return os.path.join(self.checkpoint_path,
+                            hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+
+    def _load_checkpoint(self, checkpoint):
+        """
+        (pages, meta) of a resumable checkpoint. Expired checkpoints, and
+        ones written before the meta file existed, are discarded.
+        """
+        pages = {}
+        if not os.path.isdir(checkpoint):
+            return pages, {}
+        meta_path = os.path.join(checkpoint, CHECKPOINT_META)
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        if time.time() - meta.get("created", 0) > CHECKPOINT_TTL_SECONDS:
+            self._clear_checkpoint(checkpoint)
+            return pages, {}
+        for name in os.listdir(checkpoint):
+            if name.startswith("skip_") and name.endswith(".json"):
+                with open(os.path.join(checkpoint, name)) as f:
+                    pages[int(name[5:-5])] = json.load(f)
+        return pages, meta
+
+    def _start_checkpoint(self, checkpoint, last_updated):
+        os.makedirs(checkpoint, exist_ok=True)
+        with open(os.path.join(checkpoint, CHECKPOINT_META), "w") as f:
+            json.dump({"last_updated": last_updated, "created": time.time()}, f)
+
+    def _save_page(self, checkpoint, skip, page):
+        os.makedirs(checkpoint, exist_ok=True)
+        tmp_path = os.path.join(checkpoint, f"skip_{skip}.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(page, f)
+        os.replace(tmp_path, os.path.join(checkpoint, f"skip_{skip}.json"))
+
+    def _clear_checkpoint(self, checkpoint):
+        if not os.path.isdir(checkpoint):
+            return
+        for name in os.listdir(checkpoint):
+            os.remove(os.path.join(checkpoint, name))
+        os.rmdir(checkpoint)
+
+
+def _coerce_value(value, arrow_type):
+    """
+    Bends one value to `arrow_type` the way the old per-record code read it:
+    scalars where a string is expected become strings, anything else that
+    does not fit (a list where a scalar is expected, ...) becomes null.
+    """
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return None if isinstance(value, (list, dict)) else str(value)
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        if not isinstance(value, list):
+            return None
+        return [_coerce_value(v, arrow_type.value_type) for v in value]
+    if pa.types.is_struct(arrow_type):
+        if not isinstance(value, dict):
+            return None
+        return {field.name: _coerce_value(value.get(field.name), field.type) for field in arrow_type}
+    try:
+        pa.scalar(value, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return None
+    return value
+
+
+def records_to_frame(records, schema):
+    """
+    openFDA records (list of nested dicts) -> Polars DataFrame with `schema`.
+
+    Arrow converts the whole list in C++, keeping nested fields as
+    lists/structs and dropping keys that are not in the schema; missing keys
+    become nulls. All further flattening is done with Polars expressions.
+    openFDA is not consistent about field types; if any record does not fit
+    the schema, every record is coerced in Python first (see _coerce_value)
+    instead of failing the whole ingest.
+    """
+    arrow_type = pa.struct(list(pl.DataFrame(schema=schema).to_arrow().schema))
+    try:
+        array = pa.array(records, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        print(f"   ⚠️ Off-schema openFDA field ({e}); coercing records.")
+        array = pa.array([_coerce_value(r, arrow_type) for r in records], type=arrow_type)
+    return pl.from_arrow(pa.Table.from_struct_array(array))
+
+
+_default_client = None
+
+
+def get_client(replay=REPLAY_DEFAULT):
+    """
+    Process-wide client so every ingestor shares one connection pool.
+    Pages are kept in the shared raw cache; replay=True serves them from it.
+    """
+    global _default_client
+    if replay:
+        return OpenFDAClient(cache=get_cache(), replay=True)
+    if _default_client is None:
+        _default_client = OpenFDAClient(cache=get_cache())
+    return _default_client
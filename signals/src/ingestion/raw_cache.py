@@ -0,0 +1,142 @@
+import os
+import json
+import gzip
+import hashlib
+import threading
+from datetime import datetime
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Every raw API/RSS payload the ingestors download is kept here, so processing
+# can be re-run (replayed) without touching the network.
+RAW_CACHE_PATH = os.getenv("SIGNALS_RAW_CACHE", "data/raw/cache")
+INDEX_FILE = "index.jsonl"
+# Replay mode: serve every request from the cache and never hit the network.
+REPLAY_DEFAULT = os.getenv("SIGNALS_REPLAY", "0") == "1"
+
+# Never part of a request key (and never written to disk).
+SECRET_PARAMS = {"api_key"}
+
+
+def request_key(url, params=None):
+    """Stable key for a request: sha256 of the URL + sorted non-secret params."""
+    params = {k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS}
+    canonical = json.dumps({"url": url, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RawCache:
+    """
+    Content-addressed store of raw payloads.
+
+    - objects/<aa>/<sha256>.gz holds each distinct payload once (gzip).
+    - index.jsonl is an append-only log of fetches:
+      {key, url, params, sha256, bytes, fetched_at}.
+    The latest fetch of a request key wins on lookup; older payloads stay on
+    disk so a past run can still be reproduced by hash.
+    Lookups first read any index lines appended since the last one (by this
+    or another process, e.g. a concurrent Celery worker), so the in-memory
+    index never falls behind the file.
+    """
+
+    def __init__(self, root=RAW_CACHE_PATH):
+        self.root = root
+        self.lock = threading.Lock()
+        self._index = None
+        self._latest = None  # request key -> latest index entry
+        self._offset = 0  # bytes of index.jsonl already read
+
+    # ------------------------------------------
+    # Write
+    # ------------------------------------------
+    def put(self, url, params, payload):
+        """Stores raw bytes for a request. Returns the content hash."""
+        digest = hashlib.sha256(payload).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, object_path)
+
+        entry = {
+            "key": request_key(url, params),
+            "url": url,
+            "params": {k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS},
+            "sha256": digest,
+            "bytes": len(payload),
+            "fetched_at": datetime.now().isoformat(timespec="microseconds"),
+        }
+        with self.lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, INDEX_FILE), "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        return digest
+
+    # ------------------------------------------
+    # Read
+    # ------------------------------------------
+    def entries(self, url=None):
+        """All logged fetches (oldest first), optionally for one URL."""
+        with self.lock:
+            self._ensure_loaded()
+            entries = list(self._index)
+        if url is not None:
+            entries = [e for e in entries if e["url"] == url]
+        return entries
+
+    def get(self, url, params=None):
+        """Latest payload cached for this request, or None."""
+        key = request_key(url, params)
+        with self.lock:
+            self._ensure_loaded()
+            entry = self._latest.get(key)
+        if entry is None:
+            return None
+        return self.read_object(entry["sha256"])
+
+    def read_object(self, digest):
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return f.read()
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.gz")
+
+    def _ensure_loaded(self):
+        """
+        Brings the in-memory index up to date with index.jsonl, reading only
+        the bytes appended since the last call; caller holds self.lock.
+        """
+        path = os.path.join(self.root, INDEX_FILE)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self._index is None or size < self._offset:
+            # First lookup, or the index was replaced: read it from the start
+            self._index, self._latest, self._offset = [], {}, 0
+        if size == self._offset:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        # A line still being written by another process is picked up next time
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # blank or torn line from an interrupted write
+            self._index.append(entry)
+            self._latest[entry["key"]] = entry
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Process-wide cache shared by every ingestor."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = RawCache()
+    return _default_cache
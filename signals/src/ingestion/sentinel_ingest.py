@@ -2,58 +2,221 @@ from typing import List, Dict, Optional
 import feedparser
 from bs4 import BeautifulSoup
 import os
+import sys
+import re
 import json
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from neo4j import GraphDatabase, basic_auth
 import polars as pl
-from pathlib import Path
 from email.utils import parsedate_to_datetime
 from datetime import datetime
 
+# --- Fix Path for Imports ---
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.ingestion.raw_cache import get_cache, REPLAY_DEFAULT
+from src.ingestion.sentinel_store import append_risks
+from src.utils.seen_ledger import get_seen_ledger, item_key
+from src.utils.llm_cache import get_llm_cache
+from src.utils.llm_backend import get_llm_backend, backend_model
+from src.entities.ingredient_matcher import normalize_description
+
 # Load environment variables
 load_dotenv()
 
-
-def fetch_enforcement_reports(feed_url: Optional[str] = "https://www.fda.gov/about-fda/contact-fda/stay-informed/rss-feeds/medwatch/rss.xml") -> List[Dict[str, any]]:
+# FDA feeds polled by the watchdog, {source: url}; all parse to one event schema
+FDA_FEEDS = {
+    "medwatch": "https://www.fda.gov/about-fda/contact-fda/stay-informed/rss-feeds/medwatch/rss.xml",
+    "recalls": "https://www.fda.gov/about-fda/contact-fda/stay-informed/rss-feeds/recalls/rss.xml",
+    "warning_letters": "https://www.fda.gov/about-fda/contact-fda/stay-informed/rss-feeds/warning-letters/rss.xml",
+}
+# ETag / Last-Modified per feed URL, for conditional GETs
+FEED_STATE_PATH = "data/processed/sentinel_feed_state.json"
+FEED_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/rss+xml, application/xml, text/xml, */*"
+}
+# Risk scoring: summaries per prompt, prompts in flight, attempts per chunk
+RISK_CHUNK_SIZE = int(os.getenv("SENTINEL_CHUNK_SIZE", "10"))
+RISK_MAX_WORKERS = int(os.getenv("SENTINEL_MAX_WORKERS", "4"))
+RISK_MAX_RETRIES = 3
+RISK_RETRY_SECONDS = 2
+
+# Local pre-triage: only items that mention a risk term or a known
+# manufacturer go to the LLM; everything else is scored locally.
+# Keywords and manufacturer names match whole words only ("MOLD" not in
+# "MOLDED"); stems match the start of a word ("DISCONTINU" -> "DISCONTINUED").
+RISK_KEYWORDS = [
+    "RECALL", "RECALLS", "RECALLED", "FORM 483", "WARNING LETTER", "IMPORT ALERT",
+    "SHUTDOWN", "SHUT DOWN", "CEASE", "CEASED", "CLOSURE", "SHORTAGE", "SHORTAGES",
+    "STERILITY", "NON-STERILE", "PARTICULATE", "PARTICULATES", "MICROBIAL", "MOLD",
+    "ENDOTOXIN", "ENDOTOXINS", "CGMP", "GOOD MANUFACTURING", "QUALITY CONTROL",
+    "OUT OF SPECIFICATION", "FAILED", "DEFECT", "DEFECTS", "DEFECTIVE", "SUPER-POTENT",
+    "SUBPOTENT", "NITROSAMINE", "NITROSAMINES", "INJUNCTION",
+]
+RISK_KEYWORD_STEMS = ["DISCONTINU", "CONTAMINA", "ADULTERAT", "IMPURIT"]
+MANUFACTURER_MIN_CHARS = 4  # shorter names match too much ordinary text
+# Reload the manufacturer names after this long (new Corporations in the graph)
+MANUFACTURER_VOCABULARY_TTL_SECONDS = int(os.getenv("SENTINEL_VOCABULARY_TTL_SECONDS", "3600"))
+ENTITY_MAP_PATH = "data/processed/ndc_entity_map.parquet"
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
+LOCAL_NO_RISK = {"risk_type": "No Specific Risk Identified", "manufacturer": None,
+                 "product": None, "severity_score": 0}
+
+RISK_SYSTEM_PROMPT = """
+You are a supply chain risk analyst. For each news summary provided, perform the following tasks:
+1. Identify if the text mentions: 'Factory Shutdown', 'Recall', 'Form 483 Warning', or 'Quality Control Failure'. If none, use 'No Specific Risk Identified'.
+2. Extract the 'Manufacturer Name' (or null).
+3. Extract the 'Drug/Product Name' (or null).
+4. Assign a 'Severity Score' from 0 (No Risk) to 10 (Critical Failure).
+
+Output must be a JSON object with a single key "analyses" containing a list of objects, one per summary.
+Each object must have: 'id' (the id attribute of its <summary>), 'risk_type', 'manufacturer', 'product', 'severity_score'.
+"""
+
+
+def load_feed_state(state_path: str = FEED_STATE_PATH) -> Dict[str, Dict[str, str]]:
+    """{feed url: {etag, last_modified}} from the last successful poll."""
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_feed_state(state: Optional[Dict[str, Dict[str, str]]], state_path: str = FEED_STATE_PATH):
     """
-    Fetches FDA MedWatch/Safety Reports with a browser-mimicking User-Agent.
-    Includes a 'Circuit Breaker' to return demo data if the live feed fails.
+    Persists the validators returned by fetch_and_score_rss. Call only once
+    the scored items are saved and marked seen: after that the feeds answer
+    304 and their current items are not fetched again. None saves nothing.
     """
-    print(f"📡 Connecting to FDA Feed: {feed_url}...")
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Accept": "application/rss+xml, application/xml, text/xml, */*"
-    }
-
-    raw_feed_content = None
+    if state is None:
+        return
+    if os.path.dirname(state_path):
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def _demo_reports() -> List[Dict[str, any]]:
+    """Circuit-breaker data used when no feed could be reached."""
+    return [
+        {
+            "title": "[DEMO] Urgent: Sterile Water Contamination", "link": "http://fda.gov/demo/1",
+            "guid": "http://fda.gov/demo/1", "source": "demo",
+            "published": datetime(2026, 1, 16, 12, 0, 0),
+            "summary": "Urgent recall issued for Baxter International sterile water vials due to particulate matter observed in lot #4459. Risk of embolism."
+        },
+        {
+            "title": "[DEMO] Labeling Error: Ibuprofen", "link": "http://fda.gov/demo/2",
+            "guid": "http://fda.gov/demo/2", "source": "demo",
+            "published": datetime(2026, 1, 15, 9, 30, 0),
+            "summary": "Voluntary recall of Ibuprofen 200mg by Dr. Reddy's due to potential missing child-safety cap mechanism. No chemical defects found."
+        }
+    ]
+
+
+def poll_feed(source: str, feed_url: str, validators: Dict[str, str], cache, http=requests):
+    """
+    One conditional GET. Returns (status, items, validators): status is
+    "changed", "unchanged" (304, nothing parsed) or "failed".
+    """
+    headers = dict(FEED_HEADERS)
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
 
     try:
-        response = requests.get(feed_url, headers=headers, timeout=15)
+        response = http.get(feed_url, headers=headers, timeout=15)
+        if response.status_code == 304:
+            return "unchanged", [], validators
         response.raise_for_status()
-        raw_feed_content = response.content
-        print("   ✅ Connection established.")
-
     except Exception as e:
-        print(f"   ⚠️ LIVE FEED ERROR: {e}")
+        print(f"   ⚠️ LIVE FEED ERROR ({source}): {e}")
+        return "failed", [], validators
+
+    cache.put(feed_url, None, response.content)
+    new_validators = {k: v for k, v in {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }.items() if v}
+    return "changed", parse_feed(response.content, source), new_validators
+
+
+def poll_feeds(feeds: Dict[str, str] = None, state: Dict[str, Dict[str, str]] = None,
+               replay: bool = REPLAY_DEFAULT, cache=None, http=requests):
+    """
+    Polls every feed concurrently with ETag/If-Modified-Since validators.
+    Returns (items from all changed feeds, {source: status}, updated state);
+    the caller decides when to persist the state (see save_feed_state).
+    """
+    feeds = feeds or FDA_FEEDS
+    state = dict(state or {})
+    cache = cache or get_cache()
+
+    if replay:
+        print(f"⏪ Replaying {len(feeds)} FDA feed(s) from raw cache...")
+        items, statuses = [], {}
+        for source, feed_url in feeds.items():
+            raw_feed_content = cache.get(feed_url)
+            statuses[source] = "changed" if raw_feed_content is not None else "failed"
+            if raw_feed_content is not None:
+                items.extend(parse_feed(raw_feed_content, source))
+        return items, statuses, state
+
+    print(f"📡 Polling {len(feeds)} FDA feed(s): {', '.join(feeds)}...")
+    items, statuses = [], {}
+    with ThreadPoolExecutor(max_workers=len(feeds)) as pool:
+        futures = {
+            pool.submit(poll_feed, source, feed_url, state.get(feed_url, {}), cache, http): (source, feed_url)
+            for source, feed_url in feeds.items()
+        }
+        for future in as_completed(futures):
+            source, feed_url = futures[future]
+            status, feed_items, validators = future.result()
+            statuses[source] = status
+            state[feed_url] = validators
+            items.extend(feed_items)
+
+    counts = {s: sum(1 for v in statuses.values() if v == s) for s in ("changed", "unchanged", "failed")}
+    print(f"   ✅ {counts['changed']} changed ({len(items)} items), "
+          f"{counts['unchanged']} unchanged (304), {counts['failed']} failed.")
+    return items, statuses, state
+
+
+def fetch_enforcement_reports(feeds: Optional[Dict[str, str]] = None,
+                              replay: bool = REPLAY_DEFAULT, cache=None,
+                              state_path: str = FEED_STATE_PATH, http=requests):
+    """
+    Fetches the FDA MedWatch, recall and warning-letter feeds (or `feeds`,
+    {source: url}) concurrently. Feeds that answer 304 Not Modified are
+    skipped without parsing, so only changed feeds return items.
+    Includes a 'Circuit Breaker' to return demo data if every live feed fails.
+    Every raw feed body is kept in the raw cache; replay=True parses the
+    latest cached bodies instead of connecting.
+
+    Returns (items, state). Nothing is persisted here: pass `state` to
+    save_feed_state once the items are stored, so items lost to a failed
+    scoring or save are fetched again. state is None when there is nothing
+    to persist (replay, circuit breaker).
+    """
+    items, statuses, state = poll_feeds(feeds, load_feed_state(state_path), replay, cache, http)
+    if replay:
+        return items, None
+    if statuses and all(status == "failed" for status in statuses.values()):
         print("   🔄 Activating Circuit Breaker: Switching to Mock Data.")
+        return _demo_reports(), None
+    return items, state
 
-        return [
-            {
-                "title": "[DEMO] Urgent: Sterile Water Contamination", "link": "http://fda.gov/demo/1",
-                "published": datetime(2026, 1, 16, 12, 0, 0),
-                "summary": "Urgent recall issued for Baxter International sterile water vials due to particulate matter observed in lot #4459. Risk of embolism."
-            },
-            {
-                "title": "[DEMO] Labeling Error: Ibuprofen", "link": "http://fda.gov/demo/2",
-                "published": datetime(2026, 1, 15, 9, 30, 0),
-                "summary": "Voluntary recall of Ibuprofen 200mg by Dr. Reddy's due to potential missing child-safety cap mechanism. No chemical defects found."
-            }
-        ]
 
+def parse_feed(raw_feed_content: bytes, source: str = None) -> List[Dict[str, any]]:
+    """Raw RSS bytes -> list of {title, link, guid, published, summary, source}."""
     feed = feedparser.parse(raw_feed_content)
     extracted_data = []
     for entry in feed.entries:
@@ -70,91 +233,280 @@ def fetch_enforcement_reports(feed_url: Optional[str] = "https://www.fda.gov/abo
 
         extracted_data.append({
             'title': entry.get('title', 'N/A'), 'link': entry.get('link', 'N/A'),
-            'published': dt_object, 'summary': cleaned_summary.strip()
+            'guid': entry.get('id') or entry.get('link'),
+            'published': dt_object, 'summary': cleaned_summary.strip(),
+            'source': source
         })
 
-    print(f"   ✅ Fetched {len(extracted_data)} reports from live feed.")
     return extracted_data
 
 
-def analyze_risk_with_gemini(text_batch: List[str]) -> List[Dict[str, any]]:
+_manufacturer_vocabulary = None
+_manufacturer_vocabulary_loaded_at = 0.0
+
+
+def normalize_term(term: str) -> str:
+    """A triage term in normalize_description form: "Dr. Reddy's" -> "DR REDDY S"."""
+    return re.sub(r"[^A-Z0-9]+", " ", term.upper()).strip()
+
+
+def load_manufacturer_vocabulary() -> List[str]:
     """
-    Analyzes a batch of text for supply chain risks using Google GenAI (v1.0+ SDK).
+    Normalized manufacturer names for triage: Corporation nodes from Neo4j,
+    or the entity map's manufacturers when the graph is unreachable.
+    Reloaded once MANUFACTURER_VOCABULARY_TTL_SECONDS have passed.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    global _manufacturer_vocabulary, _manufacturer_vocabulary_loaded_at
+    if (_manufacturer_vocabulary is not None
+            and time.monotonic() - _manufacturer_vocabulary_loaded_at < MANUFACTURER_VOCABULARY_TTL_SECONDS):
+        return _manufacturer_vocabulary
+
+    names = []
+    try:
+        driver = GraphDatabase.driver(NEO4J_URI, auth=basic_auth(NEO4J_USER, NEO4J_PASSWORD),
+                                      connection_timeout=5)
+        try:
+            with driver.session(database="neo4j") as session:
+                result = session.run(
+                    "MATCH (c:Corporation) WHERE c.name IS NOT NULL RETURN c.name AS name")
+                names = [record["name"] for record in result]
+        finally:
+            driver.close()
+        print(f"   🏭 Triage vocabulary: {len(names)} Corporation names from Neo4j.")
+    except Exception as e:
+        if os.path.exists(ENTITY_MAP_PATH):
+            names = (
+                pl.scan_parquet(ENTITY_MAP_PATH)
+                .select(pl.col("manufacturer").unique())
+                .collect()["manufacturer"]
+                .to_list()
+            )
+        print(f"   🏭 Neo4j unavailable ({type(e).__name__}); "
+              f"{len(names)} manufacturer names from the entity map.")
 
-    # --- UPDATED: New Client Syntax ---
-    client = genai.Client(api_key=api_key)
+    _manufacturer_vocabulary = sorted({
+        normalize_term(n) for n in names
+        if n and n != "UNKNOWN_MFG" and len(normalize_term(n)) >= MANUFACTURER_MIN_CHARS
+    })
+    _manufacturer_vocabulary_loaded_at = time.monotonic()
+    return _manufacturer_vocabulary
 
-    system_prompt = """
-    You are a supply chain risk analyst. For each news summary provided, perform the following tasks:
-    1. Identify if the text mentions: 'Factory Shutdown', 'Recall', 'Form 483 Warning', or 'Quality Control Failure'. If none, use 'No Specific Risk Identified'.
-    2. Extract the 'Manufacturer Name' (or null).
-    3. Extract the 'Drug/Product Name' (or null).
-    4. Assign a 'Severity Score' from 0 (No Risk) to 10 (Critical Failure).
 
-    Output must be a JSON object with a single key "analyses" containing a list of objects.
-    Each object must have: 'risk_type', 'manufacturer', 'product', 'severity_score'.
+def triage_summaries(summaries: List[str], keywords: List[str] = None,
+                     manufacturers: List[str] = None, stems: List[str] = None) -> pl.DataFrame:
     """
+    One multi-pattern (Aho-Corasick) pass per vocabulary over all summaries.
+    Text and terms are normalized as in ingredient_matcher, and terms are
+    space-padded, so keywords and manufacturers only match whole words and
+    stems only match at the start of a word.
+    Returns risk_hits, manufacturer_hits (normalized terms) and is_candidate
+    (any hit) per summary.
+    """
+    keywords = RISK_KEYWORDS if keywords is None else keywords
+    stems = RISK_KEYWORD_STEMS if stems is None else stems
+    manufacturers = load_manufacturer_vocabulary() if manufacturers is None else manufacturers
+
+    text = normalize_description(pl.col("summary"))
+
+    def hits(words, prefixes=()):
+        patterns = ([f" {normalize_term(w)} " for w in words]
+                    + [f" {normalize_term(p)}" for p in prefixes])
+        if not patterns:
+            return pl.lit([], dtype=pl.List(pl.Utf8))
+        # Overlapping, since neighbouring words share their padding space
+        return (
+            text.str.extract_many(patterns, overlapping=True)
+            .list.eval(pl.element().str.strip_chars())
+            .list.unique(maintain_order=True)
+        )
+
+    return (
+        pl.DataFrame({"summary": summaries}, schema={"summary": pl.Utf8})
+        .with_columns(
+            hits(keywords, stems).alias("risk_hits"),
+            hits(manufacturers).alias("manufacturer_hits"),
+        )
+        .with_columns(
+            ((pl.col("risk_hits").list.len() > 0)
+             | (pl.col("manufacturer_hits").list.len() > 0)).alias("is_candidate")
+        )
+    )
+
+
+def _risk_chunk_prompt(chunk: List[str]) -> str:
+    """Prompt for one chunk; each summary carries a chunk-local id the model must echo."""
     summaries_for_prompt = "\n".join(
-        [f"<summary>{s}</summary>" for s in text_batch])
-    full_prompt = f"{system_prompt}\n\nSummaries to analyze:\n{summaries_for_prompt}"
+        [f'<summary id="{i}">{s}</summary>' for i, s in enumerate(chunk)])
+    return f"{RISK_SYSTEM_PROMPT}\n\nSummaries to analyze:\n{summaries_for_prompt}"
+
 
-    retries = 3
-    while retries > 0:
+def _parse_risk_response(text: str, chunk_len: int) -> Dict[int, Dict[str, any]]:
+    """Response JSON -> {id: analysis}, ignoring objects with missing/unknown ids."""
+    by_id = {}
+    for analysis in json.loads(text).get("analyses", []):
         try:
-            print("   🧠 Thinking (Gemini)...")
-
-            # --- UPDATED: New Generation Call ---
-            response = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=full_prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type='application/json'
-                )
-            )
+            item_id = int(analysis.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= item_id < chunk_len:
+            by_id[item_id] = analysis
+    return by_id
 
-            analysis_result = json.loads(response.text)
-            return analysis_result.get("analyses", [])
-        except Exception as e:
-            print(f"   ⚠️ API Error: {e}. Retrying...")
-            retries -= 1
-            time.sleep(2)
 
-    return [{"risk_type": "Error", "manufacturer": "Unknown", "severity_score": 0, "product": "Unknown"} for _ in text_batch]
+def _item_cache_prompt(summary: str) -> str:
+    """Cache key prompt for one summary: the prompt it would get scored alone."""
+    return _risk_chunk_prompt([summary])
 
 
-def fetch_and_score_rss() -> pl.DataFrame:
+def _cache_analysis(cache, model: str, summary: str, analysis: Dict[str, any]):
+    """Stores one item's analysis as the response to its single-summary prompt."""
+    response_text = json.dumps({"analyses": [{**analysis, "id": 0}]})
+    cache.set(model, _item_cache_prompt(summary), response_text)
+
+
+def _score_chunk(backend, chunk: List[str], cache, max_retries: int) -> Dict[int, Dict[str, any]]:
+    """
+    Scores one chunk, retrying only this chunk until every id has an answer.
+    Returns whatever ids were answered by the last attempt; each answered
+    item is cached on its own (see analyze_risk_with_gemini).
+    """
+    prompt = _risk_chunk_prompt(chunk)
+    best = {}
+    for attempt in range(max_retries):
+        try:
+            by_id = _parse_risk_response(backend.generate(prompt), len(chunk))
+            if len(by_id) == len(chunk):
+                best = by_id
+                break
+            best = by_id if len(by_id) > len(best) else best
+            print(f"   ⚠️ Chunk answered {len(by_id)}/{len(chunk)} ids. Retrying...")
+        except Exception as e:
+            print(f"   ⚠️ API Error: {e}. Retrying chunk...")
+        if attempt < max_retries - 1:
+            time.sleep(RISK_RETRY_SECONDS * (attempt + 1))
+    for item_id, analysis in best.items():
+        _cache_analysis(cache, backend.model, chunk[item_id], analysis)
+    return best
+
+
+def analyze_risk_with_gemini(text_batch: List[str], chunk_size: int = None, max_workers: int = None,
+                             backend=None, cache=None) -> List[Dict[str, any]]:
+    """
+    Analyzes a batch of text for supply chain risks with the configured LLM
+    backend (Gemini, or the local stand-in with LLM_BACKEND=local).
+
+    Every summary is first looked up in the shared LLM response cache on its
+    own, so a cached item is served no matter which items it arrives with.
+    Only the misses are split into fixed-size chunks scored concurrently.
+    Every summary is tagged with an id the response must echo, so results are
+    matched by id, never by position: the returned list is always aligned with
+    `text_batch`, with an 'Error' entry only for items that stayed unanswered.
+    """
+    chunk_size = chunk_size or RISK_CHUNK_SIZE
+    max_workers = max_workers or RISK_MAX_WORKERS
+    cache = cache or get_llm_cache()
+    model = backend.model if backend is not None else backend_model()
+
+    answers = {}  # position in text_batch -> analysis
+    misses = []
+    for index, summary in enumerate(text_batch):
+        prompt = _item_cache_prompt(summary)
+        cached = cache.get(model, prompt)
+        try:
+            by_id = _parse_risk_response(cached, 1) if cached is not None else {}
+        except (ValueError, TypeError, AttributeError):
+            # Corrupt/truncated entry: drop it and score the summary again
+            cache.delete(model, prompt)
+            by_id = {}
+        if by_id:
+            answers[index] = by_id[0]
+        else:
+            misses.append(index)
+    if answers:
+        print(f"   ⚡ LLM cache hit for {len(answers)}/{len(text_batch)} summaries.")
+
+    if misses:
+        # Only built when a summary misses the cache (Gemini needs GEMINI_API_KEY)
+        backend = backend or get_llm_backend()
+        chunks = [misses[i:i + chunk_size] for i in range(0, len(misses), chunk_size)]
+
+        print(f"   🧠 Thinking ({backend.model}): {len(chunks)} chunk(s) of <= {chunk_size}, "
+              f"{min(max_workers, len(chunks))} in parallel...")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_score_chunk, backend, [text_batch[i] for i in chunk],
+                            cache, RISK_MAX_RETRIES): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                chunk = futures[future]
+                for item_id, analysis in future.result().items():
+                    answers[chunk[item_id]] = analysis
+        print(f"   📊 {backend.summary()}")
+
+    results = []
+    for index in range(len(text_batch)):
+        analysis = answers.get(index)
+        if analysis is None:
+            analysis = {"risk_type": "Error", "manufacturer": "Unknown",
+                        "severity_score": 0, "product": "Unknown"}
+        results.append({k: v for k, v in analysis.items() if k != "id"})
+    return results
+
+
+def fetch_and_score_rss(ledger=None, dedupe: bool = True, triage: bool = True):
     """
     Fetches the latest FDA enforcement reports, analyzes them for risk with an LLM,
-    and returns the scored events as a Polars DataFrame.
+    and returns (scored events as a Polars DataFrame, feed state). Only feeds
+    that changed since the last poll contribute items. Persist the feed state
+    with save_feed_state after save_scored_risks and mark_scored_risks; if
+    anything fails first, the next poll fetches the same items again.
+    With dedupe=True only items the seen-ledger has not scored (or whose
+    content changed) are sent to the LLM, so the result holds new events only.
+    Nothing is marked seen here: call mark_scored_risks once the result has
+    been saved, so items lost to a failed save are scored again next run.
+    With triage=True items with no risk keyword and no known manufacturer are
+    scored locally as 'No Specific Risk Identified' without an LLM call.
     """
     print("\n🚀 Running Sentinel RSS Fetch & Score...")
 
-    # 1. Fetch
-    reports = fetch_enforcement_reports()
+    # 1. Fetch (feeds unchanged since the last poll return nothing)
+    reports, feed_state = fetch_enforcement_reports()
     if not reports:
-        return pl.DataFrame()
+        return pl.DataFrame(), feed_state
 
     reports_with_summaries = [r for r in reports if r.get('summary')]
     if not reports_with_summaries:
-        return pl.DataFrame()
+        return pl.DataFrame(), feed_state
 
-    # 2. Analyze
-    summaries = [report['summary'] for report in reports_with_summaries]
-    print(f"   🔍 Analyzing {len(summaries)} summaries...")
-    analyses = analyze_risk_with_gemini(summaries)
+    if dedupe:
+        ledger = ledger or get_seen_ledger()
+        fresh = ledger.filter_unseen(reports_with_summaries)
+        print(f"   🧾 Seen-ledger: {len(fresh)} new/changed of {len(reports_with_summaries)} items.")
+        reports_with_summaries = fresh
+        if not reports_with_summaries:
+            return pl.DataFrame(), feed_state
 
-    # 3. Merge
+    # 2. Triage + Analyze
+    summaries = [report['summary'] for report in reports_with_summaries]
+    if triage:
+        candidates = triage_summaries(summaries)["is_candidate"].to_list()
+    else:
+        candidates = [True] * len(summaries)
+    to_score = [s for s, is_candidate in zip(summaries, candidates) if is_candidate]
+    print(f"   🔍 Triage: {len(to_score)} of {len(summaries)} summaries need the LLM...")
+
+    scored = iter(analyze_risk_with_gemini(to_score) if to_score else [])
+    analyses = [next(scored) if is_candidate else dict(LOCAL_NO_RISK)
+                for is_candidate in candidates]
+    print(f"   📊 {get_llm_cache().summary()}")
+
+    # 3. Merge (analyses are aligned with the reports by id)
     combined_data = []
-    limit = min(len(reports_with_summaries), len(analyses))
-
-    for i in range(limit):
-        report = reports_with_summaries[i]
-        analysis = analyses[i]
+    for report, analysis in zip(reports_with_summaries, analyses, strict=True):
         combined_data.append({
+            "item_id": item_key(report),
+            "source": report.get('source'),
             "title": report.get('title'),
             "link": report.get('link'),
             "event_date": report.get('published'),
@@ -164,34 +516,53 @@ def fetch_and_score_rss() -> pl.DataFrame:
             "raw_summary": report.get('summary')
         })
 
+    # A feed would answer 304 next time, so make its failed items come back
+    failed_sources = {report.get('source') for report, analysis in zip(reports_with_summaries, analyses)
+                      if analysis.get('risk_type') == "Error"}
+    if feed_state is not None:
+        feed_state = {url: validators for url, validators in feed_state.items()
+                      if url not in {FDA_FEEDS.get(s) for s in failed_sources}}
+
     if not combined_data:
-        return pl.DataFrame()
+        return pl.DataFrame(), feed_state
 
-    return pl.DataFrame(combined_data)
+    return pl.DataFrame(combined_data), feed_state
 
 
-def save_scored_risks(df: pl.DataFrame, output_path: str = "data/processed/sentinel_risks.parquet"):
+def save_scored_risks(df: pl.DataFrame, processed_path: str = "data/processed"):
     """
-    Saves the scored risk DataFrame to a parquet file.
+    Appends the scored risk DataFrame to the date-partitioned Sentinel risk
+    store (see sentinel_store.py). Earlier runs are never overwritten.
     """
     if df.is_empty():
         print("   ⚠️ No data to save.")
         return
 
-    print(f"   💾 Saving {len(df)} risk events to {output_path}...")
-    output_dir = Path(os.path.dirname(output_path))
-    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"   💾 Appending {len(df)} risk events to the Sentinel risk store...")
+    final_df = df.with_columns(pl.col("event_date").cast(pl.Date))
+    written = append_risks(final_df, processed_path)
+    print(f"   ✅ SUCCESS: Saved {written} events.")
+
 
-    final_df = df.select([
-        pl.col("event_date").cast(pl.Date), "manufacturer", "risk_type",
-        "severity_score", "raw_summary"
+def mark_scored_risks(df: pl.DataFrame, ledger=None):
+    """
+    Records the saved rows in the seen-ledger. Call only after save_scored_risks
+    succeeded. Rows whose analysis failed ('Error') are not marked, so they
+    are retried on the next run.
+    """
+    if df.is_empty():
+        return
+    ledger = ledger or get_seen_ledger()
+    ledger.mark_seen([
+        {"guid": row["item_id"], "title": row["title"], "summary": row["raw_summary"]}
+        for row in df.filter(pl.col("risk_type") != "Error").to_dicts()
     ])
-    final_df.write_parquet(output_path)
-    print(f"   ✅ SUCCESS: Saved data.")
 
 
 if __name__ == '__main__':
     # Preserves the original script behavior when run directly
-    scored_events_df = fetch_and_score_rss()
+    scored_events_df, feed_state = fetch_and_score_rss()
     if not scored_events_df.is_empty():
         save_scored_risks(scored_events_df)
+        mark_scored_risks(scored_events_df)
+    save_feed_state(feed_state)
@@ -0,0 +1,285 @@
+import polars as pl
+import os
+import sys
+import glob
+import uuid
+from datetime import date, datetime, timedelta
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROCESSED_DATA_PATH = "data/processed"
+# Legacy single-snapshot file; migrated into the store by the first append.
+LEGACY_RISK_FILE = "sentinel_risks.parquet"
+STORE_DIR = "sentinel_risks"  # sentinel_risks/event_date=YYYY-MM-DD/part-*.parquet
+COMPACTED_FILE = "part-compacted.parquet"
+
+RISK_SCHEMA = {
+    "item_id": pl.Utf8,
+    "source": pl.Utf8,  # feed the event came from (medwatch, recalls, ...)
+    "event_date": pl.Date,
+    "manufacturer": pl.Utf8,
+    "risk_type": pl.Utf8,
+    "severity_score": pl.Int64,
+    "raw_summary": pl.Utf8,
+    "title": pl.Utf8,
+    "link": pl.Utf8,
+    "scored_at": pl.Datetime("us"),
+}
+# Store files also carry moved_to, set only on tombstones: rows that mark an
+# item's version in this partition as superseded by one under another date.
+STORE_SCHEMA = {**RISK_SCHEMA, "moved_to": pl.Date}
+
+# sentinel_risks/_items/part-*.parquet: (item_id, event_date, scored_at) of
+# every appended row, so an append can find the partition an item used to be in.
+ITEM_INDEX_DIR = "_items"
+ITEM_INDEX_COLUMNS = ["item_id", "event_date", "scored_at"]
+
+
+def store_root(processed_path=PROCESSED_DATA_PATH):
+    return os.path.join(processed_path, STORE_DIR)
+
+
+def _item_index_dir(processed_path):
+    return os.path.join(store_root(processed_path), ITEM_INDEX_DIR)
+
+
+def _partition_date(file_path):
+    """'.../event_date=2026-01-16/part-x.parquet' -> date(2026, 1, 16)"""
+    day_dir = os.path.basename(os.path.dirname(file_path))
+    return date.fromisoformat(day_dir.split("=", 1)[1])
+
+
+def _partition_files(processed_path, start_date=None, end_date=None):
+    """Store files in event-date order, pruned to the requested window."""
+    pattern = os.path.join(store_root(processed_path), "event_date=*", "*.parquet")
+    files = sorted(glob.glob(pattern), key=_partition_date)
+    if start_date is not None:
+        files = [f for f in files if _partition_date(f) >= start_date]
+    if end_date is not None:
+        files = [f for f in files if _partition_date(f) <= end_date]
+    return files
+
+
+def _scan_files(files):
+    """Scans store files as STORE_SCHEMA; columns added later read as null in older files."""
+    return pl.scan_parquet(files, hive_partitioning=False, schema=STORE_SCHEMA,
+                           missing_columns="insert")
+
+
+def _conform(df):
+    """Casts/adds columns so every file in the store has STORE_SCHEMA."""
+    return df.select([
+        (pl.col(name) if name in df.columns else pl.lit(None)).cast(dtype, strict=False).alias(name)
+        for name, dtype in STORE_SCHEMA.items()
+    ])
+
+
+def _latest_per_item(lf):
+    """
+    Merge-on-read upsert: the most recently scored version of each item wins.
+    On a scored_at tie a live row beats a tombstone.
+    """
+    order = ["scored_at"]
+    if "moved_to" in lf.collect_schema().names():
+        order.append(pl.col("moved_to").is_null())
+    return (
+        lf.sort(order, nulls_last=False, maintain_order=True)
+        .unique(subset=["item_id"], keep="last", maintain_order=True)
+        .sort("event_date")
+    )
+
+
+def _tombstones(versions):
+    """
+    Tombstone rows for `versions` (ITEM_INDEX_COLUMNS, one or more rows per
+    item): every event_date that is not the item's latest gets one, carrying
+    the winner's scored_at so it outranks whatever that partition holds.
+    """
+    latest = _latest_per_item(versions.lazy()).collect()
+    return (
+        versions.select(["item_id", "event_date"]).unique()
+        .join(latest.rename({"event_date": "moved_to"}), on="item_id")
+        .filter(pl.col("event_date") != pl.col("moved_to"))
+    )
+
+
+def _load_item_index(processed_path):
+    """
+    Latest (item_id, event_date, scored_at) per item in the store. A store
+    written before the index existed is indexed once from its partitions,
+    and items that already moved get their tombstones then.
+    """
+    index_files = glob.glob(os.path.join(_item_index_dir(processed_path), "*.parquet"))
+    if index_files:
+        return _latest_per_item(pl.scan_parquet(index_files)).collect()
+
+    partitions = _partition_files(processed_path)
+    if not partitions:
+        return pl.DataFrame(schema={k: STORE_SCHEMA[k] for k in ITEM_INDEX_COLUMNS})
+    versions = (
+        _scan_files(partitions)
+        .filter(pl.col("moved_to").is_null())
+        .select(ITEM_INDEX_COLUMNS)
+        .collect()
+    )
+    _write_files(_tombstones(versions), processed_path)
+    index = _latest_per_item(versions.lazy()).collect()
+    _write_index(index, processed_path)
+    return index
+
+
+def _write_index(rows, processed_path, name=None):
+    index_dir = _item_index_dir(processed_path)
+    os.makedirs(index_dir, exist_ok=True)
+    name = name or f"part-{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp_path = os.path.join(index_dir, f".{name}.tmp")
+    rows.select(ITEM_INDEX_COLUMNS).write_parquet(tmp_path)
+    os.replace(tmp_path, os.path.join(index_dir, name))
+
+
+def append_risks(df, processed_path=PROCESSED_DATA_PATH):
+    """
+    Appends scored risk events to the store: one new small file per touched
+    event_date partition. Nothing is rewritten; re-appending an item is an
+    idempotent upsert because readers keep only its latest scored version.
+    When an item's event_date changed, a tombstone goes into the partition
+    of the version that lost, so date-windowed reads that only open their
+    own partitions never see the stale row.
+    The first append moves a legacy sentinel_risks.parquet into the store,
+    since scan_risks stops reading that file once the store exists.
+    Returns the number of rows written (migrated rows not included).
+    """
+    if df.is_empty():
+        return 0
+    if not os.path.isdir(store_root(processed_path)):
+        migrated = migrate_legacy_file(processed_path)
+        if migrated:
+            print(f"   📦 Migrated {migrated} legacy rows into the store.")
+    return _write_partitions(df, processed_path)
+
+
+def _write_partitions(df, processed_path):
+    if "scored_at" not in df.columns:
+        df = df.with_columns(pl.lit(datetime.now()).alias("scored_at"))
+    df = _conform(df).filter(pl.col("event_date").is_not_null() & pl.col("item_id").is_not_null())
+    if df.is_empty():
+        return 0
+
+    # Index first: a crash before the partitions land leaves an index entry
+    # whose tombstone later hits nothing, never an unindexed row.
+    index = _load_item_index(processed_path)
+    versions = pl.concat([
+        index.join(df.select("item_id").unique(), on="item_id", how="semi"),
+        df.select(ITEM_INDEX_COLUMNS),
+    ])
+    _write_index(df, processed_path)
+    _write_files(pl.concat([df, _tombstones(versions)], how="diagonal_relaxed"), processed_path)
+    return df.height
+
+
+def _write_files(rows, processed_path):
+    """Writes rows as one new file per event_date partition they touch."""
+    if rows.is_empty():
+        return
+    rows = _conform(rows)
+    run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    for (day,), part in rows.group_by(["event_date"]):
+        partition = os.path.join(store_root(processed_path), f"event_date={day.isoformat()}")
+        os.makedirs(partition, exist_ok=True)
+        tmp_path = os.path.join(partition, f".part-{run_id}.tmp")
+        part.write_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(partition, f"part-{run_id}.parquet"))
+
+
+def scan_risks(processed_path=PROCESSED_DATA_PATH, start_date=None, end_date=None):
+    """
+    The one way to read Sentinel risks. Returns a LazyFrame (latest version of
+    each item) scanning only the event_date partitions inside the window.
+    Items that moved out of a partition left a tombstone there (see
+    append_risks), so no stale version is read even before compaction.
+    Falls back to the legacy flat file when the store has not been created.
+    """
+    if os.path.isdir(store_root(processed_path)):
+        files = _partition_files(processed_path, start_date, end_date)
+        if not files:
+            return pl.LazyFrame(schema=RISK_SCHEMA)
+        lf = (
+            _latest_per_item(_scan_files(files))
+            .filter(pl.col("moved_to").is_null())
+            .select(list(RISK_SCHEMA))
+        )
+    else:
+        lf = pl.scan_parquet(os.path.join(processed_path, LEGACY_RISK_FILE))
+
+    if start_date is not None:
+        lf = lf.filter(pl.col("event_date") >= start_date)
+    if end_date is not None:
+        lf = lf.filter(pl.col("event_date") <= end_date)
+    return lf
+
+
+def compact_risks(processed_path=PROCESSED_DATA_PATH, older_than_days=0):
+    """
+    Merges each partition's small hourly files into one file, keeping only the
+    latest version of each item and dropping tombstones together with the
+    rows they supersede. Partitions newer than `older_than_days` are left
+    alone. The item index is collapsed to one file as well.
+    Only the files listed at the start are merged and removed; the merged
+    file is written aside and swapped in with os.replace. A file appended
+    meanwhile, to any partition, is simply left for the next compaction, and
+    concurrent readers see either version. Returns (partitions compacted,
+    files removed).
+    """
+    cutoff = date.today() - timedelta(days=older_than_days)
+    partitions = {}
+    for f in _partition_files(processed_path, end_date=cutoff):
+        partitions.setdefault(os.path.dirname(f), []).append(f)
+
+    compacted = removed = 0
+    for partition, files in sorted(partitions.items()):
+        rows = _scan_files(files)
+        merged = _latest_per_item(rows).filter(pl.col("moved_to").is_null()).collect()
+        if len(files) < 2 and merged.height == rows.select(pl.len()).collect().item():
+            continue
+        if not merged.is_empty():
+            tmp_path = os.path.join(partition, ".compacting.tmp")
+            merged.write_parquet(tmp_path)
+            os.replace(tmp_path, os.path.join(partition, COMPACTED_FILE))
+        for f in files:
+            if merged.is_empty() or os.path.basename(f) != COMPACTED_FILE:
+                os.remove(f)
+                removed += 1
+        compacted += 1
+
+    index_files = glob.glob(os.path.join(_item_index_dir(processed_path), "*.parquet"))
+    if len(index_files) > 1:
+        _write_index(_latest_per_item(pl.scan_parquet(index_files)).collect(),
+                     processed_path, COMPACTED_FILE)
+        for f in index_files:
+            if os.path.basename(f) != COMPACTED_FILE:
+                os.remove(f)
+
+    print(f"   🧹 Compacted {compacted} partition(s), merged away {removed} file(s).")
+    return compacted, removed
+
+
+def migrate_legacy_file(processed_path=PROCESSED_DATA_PATH):
+    """One-off: moves rows of the old overwrite-style file into the store."""
+    legacy_path = os.path.join(processed_path, LEGACY_RISK_FILE)
+    if not os.path.exists(legacy_path) or os.path.isdir(store_root(processed_path)):
+        return 0
+    legacy = pl.read_parquet(legacy_path)
+    legacy = legacy.with_columns(
+        pl.concat_str([pl.lit("legacy"), pl.col("raw_summary").hash().cast(pl.Utf8)],
+                      separator=":").alias("item_id")
+    )
+    return _write_partitions(legacy, processed_path)
+
+
+if __name__ == "__main__":
+    # python src/ingestion/sentinel_store.py [--compact] [--migrate]
+    if "--migrate" in sys.argv:
+        print(f"   📦 Migrated {migrate_legacy_file()} legacy rows into the store.")
+    if "--compact" in sys.argv:
+        compact_risks()
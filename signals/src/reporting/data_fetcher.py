@@ -9,30 +9,29 @@ from datetime import datetime, timedelta
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(current_dir, "../.."))
 PROCESSED_PATH = os.path.join(project_root, "data/processed")
-NADAC_HISTORY_PATH = os.path.join(PROCESSED_PATH, "nadac_history.parquet")
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.ingestion.nadac_store import history_exists, scan_weekly_prices
+from src.entities.entity_lookup import get_entity_lookup
 
 
 def get_drug_history(ndc11: str) -> pd.DataFrame:
     """
     Retrieves the full price history for a given drug NDC.
-    Forces NDC matching by zero-padding input and database column.
+    The input is zero-padded; the stored column is already normalized at
+    ingest. Weeks are expanded from the NDC's price runs, so only a handful
+    of run rows are read.
     """
     try:
-        if not os.path.exists(NADAC_HISTORY_PATH):
+        if not history_exists(PROCESSED_PATH):
             return pd.DataFrame(columns=['date', 'price'])
 
         # Defensive: Force target to be 11-digit string
-        target_ndc = str(ndc11).zfill(11).strip()
-
-        # Lazy scan for performance
-        lf = pl.scan_parquet(NADAC_HISTORY_PATH)
+        target_ndc = str(ndc11).strip().zfill(11)
 
         drug_history = (
-            lf
-            .select(["ndc11", "effective_date", "price_per_unit"])
-            # Defensive: Force DB column to be 11-digit string
-            .with_columns(pl.col("ndc11").cast(pl.Utf8).str.strip_chars().str.zfill(11))
-            .filter(pl.col("ndc11") == target_ndc)
+            scan_weekly_prices(PROCESSED_PATH, ndc11=target_ndc)
             .select([
                 pl.col("effective_date").alias("date"),
                 pl.col("price_per_unit").alias("price")
@@ -51,6 +50,21 @@ def get_drug_history(ndc11: str) -> pd.DataFrame:
         return pd.DataFrame(columns=['date', 'price'])
 
 
+def attach_drug_details(frame: pl.DataFrame, attributes=("drug_description", "manufacturer")) -> pl.DataFrame:
+    """
+    Adds drug name / ingredient / manufacturer / labeler columns by ndc_id from
+    the shared, memory-mapped entity lookup (columns the frame already has are kept).
+    """
+    return get_entity_lookup(PROCESSED_PATH).attach(frame, list(attributes))
+
+
+def get_drug_details(ndc11_values) -> pl.DataFrame:
+    """ndc11 string(s) -> drug_description, ingredient, manufacturer, labeler_id."""
+    if isinstance(ndc11_values, str):
+        ndc11_values = [ndc11_values]
+    return get_entity_lookup(PROCESSED_PATH).lookup_ndc11([str(n).strip().zfill(11) for n in ndc11_values])
+
+
 def get_mock_forecast(history_df: pd.DataFrame, risk_score: float) -> pd.DataFrame:
     if history_df.empty:
         return pd.DataFrame(columns=['date', 'price', 'lower_bound', 'upper_bound'])
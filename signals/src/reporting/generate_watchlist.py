@@ -11,18 +11,18 @@ from jinja2 import Environment, FileSystemLoader
 # 🛡️ BULLETPROOF IMPORT BLOCK
 # ==========================================
 try:
-    from src.reporting.data_fetcher import get_drug_history, get_mock_forecast
+    from src.reporting.data_fetcher import get_drug_history, get_mock_forecast, attach_drug_details
     from src.reporting.interactive_plot import generate_interactive_forecast
 except ImportError:
     try:
-        from data_fetcher import get_drug_history, get_mock_forecast
+        from data_fetcher import get_drug_history, get_mock_forecast, attach_drug_details
         from interactive_plot import generate_interactive_forecast
     except ImportError:
         current_dir = os.path.dirname(os.path.abspath(__file__))
         project_root = os.path.abspath(os.path.join(current_dir, "../.."))
         if project_root not in sys.path:
             sys.path.insert(0, project_root)
-        from src.reporting.data_fetcher import get_drug_history, get_mock_forecast
+        from src.reporting.data_fetcher import get_drug_history, get_mock_forecast, attach_drug_details
         from src.reporting.interactive_plot import generate_interactive_forecast
 # ==========================================
 
@@ -86,15 +86,9 @@ def generate_risk_report():
     # 4. Format Report (RESTORED COLUMNS)
     print("   💄 Formatting for Client...")
     try:
-        entity_map = pl.read_parquet(os.path.join(
-            PROCESSED_PATH, "ndc_entity_map.parquet"))
-        nadac_desc = pl.read_parquet(os.path.join(PROCESSED_PATH, "nadac_history.parquet")).select(
-            ["ndc11", "drug_description"]).unique(subset=["ndc11"])
-
+        # Names come from the shared entity lookup (gathered by ndc_id)
         final_report = (
-            report
-            .join(entity_map, on="ndc11", how="left")
-            .join(nadac_desc, on="ndc11", how="left")
+            attach_drug_details(report, ["drug_description", "manufacturer"])
             .filter(pl.col("risk_score") > 0.50)
             .sort("risk_score", descending=True)
             .select([
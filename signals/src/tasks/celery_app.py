@@ -44,6 +44,11 @@ app.conf.beat_schedule = {
         'task': 'run_sentinel_watchdog', # This name is defined in sentinel_tasks.py
         'schedule': 3600.0,
     },
+    # Task 1b: Merge the watchdog's hourly risk files once a day.
+    'compact-sentinel-risks-daily': {
+        'task': 'compact_sentinel_risks', # Defined in sentinel_tasks.py
+        'schedule': crontab(minute=30, hour=2),
+    },
     # Task 2: The "Brain" - runs the main weekly pipeline.
     'run-weekly-pipeline-wed-6am': {
         'task': 'signals.src.tasks.celery_app.run_weekly_pipeline',
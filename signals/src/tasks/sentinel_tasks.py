@@ -4,12 +4,14 @@ import polars as pl
 # Import the Celery app instance, the refactored ingestion function, and the new notifier
 try:
     from signals.src.tasks.celery_app import app
-    from signals.src.ingestion.sentinel_ingest import fetch_and_score_rss
+    from signals.src.ingestion.sentinel_ingest import fetch_and_score_rss, save_scored_risks, mark_scored_risks, save_feed_state
+    from signals.src.ingestion.sentinel_store import compact_risks
     from signals.src.utils.notifications import NotificationManager
 except ImportError:
     # Handle cases where the script might be run in a different context
     from .celery_app import app
-    from ..ingestion.sentinel_ingest import fetch_and_score_rss
+    from ..ingestion.sentinel_ingest import fetch_and_score_rss, save_scored_risks, mark_scored_risks, save_feed_state
+    from ..ingestion.sentinel_store import compact_risks
     from ..utils.notifications import NotificationManager
 
 
@@ -25,17 +27,26 @@ def run_sentinel_watchdog():
     """
     This Celery task runs hourly. It fetches the latest FDA RSS feeds,
     scores them for supply chain risk, and sends Slack notifications for critical events.
+    Items already scored in an earlier run are skipped (see utils/seen_ledger.py),
+    so each run only pays for, and alerts on, new or changed items.
     """
     logging.info("Executing task: run_sentinel_watchdog")
     
     try:
         # 1. Run the ingestion and scoring logic from the refactored module
-        scored_events_df = fetch_and_score_rss()
+        scored_events_df, feed_state = fetch_and_score_rss()
 
         if scored_events_df is None or scored_events_df.is_empty():
+            save_feed_state(feed_state)
             logging.info("Task completed. No new events found.")
             return "Completed. No new events."
 
+        # Persist to the append-only risk store (one small file per touched day),
+        # then record the items as seen, and only then let the feeds answer 304
+        save_scored_risks(scored_events_df)
+        mark_scored_risks(scored_events_df)
+        save_feed_state(feed_state)
+
         # 2. Check for critical alerts
         # Filter for events with a high severity score (e.g., > 8)
         critical_alerts = scored_events_df.filter(pl.col("severity_score") > 8)
@@ -66,3 +77,17 @@ def run_sentinel_watchdog():
         # Re-raising the exception will cause Celery to mark the task as FAILED
         # and potentially retry based on task configuration.
         raise
+
+
+@app.task(name='compact_sentinel_risks')
+def compact_sentinel_risks():
+    """
+    Daily housekeeping: merges the hourly watchdog files of each event_date
+    partition up to yesterday into one file so lookback scans stay cheap.
+    Partitions follow the feed's published date, so the watchdog may append
+    to any of them meanwhile; that is safe because compact_risks only
+    removes the files it listed and swaps the merged file in with os.replace.
+    """
+    logging.info("Executing task: compact_sentinel_risks")
+    compacted, removed = compact_risks(older_than_days=1)
+    return f"Completed. Compacted {compacted} partition(s), removed {removed} file(s)."
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import time
+import hashlib
+import difflib
+import logging
+import threading
+from collections import deque, OrderedDict
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # "gemini" or "local"
+GEMINI_MODEL = 'gemini-2.5-flash'
+LOCAL_MODEL = "local-stand-in"  # own cache namespace: never mixed with real answers
+
+# Local stand-in behaviour (load tests / benchmarks)
+LOCAL_LATENCY_SECONDS = float(os.getenv("LLM_LOCAL_LATENCY_SECONDS", "0.5"))
+LOCAL_LATENCY_JITTER = float(os.getenv("LLM_LOCAL_LATENCY_JITTER", "0.2"))  # +/- fraction
+LOCAL_ERROR_RATE = float(os.getenv("LLM_LOCAL_ERROR_RATE", "0.0"))
+LOCAL_REQUESTS_PER_MINUTE = int(os.getenv("LLM_LOCAL_RPM", "0"))  # 0 = unlimited
+LOCAL_TRACKED_PROMPTS = 10_000  # attempt counters kept, least recently used dropped first
+
+LOCAL_RISK_RULES = [  # first matching rule wins: (risk_type, terms, severity range)
+    ("Factory Shutdown", ["SHUTDOWN", "SHUT DOWN", "CEASE", "CLOSURE"], (8, 10)),
+    ("Quality Control Failure", ["CONTAMINA", "STERIL", "PARTICULATE", "IMPURIT", "CGMP"], (6, 9)),
+    ("Form 483 Warning", ["FORM 483", "WARNING LETTER"], (5, 7)),
+    ("Recall", ["RECALL"], (3, 6)),
+]
+
+
+def _unit_hash(*parts) -> float:
+    """Deterministic value in [0, 1) for the given parts."""
+    digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class RateLimitError(Exception):
+    """The backend refused the call (HTTP 429 / RESOURCE_EXHAUSTED)."""
+
+
+class LLMBackend:
+    """
+    One JSON-mode text generation call, shared by every LLM caller.
+    Backends implement `_generate`; this class keeps call/latency counters so
+    pipeline throughput can be reported the same way for any backend.
+    """
+
+    model = None
+
+    def __init__(self):
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0, "seconds": 0.0}
+        self.stats_lock = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        """
+        Returns the raw response text (expected to be JSON).
+
+        Args:
+            prompt (str): The full prompt.
+        """
+        started = time.perf_counter()
+        try:
+            return self._generate(prompt)
+        except RateLimitError:
+            self._count("rate_limited")
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._count("calls")
+            self._count("seconds", time.perf_counter() - started)
+
+    def summary(self) -> str:
+        calls = self.stats["calls"]
+        mean = (self.stats["seconds"] / calls) if calls else 0.0
+        return (f"LLM backend {self.model}: {calls} calls, {self.stats['errors']} errors, "
+                f"{self.stats['rate_limited']} rate-limited, {mean:.2f}s mean latency")
+
+    def _count(self, name: str, n=1):
+        with self.stats_lock:
+            self.stats[name] += n
+
+    def _generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """Google GenAI (v1.0+ SDK), JSON response mode."""
+
+    def __init__(self, api_key: str = None, model: str = GEMINI_MODEL):
+        super().__init__()
+        from google import genai  # optional dependency, only needed for this backend
+        from google.genai import types
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables.")
+        self.client = genai.Client(api_key=api_key)
+        self.config = types.GenerateContentConfig(response_mime_type='application/json')
+        self.model = model
+
+    def _generate(self, prompt: str) -> str:
+        response = self.client.models.generate_content(
+            model=self.model, contents=prompt, config=self.config)
+        return response.text
+
+
+class LocalStandInBackend(LLMBackend):
+    """
+    Offline stand-in answering the Sentinel risk and facility-verdict prompts
+    with rule-based JSON. Everything is derived from the prompt text, so the
+    same prompt always gets the same answer, latency and (per attempt) failure,
+    whatever order concurrent callers arrive in.
+    """
+
+    model = LOCAL_MODEL
+
+    def __init__(self, latency_seconds: float = LOCAL_LATENCY_SECONDS,
+                 latency_jitter: float = LOCAL_LATENCY_JITTER,
+                 error_rate: float = LOCAL_ERROR_RATE,
+                 requests_per_minute: int = LOCAL_REQUESTS_PER_MINUTE,
+                 sleep=time.sleep, tracked_prompts: int = LOCAL_TRACKED_PROMPTS):
+        """
+        Args:
+            latency_seconds (float): Mean simulated latency per call.
+            latency_jitter (float): Latency varies by +/- this fraction, per prompt.
+            error_rate (float): Share of attempts that fail with a simulated 503.
+            requests_per_minute (int): Calls allowed per rolling minute (0 = unlimited);
+                calls over the limit raise RateLimitError.
+            sleep (callable): Injected for tests.
+            tracked_prompts (int): Prompts whose attempt count is remembered; a
+                prompt dropped from the counter starts again at attempt 0.
+        """
+        super().__init__()
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tracked_prompts = tracked_prompts
+        self.attempts = OrderedDict()
+        self.window = deque()
+
+    def _generate(self, prompt: str) -> str:
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self.lock:
+            self._admit()
+            attempt = self.attempts.pop(key, 0)
+            self.attempts[key] = attempt + 1
+            if len(self.attempts) > self.tracked_prompts:
+                self.attempts.popitem(last=False)
+
+        jitter = (2 * _unit_hash(key, "latency") - 1) * self.latency_jitter
+        self.sleep(max(0.0, self.latency_seconds * (1 + jitter)))
+        if _unit_hash(key, "error", attempt) < self.error_rate:
+            raise RuntimeError("503 UNAVAILABLE (simulated)")
+
+        if '<summary id="' in prompt:
+            return json.dumps({"analyses": self._risk_analyses(prompt)})
+        if '"fda_registry_name"' in prompt:
+            return json.dumps(self._name_verdicts(prompt))
+        return "{}"
+
+    def _admit(self):
+        """Rolling one-minute window; caller holds self.lock."""
+        if not self.requests_per_minute:
+            return
+        now = time.monotonic()
+        while self.window and now - self.window[0] >= 60:
+            self.window.popleft()
+        if len(self.window) >= self.requests_per_minute:
+            raise RateLimitError("429 RESOURCE_EXHAUSTED (simulated)")
+        self.window.append(now)
+
+    @staticmethod
+    def _risk_analyses(prompt: str) -> list:
+        analyses = []
+        for item_id, text in re.findall(r'<summary id="(\d+)">(.*?)</summary>', prompt, re.DOTALL):
+            upper = text.upper()
+            risk_type, severity = "No Specific Risk Identified", 0
+            for rule_type, terms, (low, high) in LOCAL_RISK_RULES:
+                if any(term in upper for term in terms):
+                    risk_type = rule_type
+                    severity = low + int(_unit_hash(text) * (high - low + 1))
+                    break
+            analyses.append({"id": item_id, "risk_type": risk_type, "manufacturer": None,
+                             "product": None, "severity_score": severity})
+        return analyses
+
+    @staticmethod
+    def _name_verdicts(prompt: str) -> list:
+        pairs = json.loads(re.search(r"\[.*\]", prompt, re.DOTALL).group(0))
+
+        def norm(name):
+            name = re.sub(r"\b(LLC|INC|CORP|CORPORATION|LTD|LP|CO)\b", "", (name or "").upper())
+            return re.sub(r"[^A-Z0-9]", "", name)
+
+        return [difflib.SequenceMatcher(None, norm(p["database_name"]),
+                                        norm(p["fda_registry_name"])).ratio() >= 0.85
+                for p in pairs]
+
+
+def backend_model(backend: str = LLM_BACKEND) -> str:
+    """Model name the configured backend answers as, without connecting (for cache keys)."""
+    if _default_backend is not None:
+        return _default_backend.model
+    return LOCAL_MODEL if backend == "local" else GEMINI_MODEL
+
+
+_default_backend = None
+
+
+def get_llm_backend(backend: str = LLM_BACKEND) -> LLMBackend:
+    """
+    Process-wide backend so counters and the stand-in's rate limit cover
+    every caller. Raises ValueError for "gemini" without GEMINI_API_KEY.
+
+    Args:
+        backend (str): "gemini" or "local".
+    """
+    global _default_backend
+    if _default_backend is None:
+        if backend == "local":
+            logging.info("Using the local LLM stand-in (no network calls).")
+            _default_backend = LocalStandInBackend()
+        else:
+            _default_backend = GeminiBackend()
+    return _default_backend
@@ -0,0 +1,288 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "disk")  # "disk", "redis" or "off"
+DISK_PATH = os.getenv("LLM_CACHE_PATH", "data/cache/llm_cache.sqlite")
+REDIS_URL = os.getenv("LLM_CACHE_REDIS_URL", "redis://localhost:6379/2")
+TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace so indentation-only differences share a cache entry."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def cache_key(model: str, prompt: str) -> str:
+    """sha256 of model name + normalized prompt."""
+    text = f"{model}\x1f{normalize_prompt(prompt)}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Response cache shared by every Gemini caller, keyed by model + prompt hash.
+    Backends implement `_get` / `_set`; this class keeps hit/miss counters.
+    """
+
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.stats_lock = threading.Lock()
+
+    def get(self, model: str, prompt: str):
+        """
+        Returns the cached response text, or None on a miss/expired entry.
+
+        Args:
+            model (str): Model name the response came from.
+            prompt (str): The full prompt sent to the model.
+        """
+        value = self._get(cache_key(model, prompt))
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, model: str, prompt: str, response_text: str):
+        """
+        Stores a response. Only call this for responses that parsed successfully.
+
+        Args:
+            model (str): Model name the response came from.
+            prompt (str): The full prompt sent to the model.
+            response_text (str): Raw response text.
+        """
+        self._set(cache_key(model, prompt), model, response_text)
+        self._count("writes")
+
+    def delete(self, model: str, prompt: str):
+        """
+        Drops an entry, e.g. one whose stored response no longer parses.
+
+        Args:
+            model (str): Model name the response came from.
+            prompt (str): The full prompt sent to the model.
+        """
+        self._delete(cache_key(model, prompt))
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        rate = (self.stats["hits"] / lookups * 100) if lookups else 0.0
+        return (f"LLM cache: {self.stats['hits']} hits / {self.stats['misses']} misses "
+                f"({rate:.0f}% hit rate), {self.stats['evictions']} evicted")
+
+    def _count(self, name: str, n: int = 1):
+        with self.stats_lock:
+            self.stats[name] += n
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def _set(self, key: str, model: str, value: str):
+        raise NotImplementedError
+
+    def _delete(self, key: str):
+        raise NotImplementedError
+
+
+class NullLLMCache(LLMCache):
+    """Caching switched off: every lookup is a miss."""
+
+    def _get(self, key: str):
+        return None
+
+    def _set(self, key: str, model: str, value: str):
+        pass
+
+    def _delete(self, key: str):
+        pass
+
+
+class DiskLLMCache(LLMCache):
+    """
+    Single SQLite file. Entries expire after `ttl_seconds`; when the stored
+    responses exceed `max_bytes` the least recently used ones are evicted.
+    The running total of stored bytes lives in the one-row `usage` table and
+    is adjusted with every insert/delete, so a write never sums the table.
+    """
+
+    def __init__(self, path: str = DISK_PATH, ttl_seconds: int = TTL_SECONDS,
+                 max_bytes: int = MAX_BYTES):
+        super().__init__()
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._ready = False
+
+    def _ensure_schema(self, conn):
+        # Lazily created: _get skips a missing file, so lookups never create one
+        if self._ready:
+            return
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " total_size INTEGER NOT NULL)"
+        )
+        # Seeded once from the rows already there (files from before the counter)
+        conn.execute(
+            "INSERT OR IGNORE INTO usage (id, total_size) "
+            "SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        self._ready = True
+
+    @staticmethod
+    def _add_size(conn, delta: int):
+        if delta:
+            conn.execute("UPDATE usage SET total_size = total_size + ? WHERE id = 0", (delta,))
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _get(self, key: str):
+        now = time.time()
+        if not os.path.exists(self.path):
+            return None
+        with self.lock, closing(self._connect()) as conn, conn:
+            self._ensure_schema(conn)
+            row = conn.execute(
+                "SELECT value, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, size, created = row
+            if now - created > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._add_size(conn, -size)
+                return None
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def _set(self, key: str, model: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.lock, closing(self._connect()) as conn, conn:
+            self._ensure_schema(conn)
+            previous = conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, value, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, size, now, now),
+            )
+            self._add_size(conn, size - (previous[0] if previous else 0))
+            evicted = self._evict(conn)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _delete(self, key: str):
+        if not os.path.exists(self.path):
+            return
+        with self.lock, closing(self._connect()) as conn, conn:
+            self._ensure_schema(conn)
+            row = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._add_size(conn, -row[0])
+
+    def _evict(self, conn) -> int:
+        """Drops expired entries, then LRU entries until under max_bytes."""
+        cutoff = time.time() - self.ttl_seconds
+        evicted, expired_size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created < ?",
+            (cutoff,)).fetchone()
+        if evicted:
+            conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+            self._add_size(conn, -expired_size)
+
+        total = conn.execute("SELECT total_size FROM usage WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+
+        excess = total - self.max_bytes
+        victims, freed = [], 0
+        for key, size in conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._add_size(conn, -freed)
+        return evicted + len(victims)
+
+
+class RedisLLMCache(LLMCache):
+    """
+    Shared cache for multiple workers. TTL is a Redis key expiry; size-bounded
+    LRU eviction is Redis' own (configure maxmemory + allkeys-lru on the server).
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl_seconds: int = TTL_SECONDS,
+                 prefix: str = "llm:"):
+        super().__init__()
+        import redis  # optional dependency, only needed for this backend
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def _get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def _set(self, key: str, model: str, value: str):
+        self.client.set(self.prefix + key, value.encode("utf-8"), ex=self.ttl_seconds)
+
+    def _delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+
+_default_cache = None
+
+
+def get_llm_cache(backend: str = LLM_CACHE_BACKEND) -> LLMCache:
+    """
+    Process-wide cache so counters cover every caller; falls back to the disk
+    backend if Redis is unavailable.
+
+    Args:
+        backend (str): "disk", "redis" or "off".
+    """
+    global _default_cache
+    if _default_cache is not None:
+        return _default_cache
+
+    if backend == "off":
+        _default_cache = NullLLMCache()
+    elif backend == "redis":
+        try:
+            _default_cache = RedisLLMCache()
+            _default_cache.client.ping()
+        except Exception as e:
+            logging.warning(f"Redis LLM cache unavailable ({e}); using disk cache at {DISK_PATH}.")
+            _default_cache = DiskLLMCache()
+    else:
+        _default_cache = DiskLLMCache()
+    return _default_cache
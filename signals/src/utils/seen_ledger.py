@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LEDGER_BACKEND = os.getenv("SENTINEL_LEDGER_BACKEND", "sqlite")  # "sqlite" or "redis"
+SQLITE_PATH = os.getenv("SENTINEL_LEDGER_PATH", "data/processed/sentinel_seen.sqlite")
+REDIS_URL = os.getenv("SENTINEL_LEDGER_REDIS_URL", "redis://localhost:6379/1")
+REDIS_KEY = "sentinel:seen"
+
+
+def item_key(item: dict) -> str:
+    """Stable identity of a feed item: its GUID, else its link, else its title."""
+    return item.get('guid') or item.get('link') or item.get('title') or ""
+
+
+def content_hash(item: dict) -> str:
+    """Hash of the fields the LLM scores; a changed hash means re-score the item."""
+    text = "\x1f".join([item.get('title') or "", item.get('summary') or ""])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SeenLedger:
+    """
+    Remembers which feed items were already scored, keyed on GUID/link, with
+    the content hash they were scored at. Backends implement `_lookup` and
+    `_store`; callers use `filter_unseen` before scoring and `mark_seen` after.
+    """
+
+    def filter_unseen(self, items: list) -> list:
+        """
+        Returns the items that were never scored or whose content changed.
+
+        Args:
+            items (list): Feed item dicts (guid/link, title, summary).
+        """
+        known = self._lookup([item_key(i) for i in items])
+        return [i for i in items if known.get(item_key(i)) != content_hash(i)]
+
+    def mark_seen(self, items: list):
+        """
+        Records items as scored at their current content hash.
+
+        Args:
+            items (list): Feed item dicts that were successfully scored.
+        """
+        if items:
+            self._store({item_key(i): content_hash(i) for i in items})
+
+    def _lookup(self, keys: list) -> dict:
+        raise NotImplementedError
+
+    def _store(self, hashes: dict):
+        raise NotImplementedError
+
+
+class SQLiteSeenLedger(SeenLedger):
+    """Local single-file ledger (default; no extra services needed)."""
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                " item_key TEXT PRIMARY KEY,"
+                " content_hash TEXT NOT NULL,"
+                " first_seen REAL NOT NULL,"
+                " last_scored REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        """New connection per call; callers close it (`with conn:` only commits)."""
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        with self.lock, closing(self._connect()) as conn, conn:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT item_key, content_hash FROM seen "
+                    f"WHERE item_key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def _store(self, hashes: dict):
+        now = time.time()
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO seen (item_key, content_hash, first_seen, last_scored) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(item_key) DO UPDATE SET "
+                " content_hash = excluded.content_hash,"
+                " last_scored = excluded.last_scored",
+                [(k, h, now, now) for k, h in hashes.items()],
+            )
+
+
+class RedisSeenLedger(SeenLedger):
+    """Shared ledger for multiple workers: one Redis hash of item_key -> content hash."""
+
+    def __init__(self, url: str = REDIS_URL, key: str = REDIS_KEY):
+        import redis  # optional dependency, only needed for this backend
+
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+
+    def _lookup(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        values = self.client.hmget(self.key, keys)
+        return {k: v.decode() for k, v in zip(keys, values) if v is not None}
+
+    def _store(self, hashes: dict):
+        self.client.hset(self.key, mapping=hashes)
+
+
+def get_seen_ledger(backend: str = LEDGER_BACKEND) -> SeenLedger:
+    """
+    Returns the configured ledger, falling back to SQLite if Redis is unavailable.
+
+    Args:
+        backend (str): "sqlite" or "redis".
+    """
+    if backend == "redis":
+        try:
+            ledger = RedisSeenLedger()
+            ledger.client.ping()
+            return ledger
+        except Exception as e:
+            logging.warning(f"Redis seen-ledger unavailable ({e}); using SQLite at {SQLITE_PATH}.")
+    return SQLiteSeenLedger()
@@ -0,0 +1,152 @@
+import sys
+import os
+import polars as pl
+from datetime import date
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.ingestion import fda_shortages
+
+
+class FakeClient:
+    """Serves canned openFDA records and remembers the search it was given."""
+
+    def __init__(self, records):
+        self.records = records
+        self.searches = []
+
+    def fetch_all(self, url, search=None, max_records=None):
+        self.searches.append(search)
+        return self.records
+
+
+def test_incremental_shortage_sync(tmp_path):
+    print("\n🧪 Starting Incremental Shortage Sync Test...")
+    processed = str(tmp_path)
+
+    first = FakeClient([
+        {"generic_name": "Amoxicillin", "company_name": "Teva", "shortage_reason": "Demand",
+         "initial_posting_date": "01/05/2024", "update_date": "01/05/2024", "status": "Current"},
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality",
+         "initial_posting_date": "02/01/2023", "update_date": "03/01/2024", "status": "Current"},
+    ])
+    fda_shortages.run_pipeline(processed_path=processed, client=first)
+    assert first.searches == [None]
+    assert fda_shortages.load_sync_state(processed)["watermark"] == "2024-03-01"
+
+    # Cisplatin resolves and its reason is revised; nothing else changed
+    second = FakeClient([
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality (resolved)",
+         "initial_posting_date": "02/01/2023", "update_date": "04/10/2024",
+         "change_date": "04/10/2024", "status": "Resolved"},
+    ])
+    fda_shortages.run_pipeline(processed_path=processed, client=second)
+    assert second.searches == ["update_date:[20240301 TO 29991231]"]
+
+    events = pl.read_parquet(os.path.join(processed, fda_shortages.EVENTS_FILE))
+    assert events.height == 3
+    cis_start = events.filter((pl.col("generic_name") == "CISPLATIN")
+                              & (pl.col("event_type") == "shortage_start"))
+    assert cis_start.height == 1 and cis_start["reason"][0] == "Quality (resolved)"
+    resolved = events.filter(pl.col("event_type") == "shortage_resolved")
+    assert resolved["event_date"].to_list() == [date(2024, 4, 10)]
+    assert fda_shortages.load_sync_state(processed)["watermark"] == "2024-04-10"
+    print("   ✅ PASS: Only updated records were requested and upserted.")
+
+
+def test_revised_dates_replace_events(tmp_path):
+    print("\n🧪 Starting Shortage Date Revision Test...")
+    processed = str(tmp_path)
+
+    first = FakeClient([
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality",
+         "package_ndc": "0338-0001-01", "initial_posting_date": "02/01/2023",
+         "update_date": "03/01/2024", "change_date": "06/30/2024", "status": "Current"},
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality",
+         "package_ndc": "0338-0002-01", "initial_posting_date": "02/01/2023",
+         "update_date": "03/01/2024", "status": "Current"},
+    ])
+    fda_shortages.run_pipeline(processed_path=processed, client=first)
+    # A change_date past every update_date must not move the watermark
+    assert fda_shortages.load_sync_state(processed)["watermark"] == "2024-03-01"
+
+    # openFDA corrects one presentation's posting date and resolves it
+    second = FakeClient([
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality",
+         "package_ndc": "0338-0001-01", "initial_posting_date": "02/15/2023",
+         "update_date": "04/10/2024", "status_change_date": "04/08/2024", "status": "Resolved"},
+    ])
+    fda_shortages.run_pipeline(processed_path=processed, client=second)
+    events = pl.read_parquet(os.path.join(processed, fda_shortages.EVENTS_FILE))
+    starts = events.filter(pl.col("event_type") == "shortage_start").sort("record_id")
+    assert starts["event_date"].to_list() == [date(2023, 2, 15), date(2023, 2, 1)]
+    resolved = events.filter(pl.col("event_type") == "shortage_resolved")
+    assert resolved.height == 1 and resolved["record_id"][0] == "0338-0001-01"
+    print("   ✅ PASS: Revised dates replace the stored event, one per record.")
+
+
+def test_events_without_record_id_are_kept(tmp_path):
+    processed = str(tmp_path)
+    strengths = [
+        {"generic_name": "Heparin", "company_name": "Pfizer", "shortage_reason": "Demand",
+         "initial_posting_date": posted, "update_date": "03/01/2024", "status": "Current"}
+        for posted in ["01/10/2024", "02/20/2024"]
+    ]
+    fda_shortages.run_pipeline(processed_path=processed, client=FakeClient(strengths))
+
+    # One of the two siblings without package NDC / presentation is revised
+    resync = [dict(strengths[0], shortage_reason="Demand (revised)", update_date="04/01/2024")]
+    fda_shortages.run_pipeline(processed_path=processed, client=FakeClient(resync))
+    events = pl.read_parquet(os.path.join(processed, fda_shortages.EVENTS_FILE))
+    assert events["event_date"].to_list() == [date(2024, 1, 10), date(2024, 2, 20)]
+    assert events["reason"].to_list() == ["Demand (revised)", "Demand"]
+    print("   ✅ PASS: Sibling events without a package NDC survive a re-sync.")
+
+
+def legacy_events(raw_records):
+    """The per-record loop process_shortages used before the columnar load."""
+    events = []
+    for r in raw_records:
+        generic_name = r.get("generic_name", "UNKNOWN").upper()
+        company = r.get("company_name", "UNKNOWN").upper()
+        reason = r.get("shortage_reason", "UNKNOWN")
+        start_date_str = r.get("initial_posting_date")
+        change_date_str = r.get("change_date") or r.get("status_change_date") or r.get("update_date")
+        status = r.get("status", "Current")
+        if start_date_str:
+            events.append({"event_date": start_date_str, "event_type": "shortage_start",
+                           "generic_name": generic_name, "company_name": company,
+                           "reason": reason, "status_at_event": "Active"})
+        if status == "Resolved" and change_date_str:
+            events.append({"event_date": change_date_str, "event_type": "shortage_resolved",
+                           "generic_name": generic_name, "company_name": company,
+                           "reason": reason, "status_at_event": "Resolved"})
+    return (
+        pl.DataFrame(events)
+        .with_columns(pl.col("event_date").str.strptime(pl.Date, "%m/%d/%Y", strict=False))
+        .filter(pl.col("event_date").is_not_null())
+        .unique()
+    )
+
+
+def test_malformed_records_match_legacy_loop():
+    print("\n🧪 Starting Malformed openFDA Record Test...")
+    records = [
+        {"generic_name": "Amoxicillin", "company_name": "Teva", "shortage_reason": "Demand",
+         "initial_posting_date": "01/05/2024", "status": "Current"},
+        {"generic_name": "Cisplatin", "company_name": "Baxter", "shortage_reason": "Quality",
+         "initial_posting_date": "02/01/2023", "change_date": "03/01/2024", "status": "Resolved",
+         # Off-schema: a list and a number where strings are expected
+         "status_change_date": ["03/01/2024"], "update_date": 20240301},
+        {"generic_name": "Heparin", "company_name": "Pfizer", "shortage_reason": "Demand",
+         "initial_posting_date": "04/01/2024", "change_date": ["04/02/2024"], "status": "Current"},
+    ]
+    new = fda_shortages.process_shortages(records).drop("record_id")
+    legacy = legacy_events(records).select(new.columns)
+    assert new.sort(new.columns).equals(legacy.sort(new.columns))
+    assert new.height == 4
+    print("   ✅ PASS: One bad record no longer fails the ingest; output matches the old loop.")
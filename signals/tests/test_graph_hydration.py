@@ -0,0 +1,224 @@
+import sys
+import os
+import threading
+import polars as pl
+from neo4j.exceptions import TransientError
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.graph import hydrate_baseline, bulk_export, enrich_facilities
+
+
+class RecordingSession:
+    """Stands in for a neo4j session: records every (session, query, batch) it runs."""
+
+    def __init__(self, driver, session_id):
+        self.driver = driver
+        self.session_id = session_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_write(self, fn, *args):
+        return fn(self, *args)
+
+    def run(self, query, **params):
+        with self.driver.lock:
+            self.driver.calls.append((self.session_id, query, params.get("batch", params.get("links"))))
+
+
+class RecordingDriver:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.sessions = 0
+
+    def session(self, database=None):
+        with self.lock:
+            self.sessions += 1
+            return RecordingSession(self, self.sessions)
+
+    def rows(self, query):
+        return [row for _, q, batch in self.calls if q == query for row in batch]
+
+
+ENTITY_MAP = pl.DataFrame({
+    "ndc_id": [1, 2, 3, 4, 5],
+    "ndc11": ["00001000101", "00001000201", "00002000101", "00003000101", "00003000201"],
+    "drug_description": ["AMOXICILLIN 500MG", "AMOXICILLIN 250MG", "GABAPENTIN 300MG",
+                         "SODIUM CHLORIDE 0.9%", "AMOXICILLIN 875MG"],
+    "manufacturer": ["PFIZER", "PFIZER", "TEVA", "BAXTER", "BAXTER"],
+    "ingredient": ["AMOXICILLIN", "AMOXICILLIN", "GABAPENTIN", "SODIUM CHLORIDE", "AMOXICILLIN"],
+    "labeler_id": ["00001", "00001", "00002", "00003", "00003"],
+})
+
+
+def test_plan_dedupes_nodes_and_partitions_relationships():
+    print("\n🧪 Starting Staged Hydration Plan Test...")
+    phases = hydrate_baseline.plan_hydration(ENTITY_MAP, writers=3)
+    names = [p["name"] for p in phases]
+    assert names == ["Corporation nodes", "Subsidiary nodes", "Ingredient nodes", "NDC nodes",
+                     "OWNS relationships", "MARKETS relationships", "CONTAINS relationships"]
+
+    rows = {p["name"]: pl.concat(p["partitions"]) for p in phases}
+    assert rows["Corporation nodes"].height == 3
+    assert rows["Ingredient nodes"].height == 3
+    assert rows["NDC nodes"].height == 5
+    assert rows["OWNS relationships"].height == 3
+    # Both ends of OWNS are hubs: one session
+    assert len(next(p for p in phases if p["name"] == "OWNS relationships")["partitions"]) == 1
+
+    # Each hub node is written by exactly one partition
+    contains = next(p for p in phases if p["name"] == "CONTAINS relationships")
+    owners = [set(part["ingredient"]) for part in contains["partitions"]]
+    assert sum(len(o) for o in owners) == len(set().union(*owners)) == 3
+
+
+def test_hydrate_frame_writes_nodes_before_relationships():
+    driver = RecordingDriver()
+    stats = hydrate_baseline.hydrate_frame(driver, ENTITY_MAP, writers=2, batch_size=2)
+    assert stats["NDC nodes"][0] == 5
+    assert stats["MARKETS relationships"][0] == 5
+
+    queries = [q for _, q, _ in driver.calls]
+    last_node_write = max(i for i, q in enumerate(queries)
+                          if q in hydrate_baseline.NODE_QUERIES.values())
+    first_edge_write = min(i for i, q in enumerate(queries)
+                           if q in hydrate_baseline.RELATIONSHIP_QUERIES.values())
+    assert last_node_write < first_edge_write
+
+    contains = driver.rows(hydrate_baseline.RELATIONSHIP_QUERIES["CONTAINS"])
+    assert sorted((r["ndc11"], r["ingredient"]) for r in contains) == sorted(
+        zip(ENTITY_MAP["ndc11"], ENTITY_MAP["ingredient"]))
+    print("✅ Staged hydration wrote every node and edge once, nodes first.")
+
+
+class FlakySession(RecordingSession):
+    """Fails the first write of every query with a deadlock, like a contended lock."""
+
+    def execute_write(self, fn, *args):
+        with self.driver.lock:
+            first_try = args[0] not in self.driver.failed
+            self.driver.failed.add(args[0])
+        if first_try:
+            raise TransientError("deadlock detected")
+        return fn(self, *args)
+
+
+def test_transient_errors_retry_the_batch(monkeypatch):
+    monkeypatch.setattr(hydrate_baseline, "RETRY_BACKOFF_SECONDS", 0)
+    driver = RecordingDriver()
+    driver.failed = set()
+    driver.session = lambda database=None: FlakySession(driver, 1)
+    stats = hydrate_baseline.hydrate_frame(driver, ENTITY_MAP, writers=1)
+    assert len(stats) == 7 and stats["NDC nodes"][0] == 5
+    assert len(driver.rows(hydrate_baseline.NODE_QUERIES["NDC"])) == 5
+
+
+def test_delta_plan_sends_only_changed_rows():
+    print("\n🧪 Starting Delta Hydration Plan Test...")
+    snapshot = hydrate_baseline.snapshot_hashes(ENTITY_MAP)
+
+    # Week 2: one NDC relabeled to a new ingredient, one gone, one new
+    current = pl.concat([
+        ENTITY_MAP.filter(pl.col("ndc11") != "00002000101").with_columns(
+            pl.when(pl.col("ndc11") == "00003000101").then(pl.lit("SALINE"))
+            .otherwise(pl.col("ingredient")).alias("ingredient")),
+        pl.DataFrame({"ndc_id": [6], "ndc11": ["00004000101"], "drug_description": ["METFORMIN 500MG"],
+                      "manufacturer": ["TEVA"], "ingredient": ["METFORMIN"], "labeler_id": ["00004"]}),
+    ])
+    inserted, updated, removed = hydrate_baseline.diff_entity_map(current, snapshot)
+    assert inserted["ndc11"].to_list() == ["00004000101"]
+    assert updated["ndc11"].to_list() == ["00003000101"]
+    assert removed["ndc11"].to_list() == ["00002000101"]
+
+    phases = {p["name"]: (pl.concat(p["partitions"]) if p["partitions"] else None)
+              for p in hydrate_baseline.plan_delta(current, snapshot, writers=2)}
+    assert phases["NDC deletes"]["ndc11"].to_list() == ["00002000101"]
+    assert phases["NDC edge resets"]["ndc11"].to_list() == ["00003000101"]
+    assert sorted(phases["NDC nodes"]["ndc11"].to_list()) == ["00003000101", "00004000101"]
+    # TEVA still owns a labeler (00004), but no longer 00002
+    assert phases["OWNS deletes"].rows() == [("TEVA", "00002")]
+    assert sorted(phases["Ingredient prunes"]["name"].to_list()) == ["GABAPENTIN", "SODIUM CHLORIDE"]
+    assert phases["Subsidiary prunes"]["labeler_id"].to_list() == ["00002"]
+    assert phases["Corporation prunes"] is None
+
+    # Nothing changed -> nothing to write
+    quiet = hydrate_baseline.plan_delta(ENTITY_MAP, snapshot)
+    assert all(not p["partitions"] for p in quiet)
+    print("✅ Delta plan covers inserts, updates and removals only.")
+
+
+def test_bulk_export_round_trips_transactional_writes(tmp_path):
+    print("\n🧪 Starting neo4j-admin Export Round-Trip Test...")
+    links = enrich_facilities.facility_link_rows([
+        {"subsidiary_name": "PFIZER", "FEI_NUMBER": "1234567", "Firm_Name": "PFIZER LLC", "FIRM_ADDRESS": "Anytown"},
+        {"subsidiary_name": "TEVA", "FEI_NUMBER": "4567890", "Firm_Name": "TEVA", "FIRM_ADDRESS": "New City"},
+        {"subsidiary_name": "ACME", "FEI_NUMBER": "4567890", "Firm_Name": "TEVA", "FIRM_ADDRESS": "New City"},
+    ])
+
+    # What the transactional path sends to Neo4j
+    driver = RecordingDriver()
+    hydrate_baseline.hydrate_frame(driver, ENTITY_MAP, writers=2)
+    enrich_facilities.link_subsidiary_to_facility(driver, links.to_dicts())
+    link_rows = [row for _, q, rows in driver.calls if "OPERATES" in q for row in rows]
+    node_rows = {label: driver.rows(q) for label, q in hydrate_baseline.NODE_QUERIES.items()}
+    edge_rows = {t: driver.rows(q) for t, q in hydrate_baseline.RELATIONSHIP_QUERIES.items()}
+    expected = {
+        "Corporation": {r["name"] for r in node_rows["Corporation"]} | {r["subsidiary_name"] for r in link_rows},
+        "Subsidiary": {r["labeler_id"] for r in node_rows["Subsidiary"]},
+        "Ingredient": {r["name"] for r in node_rows["Ingredient"]},
+        "NDC": {(r["ndc11"], r["drug_description"]) for r in node_rows["NDC"]},
+        "Facility": {(r["FEI_NUMBER"], r["FIRM_NAME"]) for r in link_rows},
+        "OWNS": {(r["manufacturer"], r["labeler_id"]) for r in edge_rows["OWNS"]},
+        "MARKETS": {(r["labeler_id"], r["ndc11"]) for r in edge_rows["MARKETS"]},
+        "CONTAINS": {(r["ndc11"], r["ingredient"]) for r in edge_rows["CONTAINS"]},
+        "OPERATES": {(r["subsidiary_name"], r["FEI_NUMBER"]) for r in link_rows},
+    }
+
+    # What neo4j-admin would load
+    out = str(tmp_path)
+    written = bulk_export.export_import_csvs(ENTITY_MAP, links, out)
+    def read(name):
+        return pl.read_csv(os.path.join(out, name), infer_schema=False)
+    corporations, ndcs, facilities = read("corporations.csv"), read("ndcs.csv"), read("facilities.csv")
+    assert corporations.columns == ["name:ID(Corporation)", ":LABEL"]
+    assert read("owns.csv").columns == [":START_ID(Corporation)", ":END_ID(Subsidiary)", ":TYPE"]
+    assert corporations.height == written["corporations.csv"] == 4  # deduplicated IDs
+    assert facilities.height == 2
+
+    exported = {
+        "Corporation": set(corporations["name:ID(Corporation)"]),
+        "Subsidiary": set(read("subsidiaries.csv")["labeler_id:ID(Subsidiary)"]),
+        "Ingredient": set(read("ingredients.csv")["name:ID(Ingredient)"]),
+        "NDC": set(ndcs.select("ndc11:ID(NDC)", "description").rows()),
+        "Facility": set(facilities.select("fei_number:ID(Facility)", "name").rows()),
+    }
+    for rel_type, (file_name, _) in bulk_export.RELATIONSHIP_FILES.items():
+        rels = read(file_name)
+        assert set(rels[":TYPE"]) == {rel_type}
+        exported[rel_type] = set(rels.select(rels.columns[:2]).rows())
+    assert exported == expected
+
+    command = bulk_export.import_command(out)
+    assert command.startswith("neo4j-admin database import full") and "--relationships=" in command
+    print("✅ CSV export matches the transactional load.")
+
+
+def test_export_graph_writes_delta_snapshot(tmp_path, capsys):
+    data_path, snapshot_path = str(tmp_path / "map.parquet"), str(tmp_path / "hydrated.parquet")
+    ENTITY_MAP.write_parquet(data_path)
+    bulk_export.export_graph(data_path, str(tmp_path / "no_links.parquet"),
+                             str(tmp_path / "csv"), snapshot_path)
+
+    # The next --delta run sees the imported map as already hydrated
+    snapshot = pl.read_parquet(snapshot_path)
+    assert all(not p["partitions"] for p in hydrate_baseline.plan_delta(ENTITY_MAP, snapshot))
+    assert "python src/graph/setup_db.py" in capsys.readouterr().out
@@ -0,0 +1,84 @@
+import sys
+import os
+import time
+import sqlite3
+import json
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.utils.llm_cache import DiskLLMCache
+
+
+def stored_sizes(path):
+    conn = sqlite3.connect(path)
+    try:
+        total = conn.execute("SELECT total_size FROM usage").fetchone()[0]
+        actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    finally:
+        conn.close()
+    return total, actual
+
+
+def test_disk_cache_hits_and_normalizes_prompts(tmp_path):
+    print("\n🧪 Starting LLM Cache Test...")
+    cache = DiskLLMCache(str(tmp_path / "llm.sqlite"))
+    assert cache.get("gemini", "Score this recall") is None
+    cache.set("gemini", "Score this recall", '{"risk": 7}')
+
+    # Whitespace-only differences share an entry; another model does not
+    assert cache.get("gemini", "  Score   this\n recall ") == '{"risk": 7}'
+    assert cache.get("other-model", "Score this recall") is None
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 2
+    print("   ✅ PASS: Hits, misses and prompt normalization.")
+
+
+def test_disk_cache_expires_and_evicts_lru(tmp_path):
+    path = str(tmp_path / "llm.sqlite")
+    cache = DiskLLMCache(path, ttl_seconds=3600, max_bytes=25)
+    cache.set("gemini", "a", "x" * 10)
+    cache.set("gemini", "b", "y" * 10)
+    cache.get("gemini", "a")  # b is now least recently used
+    cache.set("gemini", "c", "z" * 10)
+
+    assert cache.get("gemini", "b") is None
+    assert cache.get("gemini", "a") == "x" * 10
+    assert cache.stats["evictions"] == 1
+
+    # Replacing an entry counts only its new size
+    cache.set("gemini", "a", "x" * 5)
+    assert stored_sizes(path) == (15, 15)
+
+    # Expired entries are dropped on read and no longer counted
+    cache.ttl_seconds = 0.5
+    time.sleep(0.6)
+    assert cache.get("gemini", "c") is None
+    cache.set("gemini", "d", "w" * 3)
+    assert stored_sizes(path) == (3, 3)
+    print("   ✅ PASS: TTL expiry, LRU eviction and the running size total.")
+
+
+def test_corrupt_entry_is_treated_as_a_miss(tmp_path):
+    from signals.src.ingestion import sentinel_ingest
+    from signals.src.utils.llm_backend import LocalStandInBackend
+
+    path = str(tmp_path / "llm.sqlite")
+    cache = DiskLLMCache(path)
+    backend = LocalStandInBackend(latency_seconds=0, error_rate=0)
+    summary = "Voluntary recall of lot 4459 due to a labeling mix-up."
+    prompt = sentinel_ingest._item_cache_prompt(summary)
+    cache.set(backend.model, prompt, '{"analyses": [{"id": 0, "risk_ty')  # truncated write
+
+    results = sentinel_ingest.analyze_risk_with_gemini([summary], backend=backend, cache=cache)
+    assert results[0]["risk_type"] == "Recall"
+    assert backend.stats["calls"] == 1
+    # The bad entry was replaced by the fresh answer
+    assert json.loads(cache.get(backend.model, prompt))["analyses"][0]["risk_type"] == "Recall"
+
+    cache.delete(backend.model, prompt)
+    assert cache.get(backend.model, prompt) is None
+    assert stored_sizes(path) == (0, 0)
+    print("   ✅ PASS: A corrupt cache entry is dropped and re-queried.")
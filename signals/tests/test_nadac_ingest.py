@@ -0,0 +1,337 @@
+import sys
+import os
+import polars as pl
+from datetime import date
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.ingestion import nadac_ingest
+from signals.src.ingestion import nadac_store
+
+
+HEADER = "NDC Description,NDC,NADAC Per Unit,Effective Date,Classification for Rate Setting\n"
+
+
+def write_csv(path, rows):
+    with open(path, "w") as f:
+        f.write(HEADER)
+        for desc, ndc, price, eff in rows:
+            f.write(f"{desc},{ndc},{price},{eff},G\n")
+
+
+def read_history(processed):
+    return nadac_store.scan_nadac_history(str(processed)).sort(["effective_date", "ndc11"]).collect()
+
+
+def test_incremental_ingest(tmp_path):
+    print("\n🧪 Starting Incremental NADAC Ingest Test...")
+    raw = tmp_path / "raw"
+    processed = tmp_path / "processed"
+    raw.mkdir()
+
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/03/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "01/03/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.11, "01/10/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed))
+
+    history = read_history(processed)
+    assert history.height == 3
+    manifest = nadac_ingest.load_manifest(str(processed))
+    assert manifest.height == 1
+    assert manifest["row_count"][0] == 3
+    assert manifest["min_date"][0] == date(2024, 1, 3)
+    assert manifest["max_date"][0] == date(2024, 1, 10)
+    print("   ✅ PASS: First run built history and manifest.")
+
+    # 1. Adding a new file only ingests that file
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.12, "02/07/2024"),
+    ])
+    changed, carried = nadac_ingest.plan_ingest(
+        [str(raw / "nadac_2024_01.csv"), str(raw / "nadac_2024_02.csv")], manifest)
+    assert [os.path.basename(e["path"]) for e in changed] == ["nadac_2024_02.csv"]
+    assert len(carried) == 1
+
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed))
+    history = read_history(processed)
+    assert history.height == 4
+    assert history["effective_date"].is_sorted()
+    print("   ✅ PASS: New file was appended without touching the old one.")
+
+    # 2. A revised file replaces only the effective dates it covers
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.20, "01/10/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed))
+    history = read_history(processed)
+
+    jan_10 = history.filter(pl.col("effective_date") == date(2024, 1, 10))
+    assert jan_10.height == 1 and jan_10["price_per_unit"][0] == 0.20
+    # The revision did not cover 01/03, so those rows survive
+    assert history.filter(pl.col("effective_date") == date(2024, 1, 3)).height == 2
+    assert history.filter(pl.col("effective_date") == date(2024, 2, 7)).height == 1
+    assert nadac_ingest.load_manifest(str(processed)).height == 2
+    print("   ✅ PASS: Revised file replaced only its effective dates.")
+
+    # 3. Nothing changed -> nothing re-read
+    changed, _ = nadac_ingest.plan_ingest(
+        [str(raw / "nadac_2024_01.csv"), str(raw / "nadac_2024_02.csv")],
+        nadac_ingest.load_manifest(str(processed)))
+    assert changed == []
+    print("   ✅ PASS: Unchanged files are skipped.")
+
+
+def test_partitioned_layout(tmp_path):
+    print("\n🧪 Starting Partitioned NADAC Layout Test...")
+    raw = tmp_path / "raw"
+    processed = tmp_path / "processed"
+    raw.mkdir()
+
+    write_csv(raw / "nadac_2023_12.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "12/27/2023"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "12/27/2023"),
+    ])
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.11, "01/03/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.06, "01/03/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed), partitioned=True)
+
+    assert nadac_store.is_partitioned(str(processed))
+    assert not os.path.exists(nadac_store.history_path(str(processed)))
+    parts = nadac_store._partition_files(str(processed))
+    assert [nadac_store._partition_key(p) for p in parts] == [(2023, 12), (2024, 1)]
+    print("   ✅ PASS: One partition per effective month.")
+
+    # Date windows prune partitions; NDC filters still apply inside them
+    jan = nadac_store._partition_files(str(processed), start_date=date(2024, 1, 1))
+    assert len(jan) == 1
+    amox = nadac_store.scan_nadac_history(
+        str(processed), ndc11="00093415573", start_date=date(2024, 1, 1)).collect()
+    assert amox.height == 1 and amox["price_per_unit"][0] == 0.11
+    assert nadac_store.latest_effective_date(str(processed)) == date(2024, 1, 3)
+    print("   ✅ PASS: Date and NDC filters pushed down.")
+
+    # Incremental run only rewrites the touched month
+    dec_mtime = os.path.getmtime(parts[0])
+    write_csv(raw / "nadac_2024_01b.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.12, "01/10/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed), partitioned=True)
+    assert os.path.getmtime(parts[0]) == dec_mtime
+    assert read_history(processed).height == 5
+    print("   ✅ PASS: Incremental partitioned ingest rewrote only January.")
+
+    # Switching back to the flat layout migrates the data
+    os.utime(raw / "nadac_2024_01b.csv", (0, 0))
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.13, "02/07/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(processed), partitioned=False)
+    assert not nadac_store.is_partitioned(str(processed))
+    history = pl.read_parquet(nadac_store.history_path(str(processed)))
+    assert history.height == 6
+    assert history["effective_date"].is_sorted()
+    print("   ✅ PASS: Layout switch migrated the history.")
+
+
+def test_streaming_mode_matches_in_memory(tmp_path):
+    print("\n🧪 Starting Streaming NADAC Consolidation Test...")
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/03/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "01/03/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.11, "01/10/2024"),
+    ])
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.12, "02/07/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.12, "02/07/2024"),
+    ])
+
+    eager = nadac_ingest.fetch_and_process_nadac(str(raw), str(tmp_path / "eager"))
+    streamed = nadac_ingest.fetch_and_process_nadac(
+        str(raw), str(tmp_path / "streamed"), streaming=True, chunk_rows=1_000)
+
+    assert streamed["rows"] == eager["rows"] == 4
+    assert streamed["peak_rss_mb"] is not None and streamed["peak_rss_mb"] > 0
+    assert streamed["peak_worker_rss_mb"] is not None
+    assert read_history(tmp_path / "streamed").equals(read_history(tmp_path / "eager"))
+    print(f"   ✅ PASS: Streaming output matches (peak RSS {streamed['peak_rss_mb']:.0f} MB).")
+
+    # Incremental streaming into the partitioned layout
+    nadac_ingest.fetch_and_process_nadac(
+        str(raw), str(tmp_path / "parts"), partitioned=True, streaming=True)
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.15, "02/07/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(
+        str(raw), str(tmp_path / "parts"), partitioned=True, streaming=True)
+    history = read_history(tmp_path / "parts")
+    assert history.height == 4
+    assert history.filter(pl.col("effective_date") == date(2024, 2, 7))["price_per_unit"][0] == 0.15
+    print("   ✅ PASS: Streaming incremental ingest into partitions.")
+
+    # chunk_rows reaches the streaming engine as its morsel size
+    batch_sizes = []
+    lf = pl.LazyFrame({"a": range(10_000)}).map_batches(
+        lambda df: batch_sizes.append(df.height) or df, streamable=True)
+    with nadac_ingest.streaming_config(1_000):
+        lf.collect(engine="streaming")
+    assert max(batch_sizes) <= 1_000
+
+
+def test_price_runs_round_trip(tmp_path):
+    print("\n🧪 Starting NADAC Price-Run (SCD2) Test...")
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    # Amoxicillin: flat for 3 weeks, spikes, then skips a week at the same price
+    write_csv(raw / "nadac.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/03/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/10/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/17/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.15, "01/24/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.15, "02/07/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "01/03/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "01/10/2024"),
+    ])
+    summary = nadac_ingest.fetch_and_process_nadac(str(raw), str(tmp_path / "processed"))
+    processed = str(tmp_path / "processed")
+
+    runs = nadac_store.scan_price_runs(processed).collect()
+    assert summary["price_runs"] == runs.height == 4
+    print(f"   📊 {summary['rows']} weekly rows -> {runs.height} runs")
+
+    # Full expansion reproduces the weekly table exactly
+    weekly = nadac_store.scan_nadac_history(processed).select(
+        ["effective_date", "ndc_id", "ndc11", "price_per_unit"]).sort(["effective_date", "ndc_id"]).collect()
+    rebuilt = nadac_store.expand_price_runs(pl.scan_parquet(
+        nadac_store.price_runs_path(processed))).collect()
+    assert rebuilt.equals(weekly)
+    print("   ✅ PASS: Runs expand back to the weekly spine.")
+
+    window = nadac_store.expand_price_runs(
+        nadac_store.scan_price_runs(processed, ndc11="00093415573"),
+        start_date=date(2024, 1, 10), end_date=date(2024, 1, 24)).collect()
+    assert window["effective_date"].to_list() == [
+        date(2024, 1, 10), date(2024, 1, 17), date(2024, 1, 24)]
+    print("   ✅ PASS: Windowed expansion.")
+
+    # Incremental ingests rework only the runs around the replaced weeks:
+    # revise a middle week back to the old price and append a new week
+    write_csv(raw / "nadac_revision.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/24/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.06, "01/24/2024"),
+    ])
+    write_csv(raw / "nadac_latest.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.15, "02/14/2024"),
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "02/14/2024"),
+    ])
+    summary = nadac_ingest.fetch_and_process_nadac(str(raw), processed)
+    incremental = nadac_store.scan_price_runs(processed).collect()
+    full = nadac_store.build_price_runs(nadac_store.scan_nadac_history(processed)).collect()
+    assert incremental.equals(full.select(incremental.columns))
+    assert summary["price_runs"] == incremental.height
+    # Amoxicillin 0.10 now runs Jan 3 - Jan 24, and 0.15 continues from Feb 7
+    amox = incremental.filter(pl.col("ndc11") == "00093415573")
+    assert amox.select(["valid_from", "valid_to"]).rows() == [
+        (date(2024, 1, 3), date(2024, 1, 24)), (date(2024, 2, 7), date(2024, 2, 14))]
+    print("   ✅ PASS: Incremental run update matches a full rebuild.")
+
+    prices = nadac_store.scan_weekly_prices(processed, ndc11="00228266711").collect()
+    assert prices["price_per_unit"].to_list() == [0.05, 0.05, 0.06, 0.05]
+
+
+def test_ndc_dictionary_keys(tmp_path):
+    print("\n🧪 Starting NDC Dictionary Test...")
+    from signals.src.entities import ndc_dictionary
+
+    raw = tmp_path / "raw"
+    processed = str(tmp_path / "processed")
+    raw.mkdir()
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("GABAPENTIN 300MG CAP", "00228-2667-11", 0.05, "01/03/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/03/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), processed)
+    first = ndc_dictionary.load_ndc_dictionary(processed)
+    assert first["ndc_id"].to_list() == [0, 1]
+    assert first["ndc_id"].dtype == ndc_dictionary.NDC_ID_DTYPE
+
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("LISINOPRIL 10MG TAB", "00000-0001-01", 0.02, "02/07/2024"),
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.11, "02/07/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), processed)
+    second = ndc_dictionary.load_ndc_dictionary(processed)
+
+    # Existing ids are stable, the new NDC is appended even though it sorts first
+    assert second.head(2).equals(first)
+    assert second.filter(pl.col("ndc11") == "00000000101")["ndc_id"][0] == 2
+
+    history = read_history(processed)
+    assert history["ndc_id"].null_count() == 0
+    # The flat file is stored in (effective_date, ndc_id) order, not ndc11 order
+    stored = pl.read_parquet(nadac_store.history_path(processed))
+    assert stored.equals(stored.sort(["effective_date", "ndc_id"]))
+    assert stored.filter(pl.col("effective_date") == date(2024, 2, 7))["ndc_id"].to_list() == [0, 2]
+    amox_id = ndc_dictionary.lookup_ndc_ids("00093415573", processed)[0]
+    amox = nadac_store.scan_nadac_history(processed, ndc11="00093415573").collect()
+    assert amox.height == 2 and set(amox["ndc_id"]) == {amox_id}
+    print("   ✅ PASS: Dense, stable ndc_ids on every history row.")
+
+
+def test_parallel_staging(tmp_path):
+    print("\n🧪 Starting Parallel NADAC Staging Test...")
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    write_csv(raw / "nadac_2024_01.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.10, "01/03/2024"),
+    ])
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.12, "02/07/2024"),
+    ])
+    # Older CMS layout with underscore headers in a different order
+    with open(raw / "nadac_2023_12.csv", "w") as f:
+        f.write("ndc,ndc_description,nadac_per_unit,effective_date,classification_for_rate_setting\n")
+        f.write("00093-4155-73,AMOXICILLIN 500MG CAP,0.09,12/27/2023,G\n")
+
+    summary = nadac_ingest.fetch_and_process_nadac(
+        str(raw), str(tmp_path / "processed"), workers=2)
+    assert summary["rows"] == 3
+    history = read_history(tmp_path / "processed")
+    assert history["price_per_unit"].to_list() == [0.09, 0.10, 0.12]
+    print("   ✅ PASS: Files normalized across a process pool.")
+
+    staging = tmp_path / "processed" / nadac_ingest.STAGING_DIR
+    assert len(os.listdir(staging)) == 3
+    first = nadac_ingest.read_header(str(raw / "nadac_2024_01.csv"))
+    second = nadac_ingest.read_header(str(raw / "nadac_2024_02.csv"))
+    assert nadac_ingest.header_mapping(first) == nadac_ingest.header_mapping(second)
+    assert nadac_ingest.header_mapping(first)["NADAC Per Unit"] == "price_per_unit"
+
+    # A full reload reuses the staged parquet instead of re-parsing CSVs
+    staged_mtimes = {p: os.path.getmtime(staging / p) for p in os.listdir(staging)}
+    nadac_ingest.fetch_and_process_nadac(
+        str(raw), str(tmp_path / "processed"), full_refresh=True, workers=2)
+    assert {p: os.path.getmtime(staging / p) for p in os.listdir(staging)} == staged_mtimes
+    assert read_history(tmp_path / "processed").height == 3
+    print("   ✅ PASS: Full reload served from staged parquet.")
+
+    # Revising a file prunes only the staged copy it superseded, never
+    # another run's in-flight files
+    in_flight = staging / "other-run.parquet.tmp"
+    in_flight.write_text("")
+    write_csv(raw / "nadac_2024_02.csv", [
+        ("AMOXICILLIN 500MG CAP", "00093-4155-73", 0.13, "02/07/2024"),
+    ])
+    nadac_ingest.fetch_and_process_nadac(str(raw), str(tmp_path / "processed"), workers=2)
+    remaining = set(os.listdir(staging))
+    assert in_flight.name in remaining
+    assert len(remaining) == 4 and not set(staged_mtimes) <= remaining
@@ -0,0 +1,380 @@
+import sys
+import os
+import json
+import zipfile
+import polars as pl
+from datetime import date
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.ingestion import ndc_library
+from signals.src.ingestion.nadac_store import write_nadac_history
+from signals.src.entities import map_builder
+from signals.src.entities.ingredient_matcher import build_ingredient_vocabulary, tag_ingredients
+from signals.src.entities.entity_lookup import get_entity_lookup
+from signals.src.features.signal_generator import ingredient_join_key, attach_shortage_events
+
+
+def make_products(n):
+    products = []
+    for i in range(n):
+        products.append({
+            "product_ndc": f"{i % 40:05d}-{i:04d}",
+            "generic_name": "Amoxicillin" if i % 2 else "Cisplatin",
+            "brand_name": f"Brand {i}",
+            "labeler_name": "Teva Pharmaceuticals USA, Inc" if i % 3 else "Baxter LLC",
+            "active_ingredients": [{"name": "amoxicillin", "strength": "500 mg/1"}] if i % 5 else [],
+            "marketing_start_date": "20200115",
+            "product_type": "HUMAN PRESCRIPTION DRUG",
+            "packaging": [{"package_ndc": f"{i % 40:05d}-{i:04d}-01", "description": "100 CAPSULE"}],
+            "openfda": {"manufacturer_name": ["Teva"], "note": "results: [ ] braces { } inside strings"},
+        })
+    return products
+
+
+def test_bulk_loader_matches_api_processing(tmp_path):
+    print("\n🧪 Starting Bulk NDC Loader Test...")
+    products = make_products(230)
+    products.append(dict(products[0]))  # duplicate product row
+    zip_path = tmp_path / "drug-ndc-0001-of-0001.json.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        document = {"meta": {"results": {"skip": 0, "limit": 231, "total": 231}},
+                    "results": products}
+        archive.writestr("drug-ndc-0001-of-0001.json", json.dumps(document, indent=1))
+
+    # Tiny reads and batches force elements across chunk and batch boundaries
+    ndc_library.load_bulk_ndc_directory(str(zip_path), str(tmp_path),
+                                        batch_size=17, read_chars=97)
+
+    bulk = pl.read_parquet(tmp_path / ndc_library.NDC_DIRECTORY_FILE)
+    expected = ndc_library.process_ndc_directory(products)
+    assert bulk.schema == expected.schema
+    assert bulk.sort("product_ndc").equals(expected.sort("product_ndc"))
+    assert bulk.height == 230
+    assert not os.path.exists(tmp_path / (ndc_library.NDC_DIRECTORY_FILE + ".batches"))
+    print("   ✅ PASS: Incremental bulk parse matches the API processing path.")
+
+
+def test_api_mode_warns_when_capped(capsys):
+    print("\n🧪 Starting NDC API Cap Warning Test...")
+
+    class CappedClient:
+        page_size = 100
+
+        def fetch_all(self, url, search=None, max_records=None):
+            return make_products(max_records)
+
+    ndc_library.fetch_ndc_directory(client=CappedClient(), max_records=50)
+    assert "PARTIAL" in capsys.readouterr().out
+
+    class ShortClient(CappedClient):
+        def fetch_all(self, url, search=None, max_records=None):
+            return make_products(10)
+
+    ndc_library.fetch_ndc_directory(client=ShortClient(), max_records=50)
+    assert "PARTIAL" not in capsys.readouterr().out
+    print("   ✅ PASS: A capped API fetch warns that the directory is partial.")
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_bulk_download_revalidates_stale_cache(tmp_path):
+    print("\n🧪 Starting Bulk NDC Download Freshness Test...")
+
+    class FakeResponse:
+        def __init__(self, status_code, body=b""):
+            self.status_code, self.body = status_code, body
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, chunk_size):
+            yield self.body
+
+    class FakeHTTP:
+        def __init__(self):
+            self.requests, self.responses = [], []
+
+        def get(self, url, stream, timeout, headers):
+            self.requests.append(headers)
+            return self.responses.pop(0)
+
+    http = FakeHTTP()
+    dest_dir = str(tmp_path)
+    http.responses.append(FakeResponse(200, b"v1"))
+    dest = ndc_library.download_bulk_file(dest_dir=dest_dir, http=http)
+    assert read_bytes(dest) == b"v1" and http.requests == [{}]
+
+    # Younger than the max age: reused without a request
+    ndc_library.download_bulk_file(dest_dir=dest_dir, http=http)
+    assert len(http.requests) == 1
+
+    # Stale: revalidated; 304 keeps the file, 200 replaces it
+    os.utime(dest, (0, 0))
+    http.responses.append(FakeResponse(304))
+    ndc_library.download_bulk_file(dest_dir=dest_dir, http=http)
+    assert "If-Modified-Since" in http.requests[-1]
+    assert read_bytes(dest) == b"v1"
+    os.utime(dest, (0, 0))
+    http.responses.append(FakeResponse(200, b"v2"))
+    ndc_library.download_bulk_file(dest_dir=dest_dir, http=http)
+    assert read_bytes(dest) == b"v2"
+
+    # refresh=True always downloads, unconditionally
+    http.responses.append(FakeResponse(200, b"v3"))
+    ndc_library.download_bulk_file(dest_dir=dest_dir, refresh=True, http=http)
+    assert http.requests[-1] == {} and read_bytes(dest) == b"v3"
+    print("   ✅ PASS: Stale bulk files are revalidated; --refresh forces a download.")
+
+
+def test_ndc_index_normalizes_all_layouts():
+    print("\n🧪 Starting NDC Normalization Index Test...")
+    from signals.src.entities.ndc_index import build_ndc_index
+
+    directory = pl.DataFrame({
+        "product_ndc": ["0591-2897", "50090-123", "12345-6789", "bad-ndc"],
+        "package_ndcs": [["0591-2897-01"], ["50090-123-05"], ["12345-6789-1", "12345-6789-22"], ["x"]],
+    })
+    index = build_ndc_index(directory).collect()
+
+    products = dict(index.filter(pl.col("ndc11_key").is_null())
+                    .select("product_ndc", "product_key").iter_rows())
+    assert products == {"0591-2897": 5912897, "50090-123": 500900123, "12345-6789": 123456789}
+
+    packages = dict(index.filter(pl.col("ndc11_key").is_not_null())
+                    .select("package_ndc", "ndc11_key").iter_rows())
+    assert packages == {
+        "0591-2897-01": 591289701,       # 4-4-2 -> 00591-2897-01
+        "50090-123-05": 50090012305,     # 5-3-2 -> 50090-0123-05
+        "12345-6789-1": 12345678901,     # 5-4-1 -> 12345-6789-01
+        "12345-6789-22": 12345678922,    # already 5-4-2
+    }
+    assert (index["ndc11_key"].drop_nulls() // 100).is_in(index["product_key"].implode()).all()
+    print("   ✅ PASS: 4-4-2, 5-3-2 and 5-4-1 NDCs map to canonical integer keys.")
+
+
+def test_incremental_entity_map_matches_full_build(tmp_path):
+    print("\n🧪 Starting Incremental Entity Map Test...")
+
+    def nadac(rows):
+        return pl.DataFrame(
+            [{"effective_date": d, "ndc_id": i, "ndc11": n, "price_per_unit": 1.0,
+              "drug_description": desc, "classification": "G"} for d, i, n, desc in rows],
+            schema_overrides={"ndc_id": pl.UInt32})
+
+    def directory(acme_name):
+        return pl.DataFrame({
+            "product_ndc": ["0591-2897", "12345-678", "55555-1234"],
+            "manufacturer_simple": [acme_name, "BETA", "GAMMA"],
+            "ingredient_name": ["IBUPROFEN", "NAPROXEN", "ASPIRIN"],
+            "package_ndcs": [["0591-2897-01"], ["12345-678-90"], ["55555-1234-1"]],
+        })
+
+    week1 = [(date(2026, 1, 7), 1, "00591289701", "IBUPROFEN 200MG TAB"),
+             (date(2026, 1, 7), 2, "12345067890", "NAPROXEN 250MG TAB"),
+             (date(2026, 1, 7), 3, "99999000011", "MYSTERY 5MG CAP")]
+    week2 = week1 + [(date(2026, 1, 14), 4, "55555123401", "ASPIRIN 81MG TAB")]
+
+    incremental_dir, full_dir = tmp_path / "incremental", tmp_path / "full"
+    write_nadac_history(nadac(week1), str(incremental_dir), partitioned=True)
+    directory("ACME").write_parquet(incremental_dir / "ndc_directory.parquet")
+    map_builder.build_entity_map(str(incremental_dir))
+
+    # Next week: one new NDC, and the directory renamed one manufacturer
+    write_nadac_history(nadac(week2), str(incremental_dir), partitioned=True)
+    directory("ACME HOLDINGS").write_parquet(incremental_dir / "ndc_directory.parquet")
+    updated = map_builder.build_entity_map(str(incremental_dir), incremental=True)
+
+    write_nadac_history(nadac(week2), str(full_dir), partitioned=True)
+    directory("ACME HOLDINGS").write_parquet(full_dir / "ndc_directory.parquet")
+    rebuilt = map_builder.build_entity_map(str(full_dir))
+
+    assert updated.sort("ndc_id").equals(rebuilt.sort("ndc_id"))
+    assert updated.filter(pl.col("ndc_id") == 1)["manufacturer"].item() == "ACME HOLDINGS"
+    assert updated.filter(pl.col("ndc_id") == 4)["manufacturer"].item() == "GAMMA"
+
+    # The memory-mapped lookup answers the same as the map, aligned with the input ids
+    lookup = get_entity_lookup(str(incremental_dir))
+    ids = [4, 99, 1, None, 2]
+    found = lookup.lookup(ids)
+    expected = (
+        pl.DataFrame({"ndc_id": ids}, schema={"ndc_id": pl.UInt32})
+        .join(updated.drop("ndc11"), on="ndc_id", how="left", maintain_order="left")
+    )
+    assert found.equals(expected.select(found.columns))
+
+    # A revision of an already-built week adds an NDC dated before the last build
+    week1_revised = week2 + [(date(2026, 1, 7), 5, "12345067891", "NAPROXEN 500MG TAB")]
+    write_nadac_history(nadac(week1_revised), str(incremental_dir), partitioned=True)
+    revised = map_builder.build_entity_map(str(incremental_dir), incremental=True)
+    write_nadac_history(nadac(week1_revised), str(full_dir), partitioned=True)
+    assert revised.sort("ndc_id").equals(map_builder.build_entity_map(str(full_dir)).sort("ndc_id"))
+    assert revised.filter(pl.col("ndc_id") == 5)["manufacturer"].item() == "BETA"
+    print("   ✅ PASS: Incremental map equals a full rebuild.")
+
+
+def test_incremental_entity_map_follows_vocabulary_and_descriptions(tmp_path, monkeypatch):
+    print("\n🧪 Starting Incremental Re-tag Test...")
+
+    def nadac(naproxen_description):
+        return pl.DataFrame(
+            [{"effective_date": date(2026, 1, 7), "ndc_id": i, "ndc11": n, "price_per_unit": 1.0,
+              "drug_description": desc, "classification": "G"}
+             for i, n, desc in [(1, "00591289701", "IBUPROFEN 200MG TAB"),
+                                (2, "12345067890", naproxen_description),
+                                (3, "99999000011", "ORAL MYSTERY 5MG CAP"),
+                                (4, "88888000011", "ORAL CALM 5MG CAP")]],
+            schema_overrides={"ndc_id": pl.UInt32})
+
+    def directory(ingredients):
+        return pl.DataFrame({
+            "product_ndc": ["0591-2897", "12345-678", "77777-0001"],
+            "manufacturer_simple": ["ACME", "BETA", "DELTA"],
+            "ingredient_name": ingredients,
+            "package_ndcs": [["0591-2897-01"], ["12345-678-90"], ["77777-0001-01"]],
+        })
+
+    resolved_ids = []
+    resolve = map_builder.resolve_entities
+
+    def recording_resolve(nadac_map, *lookups):
+        resolved_ids.append(sorted(nadac_map["ndc_id"].to_list()))
+        return resolve(nadac_map, *lookups)
+
+    monkeypatch.setattr(map_builder, "resolve_entities", recording_resolve)
+    incremental_dir, full_dir = tmp_path / "incremental", tmp_path / "full"
+    write_nadac_history(nadac("NAPROXEN 250MG TAB"), str(incremental_dir), partitioned=True)
+    directory(["IBUPROFEN", "NAPROXEN", "ASPIRIN"]).write_parquet(incremental_dir / "ndc_directory.parquet")
+    map_builder.build_entity_map(str(incremental_dir))
+
+    # NADAC revises one description
+    write_nadac_history(nadac("NAPROXEN SODIUM 275MG TAB"), str(incremental_dir), partitioned=True)
+    updated = map_builder.build_entity_map(str(incremental_dir), incremental=True)
+    assert resolved_ids[-1] == [2]
+    assert updated.filter(pl.col("ndc_id") == 2)["drug_description"].item() == "NAPROXEN SODIUM 275MG TAB"
+
+    # The vocabulary gains a term only one description contains
+    directory(["IBUPROFEN", "NAPROXEN", "MYSTERY"]).write_parquet(incremental_dir / "ndc_directory.parquet")
+    updated = map_builder.build_entity_map(str(incremental_dir), incremental=True)
+    assert resolved_ids[-1] == [3]
+
+    write_nadac_history(nadac("NAPROXEN SODIUM 275MG TAB"), str(full_dir), partitioned=True)
+    directory(["IBUPROFEN", "NAPROXEN", "MYSTERY"]).write_parquet(full_dir / "ndc_directory.parquet")
+    assert updated.sort("ndc_id").equals(map_builder.build_entity_map(str(full_dir)).sort("ndc_id"))
+    assert updated.sort("ndc_id")["ingredient"].to_list() == ["IBUPROFEN", "NAPROXEN", "MYSTERY", "ORAL"]
+    print("   ✅ PASS: Only re-tagged and revised descriptions were resolved again.")
+
+
+def test_entity_map_prefers_package_listing(tmp_path):
+    print("\n🧪 Starting Package-Level Entity Join Test...")
+    # The directory lists one product NDC twice (e.g. after a relabel)
+    pl.DataFrame({
+        "product_ndc": ["0591-2897", "0591-2897"],
+        "manufacturer_simple": ["OLD LABEL", "NEW LABEL"],
+        "ingredient_name": ["IBUPROFEN", "IBUPROFEN"],
+        "package_ndcs": [["0591-2897-01"], ["0591-2897-05"]],
+    }).write_parquet(tmp_path / "ndc_directory.parquet")
+    write_nadac_history(pl.DataFrame(
+        [{"effective_date": date(2026, 1, 7), "ndc_id": i, "ndc11": n, "price_per_unit": 1.0,
+          "drug_description": "IBUPROFEN 200MG TAB", "classification": "G"}
+         for i, n in [(1, "00591289701"), (2, "00591289705"), (3, "00591289799")]],
+        schema_overrides={"ndc_id": pl.UInt32}), str(tmp_path), partitioned=True)
+
+    built = map_builder.build_entity_map(str(tmp_path)).sort("ndc_id")
+    # Listed packages resolve to their own row; an unlisted one falls back to the product
+    assert built["manufacturer"].to_list() == ["OLD LABEL", "NEW LABEL", "OLD LABEL"]
+    print("   ✅ PASS: Package NDCs resolve before product NDCs.")
+
+
+def test_ingredient_matcher_prefers_longest_terms():
+    print("\n🧪 Starting Ingredient Matcher Test...")
+    directory = pl.DataFrame({"ingredient_name": [
+        "SODIUM CHLORIDE", "SODIUM BICARBONATE", "SODIUM", "HYDROCODONE BITARTRATE",
+        "HYDROCODONE", "ACETAMINOPHEN", "UNKNOWN"]})
+    vocabulary = build_ingredient_vocabulary(directory)
+    descriptions = pl.DataFrame({"drug_description": [
+        "SODIUM CHLORIDE 0.9% FLUSH", "Sodium Bicarbonate 650 mg tab",
+        "HYDROCODONE-ACETAMINOPHEN 5-325", "HYDROCODONE BITARTRATE/APAP", "ZZ UNKNOWN", None]})
+
+    tagged = tag_ingredients(descriptions, "drug_description", vocabulary)
+
+    assert tagged["ingredient_match"].to_list() == [
+        "SODIUM CHLORIDE", "SODIUM BICARBONATE", "ACETAMINOPHEN", "HYDROCODONE BITARTRATE", None, None]
+    # Both halves of a combination, without the terms nested in longer ones
+    assert tagged["ingredient_matches"].to_list() == [
+        ["SODIUM CHLORIDE"], ["SODIUM BICARBONATE"], ["HYDROCODONE", "ACETAMINOPHEN"],
+        ["HYDROCODONE BITARTRATE"], [], []]
+    print("   ✅ PASS: Multi-word and combination ingredients resolved.")
+
+
+def test_shortage_join_handles_salts_and_combinations():
+    print("\n🧪 Starting Shortage Ingredient Join Test...")
+    directory = pl.DataFrame({
+        "ingredient_name": ["METFORMIN HYDROCHLORIDE", "SODIUM CHLORIDE", "SODIUM BICARBONATE", "AMOXICILLIN"],
+        "ingredient_names": [["METFORMIN HYDROCHLORIDE"], ["SODIUM CHLORIDE"], ["SODIUM BICARBONATE"],
+                             ["AMOXICILLIN", "CLAVULANATE POTASSIUM"]],
+    })
+    vocabulary = build_ingredient_vocabulary(directory)
+    # The second ingredient of a combination product is a term too
+    assert "CLAVULANATE POTASSIUM" in vocabulary["term"].to_list()
+
+    # NDC 5 sells the combination's second ingredient on its own
+    entities = pl.DataFrame({"ndc_id": [1, 2, 3, 4, 5],
+                             "ingredient": [*directory["ingredient_name"], "CLAVULANATE POTASSIUM"]})
+    spine = (
+        pl.DataFrame({"effective_date": [date(2026, 1, 14)] * 5, "ndc_id": [1, 2, 3, 4, 5]})
+        .join(ingredient_join_key(entities, "ingredient", vocabulary).select("ndc_id", "join_key", "base_key"),
+              on="ndc_id", how="left")
+    )
+    events = ingredient_join_key(pl.DataFrame({
+        "event_date": [date(2026, 1, 2), date(2026, 1, 5), date(2026, 1, 9)],
+        "generic_name": ["Metformin", "Sodium Chloride 0.9%", "Amoxicillin and Clavulanate Potassium"],
+        "event_type": ["shortage_start"] * 3,
+        "reason": ["demand", "manufacturing", "discontinuation"],
+    }), "generic_name", vocabulary)
+
+    joined = attach_shortage_events(spine, events).sort("ndc_id")
+    # Salt form still matches as the first-word key did; saline stays off the
+    # bicarbonate NDC, which the first-word key ("SODIUM") would have hit; the
+    # combination shortage reaches the NDCs of both its ingredients
+    assert joined["event_date"].to_list() == [
+        date(2026, 1, 2), date(2026, 1, 5), None, date(2026, 1, 9), date(2026, 1, 9)]
+    print("   ✅ PASS: Exact ingredients where known, first-word fallback otherwise.")
+
+
+def test_entity_lookup_reloads_rewritten_files(tmp_path):
+    print("\n🧪 Starting Entity Lookup Reload Test...")
+    from signals.src.entities import entity_lookup
+
+    def write_map(manufacturer):
+        pl.DataFrame({
+            "ndc_id": [0, 1], "ndc11": ["00001000101", "00001000201"],
+            "drug_description": ["IBUPROFEN 200MG", "NAPROXEN 250MG"],
+            "manufacturer": [manufacturer, "BETA"], "ingredient": ["IBUPROFEN", "NAPROXEN"],
+            "labeler_id": ["00001", "00001"],
+        }).write_parquet(tmp_path / entity_lookup.ENTITY_MAP_FILE)
+
+    write_map("ACME")
+    first = get_entity_lookup(str(tmp_path))
+    assert get_entity_lookup(str(tmp_path)) is first
+
+    # Another process rebuilds map and lookup; the cached lookup is not stale by mtime
+    write_map("ACME HOLDINGS")
+    entity_lookup.write_entity_lookup(str(tmp_path))
+    second = get_entity_lookup(str(tmp_path))
+    assert second is not first
+    assert second.lookup([0])["manufacturer"].to_list() == ["ACME HOLDINGS"]
+    print("   ✅ PASS: A lookup rewritten elsewhere is picked up.")
@@ -0,0 +1,48 @@
+import sys
+import os
+import polars as pl
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.utils.seen_ledger import SQLiteSeenLedger
+from signals.src.ingestion.sentinel_ingest import mark_scored_risks
+
+
+def test_seen_ledger_unseen_seen_changed(tmp_path):
+    print("\n🧪 Starting Sentinel Seen-Ledger Test...")
+    ledger = SQLiteSeenLedger(str(tmp_path / "seen.sqlite"))
+    recall = {"guid": "fda-1", "title": "Recall", "summary": "Lot 42 recalled for particulates."}
+    letter = {"guid": "fda-2", "title": "Warning Letter", "summary": "CGMP violations."}
+
+    # Unseen items are all sent
+    assert ledger.filter_unseen([recall, letter]) == [recall, letter]
+
+    # Seen items are skipped, also by a fresh ledger on the same file
+    ledger.mark_seen([recall, letter])
+    assert SQLiteSeenLedger(str(tmp_path / "seen.sqlite")).filter_unseen([recall, letter]) == []
+
+    # Changed content is re-sent
+    revised = dict(recall, summary="Lot 42 and 43 recalled for particulates.")
+    assert ledger.filter_unseen([revised, letter]) == [revised]
+    print("   ✅ PASS: unseen -> seen -> changed content is re-scored.")
+
+
+def test_mark_scored_risks_skips_failed_analyses(tmp_path):
+    ledger = SQLiteSeenLedger(str(tmp_path / "seen.sqlite"))
+    saved = pl.DataFrame({
+        "item_id": ["fda-1", "fda-2"],
+        "title": ["Recall", "Warning Letter"],
+        "raw_summary": ["Lot 42 recalled for particulates.", "CGMP violations."],
+        "risk_type": ["Recall", "Error"],
+    })
+    mark_scored_risks(saved, ledger)
+
+    items = [{"guid": "fda-1", "title": "Recall", "summary": "Lot 42 recalled for particulates."},
+             {"guid": "fda-2", "title": "Warning Letter", "summary": "CGMP violations."}]
+    # The failed analysis stays unseen and is retried next run
+    assert [i["guid"] for i in ledger.filter_unseen(items)] == ["fda-2"]
+    print("   ✅ PASS: Only saved, successfully scored rows are marked seen.")
@@ -0,0 +1,241 @@
+import sys
+import os
+import re
+import json
+import random
+import threading
+import pytest
+import polars as pl
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.ingestion import sentinel_ingest
+from signals.src.utils.llm_cache import LLMCache, NullLLMCache
+from signals.src.utils.llm_backend import LLMBackend
+
+
+class FakeGemini(LLMBackend):
+    """Answers risk prompts out of order, with scripted failures per chunk."""
+
+    model = "fake-gemini"
+
+    def __init__(self, fail_first=(), drop_id=()):
+        super().__init__()
+        self.fail_first = set(fail_first)   # chunk first-summaries that error once
+        self.drop_id = set(drop_id)         # chunk first-summaries that always omit one id
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _generate(self, prompt):
+        items = re.findall(r'<summary id="(\d+)">(.*?)</summary>', prompt)
+        first = items[0][1]
+        with self.lock:
+            self.calls.append(first)
+            if first in self.fail_first:
+                self.fail_first.discard(first)
+                raise RuntimeError("503 UNAVAILABLE")
+        analyses = [{"id": item_id, "risk_type": "Recall", "manufacturer": text,
+                     "product": None, "severity_score": 5} for item_id, text in items]
+        if first in self.drop_id:
+            analyses = analyses[:-1]
+        random.shuffle(analyses)
+        return json.dumps({"analyses": analyses})
+
+
+def test_chunked_scoring_stays_aligned(monkeypatch):
+    print("\n🧪 Starting Chunked Risk Scoring Test...")
+    monkeypatch.setattr(sentinel_ingest, "RISK_RETRY_SECONDS", 0)
+    summaries = [f"item-{i}" for i in range(23)]
+    client = FakeGemini(fail_first={"item-10"}, drop_id={"item-20"})
+
+    results = sentinel_ingest.analyze_risk_with_gemini(
+        summaries, chunk_size=5, max_workers=3, backend=client, cache=NullLLMCache())
+
+    assert len(results) == len(summaries)
+    # Shuffled responses still land on the right item
+    for text, result in zip(summaries[:22], results[:22]):
+        assert result["manufacturer"] == text and "id" not in result
+    # The id the model kept dropping is the only Error; its chunk-mates are kept
+    assert results[22]["risk_type"] == "Error"
+    assert results[20]["manufacturer"] == "item-20"
+
+    # Only the failing chunks were retried
+    retried = {first for first in client.calls if client.calls.count(first) > 1}
+    assert retried == {"item-10", "item-20"}
+    assert client.calls.count("item-10") == 2
+    assert client.calls.count("item-20") == sentinel_ingest.RISK_MAX_RETRIES
+    print("   ✅ PASS: Results aligned by id; only failed chunks retried.")
+
+
+class DictLLMCache(LLMCache):
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+
+    def _get(self, key):
+        return self.entries.get(key)
+
+    def _set(self, key, model, value):
+        self.entries[key] = value
+
+
+def test_cache_is_per_summary_across_chunkings():
+    print("\n🧪 Starting Per-Summary LLM Cache Test...")
+    cache = DictLLMCache()
+    summaries = [f"item-{i}" for i in range(7)]
+    first = sentinel_ingest.analyze_risk_with_gemini(
+        summaries, chunk_size=3, max_workers=2, backend=FakeGemini(), cache=cache)
+
+    # A new item at the front shifts every chunk boundary
+    client = FakeGemini()
+    second = sentinel_ingest.analyze_risk_with_gemini(
+        ["item-new"] + summaries, chunk_size=3, max_workers=2, backend=client, cache=cache)
+
+    assert second[1:] == first
+    assert second[0]["manufacturer"] == "item-new"
+    assert client.calls == ["item-new"]  # only the miss reached the model
+    print("   ✅ PASS: Cached summaries hit regardless of how the batch is chunked.")
+
+
+RSS = b"""<?xml version="1.0"?><rss version="2.0"><channel><title>t</title>
+<item><title>%s</title><link>http://fda.gov/%s</link><guid>%s-1</guid>
+<pubDate>Fri, 16 Jan 2026 12:00:00 GMT</pubDate><description>Recall of %s lot 7</description></item>
+</channel></rss>"""
+
+
+class FakeHTTPResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeFeeds:
+    """Serves one item per feed and honours If-None-Match like the FDA CDN."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers, timeout):
+        source = url.rsplit("/", 1)[-1]
+        self.requests.append((source, headers.get("If-None-Match")))
+        etag = f'"{source}-v1"'
+        if headers.get("If-None-Match") == etag:
+            return FakeHTTPResponse(304)
+        body = RSS % ((source.encode(),) * 4)
+        return FakeHTTPResponse(200, body, {"ETag": etag})
+
+
+class MemoryCache:
+    def __init__(self):
+        self.puts = []
+
+    def put(self, url, params, payload):
+        self.puts.append(url)
+
+
+def test_conditional_multi_feed_polling():
+    print("\n🧪 Starting Multi-Feed Polling Test...")
+    feeds = {"medwatch": "http://feeds/medwatch", "recalls": "http://feeds/recalls"}
+    http, cache = FakeFeeds(), MemoryCache()
+
+    items, statuses, state = sentinel_ingest.poll_feeds(feeds, {}, replay=False, cache=cache, http=http)
+    assert statuses == {"medwatch": "changed", "recalls": "changed"}
+    assert sorted(i["source"] for i in items) == ["medwatch", "recalls"]
+    assert {tuple(sorted(i)) for i in items} == {
+        ("guid", "link", "published", "source", "summary", "title")}
+    assert state["http://feeds/recalls"] == {"etag": '"recalls-v1"'}
+
+    # Second poll sends the validators; 304s return nothing and cache nothing
+    items, statuses, _ = sentinel_ingest.poll_feeds(feeds, state, replay=False, cache=cache, http=http)
+    assert items == [] and set(statuses.values()) == {"unchanged"}
+    assert sorted(http.requests[2:]) == [("medwatch", '"medwatch-v1"'), ("recalls", '"recalls-v1"')]
+    assert len(cache.puts) == 2
+    print("   ✅ PASS: Changed feeds parsed into one schema; unchanged feeds skipped.")
+
+
+def test_triage_matches_whole_words_only():
+    print("\n🧪 Starting Sentinel Triage Test...")
+    triaged = sentinel_ingest.triage_summaries([
+        "Patient deceased; molded tablets shipped as usual.",   # CEASE / MOLD inside words
+        "Production ceased after mold was found.",
+        "Lot DISCONTINUED due to non-sterile vials.",            # stem + hyphenated keyword
+        "Routine label update by Tevacorp.",                    # TEVA inside a longer name
+        "Routine label update by Teva.",
+    ], manufacturers=["TEVA"])
+
+    assert triaged["is_candidate"].to_list() == [False, True, True, False, True]
+    assert triaged["risk_hits"][1].to_list() == ["CEASED", "MOLD"]
+    assert triaged["risk_hits"][2].to_list() == ["DISCONTINU", "NON STERILE"]
+    assert triaged["manufacturer_hits"][4].to_list() == ["TEVA"]
+    print("   ✅ PASS: Keywords and manufacturers match on word boundaries.")
+
+
+def test_triaged_scores_stay_aligned(monkeypatch):
+    reports = [
+        {"guid": f"fda-{i}", "title": f"Item {i}", "link": f"http://fda.gov/{i}", "source": "demo",
+         "published": None, "summary": summary}
+        for i, summary in enumerate([
+            "Recall of saline lot 7.",
+            "Agency newsletter: conference schedule.",
+            "Baxter expands a plant.",
+            "Holiday closure of the public docket office.",   # CLOSURE is a risk term
+            "Moldedware trade show announced.",
+        ])
+    ]
+    client = FakeGemini()
+    monkeypatch.setattr(sentinel_ingest, "fetch_enforcement_reports", lambda: (reports, {}))
+    monkeypatch.setattr(sentinel_ingest, "load_manufacturer_vocabulary", lambda: ["BAXTER"])
+    monkeypatch.setattr(sentinel_ingest, "get_llm_cache", NullLLMCache)
+    monkeypatch.setattr(sentinel_ingest, "get_llm_backend", lambda: client)
+
+    scored, _ = sentinel_ingest.fetch_and_score_rss(dedupe=False)
+
+    # Only candidates reach the LLM; every row keeps its own report's analysis
+    assert sorted(client.calls) == ["Recall of saline lot 7."]
+    assert scored["item_id"].to_list() == [r["guid"] for r in reports]
+    llm_rows = scored.filter(pl.col("risk_type") == "Recall")
+    assert llm_rows["manufacturer"].to_list() == llm_rows["raw_summary"].to_list()
+    assert llm_rows["item_id"].to_list() == ["fda-0", "fda-2", "fda-3"]
+    local = scored.filter(pl.col("risk_type") == "No Specific Risk Identified")
+    assert local["item_id"].to_list() == ["fda-1", "fda-4"]
+    assert local["severity_score"].to_list() == [0, 0]
+    print("   ✅ PASS: Local and LLM scores land on the right reports.")
+
+
+def test_failed_scoring_keeps_feeds_refetchable(tmp_path, monkeypatch):
+    print("\n🧪 Starting Feed State Commit Test...")
+    feeds = {"recalls": "http://feeds/recalls"}
+    state_path = str(tmp_path / "feed_state.json")
+    http, cache = FakeFeeds(), MemoryCache()
+    poll = sentinel_ingest.fetch_enforcement_reports
+
+    def fetch():
+        return poll(
+            feeds, replay=False, cache=cache, state_path=state_path, http=http)
+
+    def crash(summaries):
+        raise RuntimeError("LLM down")
+
+    monkeypatch.setattr(sentinel_ingest, "fetch_enforcement_reports", fetch)
+    monkeypatch.setattr(sentinel_ingest, "analyze_risk_with_gemini", crash)
+    with pytest.raises(RuntimeError):
+        sentinel_ingest.fetch_and_score_rss(dedupe=False, triage=False)
+
+    # Nothing was persisted, so the next poll fetches the same item again
+    items, state = fetch()
+    assert len(items) == 1 and http.requests[-1] == ("recalls", None)
+
+    # Committed after a successful save, the feed answers 304
+    sentinel_ingest.save_feed_state(state, state_path)
+    items, _ = fetch()
+    assert items == [] and http.requests[-1] == ("recalls", '"recalls-v1"')
+    print("   ✅ PASS: Feed validators are only saved after the items are stored.")
@@ -0,0 +1,170 @@
+import sys
+import os
+import glob
+import polars as pl
+from datetime import date, datetime
+
+# --- Path Correction ---
+# Add the project's root directory (the one containing the 'signals' package) to the Python path.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from signals.src.ingestion import sentinel_store
+
+
+def scored(rows, scored_at):
+    return pl.DataFrame(
+        [{"item_id": i, "event_date": d, "manufacturer": m, "risk_type": "Recall",
+          "severity_score": s, "raw_summary": f"{i} summary"} for i, d, m, s in rows]
+    ).with_columns(pl.lit(scored_at).alias("scored_at"))
+
+
+def test_append_upsert_prune_and_compact(tmp_path):
+    print("\n🧪 Starting Sentinel Risk Store Test...")
+    processed = str(tmp_path)
+
+    # Three hourly runs; the third re-scores item "a" (idempotent upsert)
+    sentinel_store.append_risks(scored([("a", date(2025, 9, 1), "ABBOTT", 6),
+                                        ("b", date(2026, 1, 10), "PFIZER", 9)],
+                                       datetime(2026, 1, 10, 8)), processed)
+    sentinel_store.append_risks(scored([("c", date(2026, 1, 10), "TEVA", 3)],
+                                       datetime(2026, 1, 10, 9)), processed)
+    sentinel_store.append_risks(scored([("a", date(2025, 9, 1), "ABBOTT", 8)],
+                                       datetime(2026, 1, 10, 10)), processed)
+
+    everything = sentinel_store.scan_risks(processed).collect()
+    assert everything.height == 3
+    assert everything.filter(pl.col("item_id") == "a")["severity_score"].to_list() == [8]
+
+    # A 90-day window only reads the January partition
+    window = sentinel_store._partition_files(processed, date(2025, 10, 12), date(2026, 1, 10))
+    assert {os.path.basename(os.path.dirname(f)) for f in window} == {"event_date=2026-01-10"}
+    recent = sentinel_store.scan_risks(processed, date(2025, 10, 12), date(2026, 1, 10)).collect()
+    assert sorted(recent["item_id"].to_list()) == ["b", "c"]
+
+    # Compaction merges each partition to one file without changing what readers see
+    sentinel_store.compact_risks(processed)
+    files = glob.glob(os.path.join(processed, sentinel_store.STORE_DIR, "event_date=*", "*.parquet"))
+    assert len(files) == 2
+    after = sentinel_store.scan_risks(processed).collect()
+    assert after.sort("item_id").equals(everything.sort("item_id"))
+    print("   ✅ PASS: Upserts, window pruning and compaction behave.")
+
+
+def test_compaction_drops_versions_left_in_other_partitions(tmp_path, monkeypatch):
+    print("\n🧪 Starting Cross-Partition Compaction Test...")
+    processed = str(tmp_path)
+    scanned = []
+    scan_files = sentinel_store._scan_files
+    monkeypatch.setattr(sentinel_store, "_scan_files",
+                        lambda files: scanned.extend(files) or scan_files(files))
+    sentinel_store.append_risks(scored([("a", date(2026, 1, 9), "ABBOTT", 6),
+                                        ("b", date(2026, 1, 9), "PFIZER", 9)],
+                                       datetime(2026, 1, 10, 8)), processed)
+    # The source revised item "a"'s date: its new version lands in another partition
+    sentinel_store.append_risks(scored([("a", date(2026, 1, 10), "ABBOTT", 7)],
+                                       datetime(2026, 1, 10, 9)), processed)
+    everything = sentinel_store.scan_risks(processed).collect()
+
+    # Before compaction a window that misses the new version must not read the
+    # stale one, and still only opens its own partition
+    scanned.clear()
+    day_before = sentinel_store.scan_risks(processed, date(2026, 1, 9), date(2026, 1, 9)).collect()
+    assert day_before["item_id"].to_list() == ["b"]
+    assert {os.path.basename(os.path.dirname(f)) for f in scanned} == {"event_date=2026-01-09"}
+
+    # A late re-score of the old version does not resurrect it
+    sentinel_store.append_risks(scored([("a", date(2026, 1, 9), "ABBOTT", 5)],
+                                       datetime(2026, 1, 10, 7)), processed)
+    day_before = sentinel_store.scan_risks(processed, date(2026, 1, 9), date(2026, 1, 9)).collect()
+    assert day_before["item_id"].to_list() == ["b"]
+
+    sentinel_store.compact_risks(processed)
+    day_before = sentinel_store.scan_risks(processed, date(2026, 1, 9), date(2026, 1, 9)).collect()
+    assert day_before["item_id"].to_list() == ["b"]
+    after = sentinel_store.scan_risks(processed).collect()
+    assert after.sort("item_id").equals(everything.sort("item_id"))
+    print("   ✅ PASS: A moved item is only read from its current partition.")
+
+
+def test_first_append_migrates_legacy_file(tmp_path):
+    processed = str(tmp_path)
+    legacy = scored([("old", date(2025, 6, 1), "BAXTER", 7)], datetime(2025, 6, 1, 8)).drop("item_id")
+    legacy.write_parquet(os.path.join(processed, sentinel_store.LEGACY_RISK_FILE))
+    assert sentinel_store.scan_risks(processed).collect().height == 1
+
+    # The first append creates the store; the legacy history must move with it
+    sentinel_store.append_risks(scored([("new", date(2026, 1, 10), "TEVA", 3)],
+                                       datetime(2026, 1, 10, 8)), processed)
+    risks = sentinel_store.scan_risks(processed).collect()
+    assert sorted(risks["manufacturer"].to_list()) == ["BAXTER", "TEVA"]
+
+    # Later appends don't migrate it again
+    sentinel_store.append_risks(scored([("new2", date(2026, 1, 11), "TEVA", 2)],
+                                       datetime(2026, 1, 11, 8)), processed)
+    assert sentinel_store.scan_risks(processed).collect().height == 3
+    print("   ✅ PASS: Legacy risks are migrated by the first append.")
+
+
+def test_source_survives_append_and_scan(tmp_path):
+    processed = str(tmp_path)
+    # A file written before the store kept the feed source
+    old_partition = os.path.join(processed, sentinel_store.STORE_DIR, "event_date=2026-01-09")
+    os.makedirs(old_partition)
+    scored([("old", date(2026, 1, 9), "BAXTER", 4)], datetime(2026, 1, 9, 8)).write_parquet(
+        os.path.join(old_partition, "part-old.parquet"))
+
+    events = scored([("a", date(2026, 1, 10), "ABBOTT", 6),
+                     ("b", date(2026, 1, 10), "PFIZER", 9)], datetime(2026, 1, 10, 8))
+    sentinel_store.append_risks(
+        events.with_columns(pl.Series("source", ["recalls", "warning_letters"])), processed)
+
+    risks = sentinel_store.scan_risks(processed).collect()
+    assert dict(zip(risks["item_id"], risks["source"])) == {
+        "old": None, "a": "recalls", "b": "warning_letters"}
+    print("   ✅ PASS: The feed source is persisted with every event.")
+
+
+def test_store_without_item_index_is_indexed_on_next_append(tmp_path):
+    processed = str(tmp_path)
+    # Written before the item index existed: item "a" moved from Jan 9 to Jan 10
+    for day, severity, hour in [(date(2026, 1, 9), 6, 8), (date(2026, 1, 10), 7, 9)]:
+        partition = os.path.join(processed, sentinel_store.STORE_DIR, f"event_date={day.isoformat()}")
+        os.makedirs(partition)
+        scored([("a", day, "ABBOTT", severity)], datetime(2026, 1, 10, hour)).write_parquet(
+            os.path.join(partition, "part-old.parquet"))
+
+    sentinel_store.append_risks(scored([("b", date(2026, 1, 9), "PFIZER", 9)],
+                                       datetime(2026, 1, 10, 10)), processed)
+    day_before = sentinel_store.scan_risks(processed, date(2026, 1, 9), date(2026, 1, 9)).collect()
+    assert day_before["item_id"].to_list() == ["b"]
+    assert sentinel_store.scan_risks(processed).collect()["severity_score"].to_list() == [9, 7]
+    print("   ✅ PASS: Existing stores are indexed and their moved items tombstoned.")
+
+
+def test_append_after_compaction_lands_next_to_compacted_file(tmp_path):
+    processed = str(tmp_path)
+    sentinel_store.append_risks(scored([("a", date(2026, 1, 9), "ABBOTT", 6),
+                                        ("b", date(2026, 1, 9), "PFIZER", 9)],
+                                       datetime(2026, 1, 10, 8)), processed)
+    sentinel_store.append_risks(scored([("c", date(2026, 1, 9), "TEVA", 3)],
+                                       datetime(2026, 1, 10, 9)), processed)
+    sentinel_store.compact_risks(processed)
+
+    # The watchdog re-scores "a" and finds a new item for the same, already compacted, day
+    sentinel_store.append_risks(scored([("a", date(2026, 1, 9), "ABBOTT", 8),
+                                        ("d", date(2026, 1, 9), "SANDOZ", 4)],
+                                       datetime(2026, 1, 10, 10)), processed)
+    partition = os.path.join(processed, sentinel_store.STORE_DIR, "event_date=2026-01-09")
+    assert sentinel_store.COMPACTED_FILE in os.listdir(partition)
+    assert len(os.listdir(partition)) == 2
+    expected = {"a": 8, "b": 9, "c": 3, "d": 4}
+    risks = sentinel_store.scan_risks(processed).collect()
+    assert dict(zip(risks["item_id"], risks["severity_score"])) == expected
+
+    sentinel_store.compact_risks(processed)
+    assert os.listdir(partition) == [sentinel_store.COMPACTED_FILE]
+    risks = sentinel_store.scan_risks(processed).collect()
+    assert dict(zip(risks["item_id"], risks["severity_score"])) == expected
+    print("   ✅ PASS: Appends to compacted partitions are kept and merged next time.")